@@ -1,19 +1,38 @@
 from os.path import dirname
+from collections import Counter, deque
+from functools import partial
 import os
 import hashlib
 import asyncio
+import mmap
+import threading
+import time
+
+from dupidup.grouping import digest_groups, inode_groups
+from dupidup.filewalk import root_of
+from dupidup.checkpoint import CheckpointWriter, discard, recover
 
 
 class DupItemRow:
 
-    def __init__(self, files, size, hash_value):
+    def __init__(self, files, size, hash_value, num_inodes=None):
         self.files = files
         self.size = size
         self.hash_value = hash_value
+        self.num_inodes = num_inodes
 
     def get_num_files(self):
         return sum([len(a) for a in self.files])
 
+    def get_num_inodes(self):
+        '''
+        Number of distinct copies of the content, hardlinks to the same inode are one copy
+        '''
+        return self.get_num_files() if self.num_inodes is None else self.num_inodes
+
+    def get_reclaimable_bytes(self):
+        return self.size * (self.get_num_inodes() - 1)
+
     def get_boxrow_height(self):
         return max(len(file_list) for file_list in self.files)
 
@@ -36,12 +55,12 @@ def _get_dirs(path_list):
     return tuple(dir_list)
 
 
-def _get_row(dirs, path_list, hash_value, size):
+def _get_row(dirs, path_list, hash_value, size, num_inodes=None):
     files = {dir1: [] for dir1 in dirs}
     for path in path_list:
         pdir, pfile = os.path.split(path)
         files[pdir].append(pfile)
-    return DupItemRow([ files[pdir] for pdir in dirs], size, hash_value)
+    return DupItemRow([ files[pdir] for pdir in dirs], size, hash_value, num_inodes)
 
 
 class DupItem:
@@ -53,172 +72,583 @@ class DupItem:
     def get_box_height(self):
         return sum(row.get_boxrow_height() for row in self.rows)
 
-    def append(self, path_list, hash_value, size):
+    def append(self, path_list, hash_value, size, num_inodes=None):
         if self.dirs == _get_dirs(path_list):
-            self.rows.append(_get_row(self.dirs, path_list, hash_value, size))
+            self.rows.append(_get_row(self.dirs, path_list, hash_value, size, num_inodes))
             return True
         else:
             return False
 
     @staticmethod
-    def create(path_list, hash_value, size):
+    def create(path_list, hash_value, size, num_inodes=None):
         dirs = _get_dirs(path_list)
-        return DupItem(dirs, [_get_row(dirs, path_list, hash_value, size)])
+        return DupItem(dirs, [_get_row(dirs, path_list, hash_value, size, num_inodes)])
 
 
-def shifts(lst):
-    return [ lst[i:] + lst[:i] for i in range(len(lst)) ]
+def rotate_to_min(path_list):
+    '''
+    Rotation of the path list that starts with its smallest path
+    '''
+    i = path_list.index(min(path_list))
+    return path_list[i:] + path_list[:i]
 
 
-def is_ignored(path, ignored_prefixes):
-    for ignored_prefix in ignored_prefixes:
-        if path.startswith(ignored_prefix):
-            return True
-    return False
+def remove_ignored(path_list, ignore_rules, roots=()):
+    return [ path for path in path_list if not ignore_rules.is_ignored(path, root_of(path, roots))]
+
+
+READ_BLOCK_SIZE = 1024 * 1024
+# files at least this large are hashed through mmap, 0 means never
+MMAP_THRESHOLD = 0
 
+_thread_buffers = threading.local()
 
-def remove_ignored(path_list, ignored_prefixes):
-    return [ path for path in path_list if not is_ignored(path, ignored_prefixes)]
 
+def _read_buffer(block_size):
+    '''
+    Read buffer of the calling thread, allocated once and reused for every hashed file
+    '''
+    buffer = getattr(_thread_buffers, "buffer", None)
+    if buffer is None or len(buffer) != block_size:
+        buffer = memoryview(bytearray(block_size))
+        _thread_buffers.buffer = buffer
+    return buffer
 
-def _hash_bytestr_iter(bytesiter, hasher):
-    for block in bytesiter:
-        hasher.update(block)
+
+def _fadvise(fd, advice_name):
+    # hashed files are read once, the advice keeps them from evicting the rest of the page cache
+    advice = getattr(os, advice_name, None)
+    if advice is not None:
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+
+class HashTiming:
+    '''
+    Seconds spent reading files and updating hashers, summed over the workers. Files hashed through mmap
+    are read by page faults while hashing, their reading counts as hashing.
+    '''
+
+    def __init__(self, io_time=0.0, hash_time=0.0):
+        self.io_time = io_time
+        self.hash_time = hash_time
+
+    def add(self, io_time, hash_time):
+        self.io_time += io_time
+        self.hash_time += hash_time
+
+
+def _hash_file(f, hasher, block_size, mmap_threshold, timing=None):
+    timing = HashTiming() if timing is None else timing
+    fd = f.fileno()
+    size = os.fstat(fd).st_size
+    if mmap_threshold > 0 and size >= mmap_threshold:
+        start = time.perf_counter()
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, "madvise"):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(m)
+            try:
+                for offset in range(0, size, block_size):
+                    hasher.update(view[offset:offset + block_size])
+            finally:
+                view.release()
+        timing.add(0.0, time.perf_counter() - start)
+    else:
+        buffer = _read_buffer(block_size)
+        io_time, hash_time = 0.0, 0.0
+        start = time.perf_counter()
+        n = f.readinto(buffer)
+        read = time.perf_counter()
+        io_time += read - start
+        while n > 0:
+            hasher.update(buffer[:n])
+            hashed = time.perf_counter()
+            hash_time += hashed - read
+            n = f.readinto(buffer)
+            read = time.perf_counter()
+            io_time += read - hashed
+        timing.add(io_time, hash_time)
+
+
+# all algorithms produce 128-bit digests
+HASH_ALGORITHMS = {
+    "md5": hashlib.md5,
+    "blake2b": partial(hashlib.blake2b, digest_size=16)
+}
+
+try:
+    import xxhash
+    HASH_ALGORITHMS["xxh128"] = xxhash.xxh3_128
+except ImportError:
+    pass
+
+DEFAULT_HASH_ALGORITHM = "md5"
+
+
+def new_hasher(algorithm=DEFAULT_HASH_ALGORITHM):
+    hasher_factory = HASH_ALGORITHMS.get(algorithm)
+    if hasher_factory is None:
+        raise Exception(f"Unsupported hash algorithm {algorithm}, available: {', '.join(HASH_ALGORITHMS)}")
+    return hasher_factory()
+
+
+def get_empty_hash(algorithm=DEFAULT_HASH_ALGORITHM):
+    '''
+    Digest of empty content, which is also the head and tail digest of a zero-length file
+    '''
+    return new_hasher(algorithm).hexdigest()
+
+
+def get_hash(path, algorithm=DEFAULT_HASH_ALGORITHM, block_size=READ_BLOCK_SIZE, mmap_threshold=MMAP_THRESHOLD, timing=None):
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb', buffering=0) as f:
+        _fadvise(f.fileno(), "POSIX_FADV_SEQUENTIAL")
+        try:
+            _hash_file(f, hasher, block_size, mmap_threshold, timing)
+        finally:
+            _fadvise(f.fileno(), "POSIX_FADV_DONTNEED")
     return hasher.hexdigest()
 
 
-def _file_as_blockiter(afile, blocksize=1024 * 1024):
-    with afile:
-        block = afile.read(blocksize)
-        while len(block) > 0:
-            yield block
-            block = afile.read(blocksize)
+HEAD_BLOCK_SIZE = 4096
 
 
-def get_hash(path):
-    return _hash_bytestr_iter(_file_as_blockiter(open(path, 'rb')), hashlib.md5())
+def _hash_block(f, block_size, algorithm, timing):
+    start = time.perf_counter()
+    block = f.read(block_size)
+    read = time.perf_counter()
+    hasher = new_hasher(algorithm)
+    hasher.update(block)
+    if timing is not None:
+        timing.add(read - start, time.perf_counter() - read)
+    return hasher.hexdigest()
 
 
-class FileHashProcessor:
+def get_head_hash(path, block_size=HEAD_BLOCK_SIZE, algorithm=DEFAULT_HASH_ALGORITHM, timing=None):
+    with open(path, 'rb') as f:
+        return _hash_block(f, block_size, algorithm, timing)
 
-    def __init__(self, file_walk, sizes, hash_file, callback, log):
+
+def get_tail_hash(path, block_size=HEAD_BLOCK_SIZE, algorithm=DEFAULT_HASH_ALGORITHM, timing=None):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - block_size))
+        return _hash_block(f, block_size, algorithm, timing)
+
+
+def timed_hash(hash_function, path):
+    '''
+    (digest, seconds reading, seconds hashing) of the file. Runs in the executor, the timing
+    is returned rather than shared, so that it works in a process pool too.
+    '''
+    timing = HashTiming()
+    digest = hash_function(path, timing=timing)
+    return digest, timing.io_time, timing.hash_time
+
+
+def get_inodes(stats):
+    '''
+    (device, inode) of each file, None where the stat record doesn't have it
+    '''
+    if stats is None:
+        return None
+    return [None if stat_record.dev is None else (stat_record.dev, stat_record.ino) for stat_record in stats]
+
+
+def _shared(idxs, key_of, inodes):
+    '''
+    Indexes whose key is shared by files of at least two different inodes. Files without known inode
+    are counted as separate inodes.
+    '''
+    inodes_by_key = Counter()
+    seen = set()
+    for i in idxs:
+        inode = i if inodes is None or inodes[i] is None else inodes[i]
+        key = key_of(i)
+        if (key, inode) not in seen:
+            seen.add((key, inode))
+            inodes_by_key[key] += 1
+    return [i for i in idxs if inodes_by_key[key_of(i)] > 1]
+
+
+def in_size_range(size, min_size=0, max_size=None):
+    return size >= min_size and (max_size is None or size <= max_size)
+
+
+def get_candidates(sizes, inodes=None, min_size=0, max_size=None):
+    '''
+    Indexes of files within the size range that share their size with at least one other file.
+    Only these can have a duplicate. Hardlinks to the same inode are not duplicates of each other.
+    '''
+    idxs = [i for i in range(len(sizes)) if in_size_range(sizes[i], min_size, max_size)]
+    return _shared(idxs, lambda i: sizes[i], inodes)
+
+
+def get_collisions(candidates, sizes, digests, inodes=None):
+    '''
+    Candidates that share both size and digest with at least one other candidate
+    '''
+    return _shared(candidates, lambda i: (sizes[i], digests[i]), inodes)
+
+
+class HashStage:
+    '''
+    One hashing pass over the candidate files. Partial stages hash only a block of block_size bytes
+    of each file, the full stage (block_size None) hashes the whole content.
+    '''
+
+    def __init__(self, name, hash_file, hash_function, block_size=None, kind=None):
+        self.name = name
+        self.hash_file = hash_file
+        self.hash_function = hash_function
+        self.block_size = block_size
+        self.kind = name if kind is None else kind
+
+    def is_partial(self):
+        return self.block_size is not None
+
+    def hashed_bytes(self, size):
+        return size if self.block_size is None else min(size, self.block_size)
+
+    def covers(self, size):
+        return self.block_size is not None and size <= self.block_size
+
+
+def hash_stage_files(hash_file):
+    '''
+    Hash files of the head, tail and full stage, the full stage uses the given hash file
+    '''
+    base, ext = os.path.splitext(hash_file)
+    return f"{base}_head{ext}", f"{base}_tail{ext}", hash_file
+
+
+def create_hash_stages(hash_file, head_size=HEAD_BLOCK_SIZE, tail_size=0, algorithm=DEFAULT_HASH_ALGORITHM,
+                       block_size=READ_BLOCK_SIZE, mmap_threshold=MMAP_THRESHOLD):
+    head_file, tail_file, _ = hash_stage_files(hash_file)
+    stages = []
+    if head_size > 0:
+        stages.append(HashStage("head", head_file, partial(get_head_hash, block_size=head_size, algorithm=algorithm), head_size,
+                                f"{algorithm}:head:{head_size}"))
+    if tail_size > 0:
+        stages.append(HashStage("tail", tail_file, partial(get_tail_hash, block_size=tail_size, algorithm=algorithm), tail_size,
+                                f"{algorithm}:tail:{tail_size}"))
+    stages.append(HashStage("full", hash_file, partial(get_hash, algorithm=algorithm, block_size=block_size,
+                                                       mmap_threshold=mmap_threshold), kind=algorithm))
+    return stages
+
+
+
+def _header_kind(line):
+    if line.startswith("#"):
+        return line[1:].strip()
+    elif line:
+        # files without the algorithm header were created before hashing was pluggable
+        return "md5"
+    return None
+
+
+def read_hash_kind(hash_file):
+    '''
+    Kind of the hashes from the hash file header, None if the file is empty
+    '''
+    with open(hash_file, "r") as f:
+        return _header_kind(f.readline())
+
+
+def kind_algorithm(kind):
+    return kind.split(":")[0]
+
+
+async def load_hashes(hash_file, digests, kind):
+    '''
+    Reads hashes from the hash file into digests list indexed by walk index,
+    returns the indexes in the order in which they were saved. The kind of the hashes is the algorithm
+    for full hashes, partial hashes have also the stage and block size (see HashStage.kind).
+    '''
+    finished = []
+    with open(hash_file, "r") as f:
+        line = f.readline()
+        file_kind = _header_kind(line)
+        if line.startswith("#"):
+            line = f.readline()
+        elif file_kind is None:
+            file_kind = kind
+        if file_kind != kind:
+            raise Exception(f"Hash file {hash_file} was computed with {file_kind}, not {kind}")
+        while line:
+            fields = line.split()
+            if len(fields) == 1:
+                # legacy format: one hash per line for every file of the walk
+                i, digest = len(finished), fields[0]
+            else:
+                i, digest = int(fields[0]), fields[1]
+            digests[i] = digest
+            finished.append(i)
+            line = f.readline()
+            if len(finished) % 1000 == 0:
+                await asyncio.sleep(0)
+    return finished
+
+
+async def save_hashes(hash_file, digests, kind):
+    with CheckpointWriter(hash_file, header=f"#{kind}", truncate=True) as w:
+        for i, digest in enumerate(digests):
+            if digest is not None:
+                w.write(f"{i} {digest}")
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+
+
+MAX_PENDING_HASHES = 64
+
+
+class FileHashProcessor:
+    '''
+    Hashes the files in stages, each stage only hashes files that still collide with another file
+    in size and digest of the previous stage. Each stage is saved to its own hash file, so that a resumed
+    run skips the stages that were already finished.
+    Hashes are computed by the given executor (loop's default one if None) with at most max_pending
+    files in flight, full hashes read files in blocks of block_size, files from mmap_threshold up through mmap.
+    With hash_cache and stat records of the files, cached digests are used without reading files.
+    With stat records, hardlinks to the same inode are hashed once and don't count as duplicates of each other.
+    Only files of size between min_size and max_size (unlimited if None) are hashed, zero-length files
+    get the empty digest without being opened.
+    '''
+
+    def __init__(self, file_walk, sizes, hash_file, callback, log, hash_all=False, head_size=HEAD_BLOCK_SIZE, tail_size=0,
+                 executor=None, max_pending=MAX_PENDING_HASHES, algorithm=DEFAULT_HASH_ALGORITHM, stats=None, hash_cache=None,
+                 block_size=READ_BLOCK_SIZE, mmap_threshold=MMAP_THRESHOLD, min_size=0, max_size=None):
         self._file_walk = file_walk
         self._sizes = sizes
-        self._hash_file = hash_file
+        self._stats = stats
+        self._inodes = get_inodes(stats)
+        self._hash_cache = hash_cache if stats is not None else None
         self._callback = callback
         self._log = log
+        self._hash_all = hash_all
+        self._executor = executor
+        self._max_pending = max_pending
+        self._algorithm = algorithm
+        self._empty_hash = get_empty_hash(algorithm)
+        self._min_size = min_size
+        self._max_size = max_size
+        if hash_all:
+            self._stages = create_hash_stages(hash_file, 0, 0, algorithm, block_size, mmap_threshold)
+        else:
+            self._stages = create_hash_stages(hash_file, head_size, tail_size, algorithm, block_size, mmap_threshold)
 
-    async def _read_file(self):
-        hashes = []
-        with open(self._hash_file, "r") as f:
-            line = f.readline()
-            while line:
-                hashes.append(line.strip())
-                line = f.readline()
-                await asyncio.sleep(0)
-        return hashes
-
-    def _check_last(self, hashes, n):
-        finished = len(hashes)
-        for i in range(finished - n, finished):
+    def _check_last(self, stage, digests, finished, n):
+        for i in finished[-n:]:
             file_i = self._file_walk[i]
-            hash_i = get_hash(file_i)
-            if hash_i != hashes[i]:
-                raise Exception(f"File {file_i} hash is {hash_i}, not {hashes[i]}")
+            digest_i = stage.hash_function(file_i)
+            if digest_i != digests[i]:
+                raise Exception(f"File {file_i} {stage.name} hash is {digest_i}, not {digests[i]}")
+
+    async def _process_stage(self, stage, candidates, covering_digests):
+        digests = [None] * len(self._file_walk)
+        if os.path.exists(stage.hash_file) and stage.is_partial():
+            kind = read_hash_kind(stage.hash_file)
+            if kind is not None and kind != stage.kind and kind_algorithm(kind) == self._algorithm:
+                # partial hashes of another block size are useless, the stage starts over
+                self._log.debug(f"Discarding {stage.hash_file} with {kind} hashes, not {stage.kind}")
+                discard(stage.hash_file)
+        if os.path.exists(stage.hash_file):
+            torn_bytes = recover(stage.hash_file)
+            if torn_bytes > 0:
+                self._log.debug(f"Truncated {torn_bytes} bytes after the last checkpoint of {stage.hash_file}")
+            loaded = [None] * len(self._file_walk)
+            finished = await load_hashes(stage.hash_file, loaded, stage.kind)
+            self._check_last(stage, loaded, finished, 3)
+            # the stage file may have been written with another size range
+            for i in candidates:
+                digests[i] = loaded[i]
+
+        for i in candidates:
+            if digests[i] is None and covering_digests[i] is not None:
+                # whole content was already hashed by a previous partial stage
+                digests[i] = covering_digests[i]
+
+        remaining = [i for i in candidates if digests[i] is None]
+        total_files = len(candidates)
+        total_bytes = sum(stage.hashed_bytes(self._sizes[i]) for i in candidates)
+        file_count = total_files - len(remaining)
+        byte_count = total_bytes - sum(stage.hashed_bytes(self._sizes[i]) for i in remaining)
+        self._log.debug(f"Hashing stage {stage.name}: {total_files} of {len(self._file_walk)} files, {len(remaining)} remaining")
+        self._timing = HashTiming()
+        await self._callback.on_hashing_started(stage.name, total_files, total_bytes)
+
+        if len(remaining) > 0:
+            loop = asyncio.get_running_loop()
+            pending = deque()
+            # only inodes with several links among the remaining files share a future, until the last link is collected
+            links_left = {}
+            if self._inodes is not None:
+                links_left = Counter(self._inodes[i] for i in remaining if self._inodes[i] is not None)
+                links_left = {inode: count for inode, count in links_left.items() if count > 1}
+            futures_by_inode = {}
+            try:
+                with CheckpointWriter(stage.hash_file, header=f"#{stage.kind}") as w:
+                    # hashes are computed in the executor but collected in submission order,
+                    # so that the hash file grows in the same order as the file walk
+                    submitted = 0
+                    while submitted < len(remaining) or len(pending) > 0:
+                        while submitted < len(remaining) and len(pending) < self._max_pending:
+                            i = remaining[submitted]
+                            inode = None if self._inodes is None else self._inodes[i]
+                            future = futures_by_inode.get(inode) if inode in links_left else None
+                            if future is None:
+                                future = self._submit(loop, stage, i)
+                                if inode in links_left:
+                                    futures_by_inode[inode] = future
+                                pending.append((i, future, True))
+                            else:
+                                # another link to an inode that is already being hashed
+                                pending.append((i, future, False))
+                            submitted += 1
+                        i, future, first_link = pending.popleft()
+                        digests[i], cached = await future
+                        inode = None if self._inodes is None else self._inodes[i]
+                        if inode in links_left:
+                            links_left[inode] -= 1
+                            if links_left[inode] == 0:
+                                del links_left[inode]
+                                del futures_by_inode[inode]
+                        if self._hash_cache is not None and first_link and not cached:
+                            self._hash_cache.put(self._stats[i], stage.kind, digests[i])
+                        w.write(f"{i} {digests[i]}")
+                        byte_count += stage.hashed_bytes(self._sizes[i])
+                        file_count += 1
+                        await self._callback.on_hashing_progress(file_count, byte_count, self._timing)
+                        if file_count % 1000 == 0:
+                            # cached and empty digests come as finished futures, awaiting them doesn't yield
+                            await asyncio.sleep(0)
+            finally:
+                for _, future, _ in pending:
+                    future.cancel()
+                if self._hash_cache is not None:
+                    self._hash_cache.commit()
+        return digests
+
+    def _submit(self, loop, stage, i):
+        '''
+        Future of (digest, cached) of the i-th file, cached digests weren't read from the file
+        '''
+        digest = None
+        if self._sizes[i] == 0:
+            digest = self._empty_hash
+        elif self._hash_cache is not None:
+            digest = self._hash_cache.get(self._stats[i], stage.kind)
+        if digest is not None:
+            future = loop.create_future()
+            future.set_result((digest, True))
+            return future
+        return asyncio.ensure_future(self._hash(loop, stage, i))
+
+    async def _hash(self, loop, stage, i):
+        digest, io_time, hash_time = await loop.run_in_executor(self._executor, timed_hash, stage.hash_function, self._file_walk[i])
+        self._timing.add(io_time, hash_time)
+        return digest, False
 
     async def process(self):
         try:
-            hashes = []
-            if os.path.exists(self._hash_file):
-                hashes = await self._read_file()
-                self._check_last(hashes, 3)
-
-            total_files = len(self._file_walk)
-            file_count = len(hashes)
-            byte_count = sum(self._sizes[:file_count])
-
-            if file_count < total_files:
-                with open(self._hash_file, "a+") as f:
-                    for file_path in self._file_walk.tail(file_count):
-                        hashval = get_hash(file_path)
-                        hashes.append(hashval)
-                        f.write(hashval)
-                        f.write("\n")
-                        f.flush()
-                        byte_count += self._sizes[file_count]
-                        file_count += 1
-                        await self._callback.on_hashing_progress(file_count, byte_count)
-                        await asyncio.sleep(0)
-
-            await self._callback.on_hashing_finished(hashes)
+            if self._hash_all:
+                candidates = [i for i in range(len(self._file_walk))
+                              if in_size_range(self._sizes[i], self._min_size, self._max_size)]
+            else:
+                candidates = get_candidates(self._sizes, self._inodes, self._min_size, self._max_size)
+            covering_digests = [None] * len(self._file_walk)
+            for stage in self._stages:
+                digests = await self._process_stage(stage, candidates, covering_digests)
+                if stage.is_partial():
+                    for i in candidates:
+                        if stage.covers(self._sizes[i]):
+                            covering_digests[i] = digests[i]
+                    candidates = get_collisions(candidates, self._sizes, digests, self._inodes)
+
+            await self._callback.on_hashing_finished(digests)
         except Exception as e:
             await self._callback.on_task_error("hashing", e)
 
 
 class DuplicateAnalysis:
+    '''
+    Duplicate items and, separately, groups of paths that are hardlinks to the same inode
+    '''
 
-    def __init__(self, items):
+    def __init__(self, items, hardlinks=None):
         self.items = items
+        self.hardlinks = [] if hardlinks is None else hardlinks
 
     def get_duplicated_bytes(self):
+        '''
+        Bytes that removing the duplicates would free, hardlinks to the same inode don't take extra space
+        '''
         duplicated_bytes = 0
         for item in self.items:
             for row in item.rows:
-                duplicated_bytes += row.size * (row.get_num_files() - 1)
+                duplicated_bytes += row.get_reclaimable_bytes()
         return duplicated_bytes
 
     def max_columns(self):
         return max(len(item.dirs) for item in self.items)
 
     @staticmethod
-    async def create(hashes, file_walk, sizes, ignored_folders, callback):
+    async def create(hashes, file_walk, sizes, ignore_rules, callback, stats=None, min_size=0, max_size=None):
+        '''
+        Groups the hashed files into duplicate items. Files matching ignore_rules or out of the min_size, max_size
+        range are left out also here, the hashes of a resumed session may have been computed with other options.
+        '''
         if len(hashes) != len(file_walk) or len(hashes) != len(sizes):
             raise Exception("Integrity error: number of hashes must be equal to number of files and number of file sizes")
-        paths_by_hash = {}
-        dups_size_by_hash = {}
-
-        for i, path, hashval, size in zip(range(len(sizes)), file_walk, hashes, sizes):
-            if hashval in paths_by_hash:
-                prevsize = dups_size_by_hash.get(hashval)
-                if prevsize == None:
-                    dups_size_by_hash[hashval] = size
-                else:
-                    if size != prevsize:
-                        raise Exception(f"Hash collision: file {path} size {size} has same hash {hashval} as files {repr(paths_by_hash[hashval])} size {prevsize}")
-                paths_by_hash[hashval].append(path)
-            else:
-                paths_by_hash[hashval] = [path]
-            if i % 1000 == 0:
-                await callback.on_analysis_progress(i)
-                await asyncio.sleep(0)
 
-        # filter ignored folders
+        # names are matched only below the root each file was walked from
+        roots = file_walk.roots()
+
+        def inode(i):
+            # files without known inode count as separate inodes
+            return i if stats is None or stats[i].dev is None else (stats[i].dev, stats[i].ino)
+
         duplists = []
-        i = 0
-        for duphash, size in dups_size_by_hash.items():
-            dup_paths = paths_by_hash[duphash]
-            non_ignored_paths = remove_ignored(dup_paths, ignored_folders)
-            if len(non_ignored_paths) > 1:
-                for dupshift in shifts(non_ignored_paths):
-                    duplists.append((dupshift, duphash, size))
-            i += 1
-            if i % 1000 == 0:
+        for n, group in enumerate(await digest_groups(hashes, callback)):
+            if n % 1000 == 0:
                 await asyncio.sleep(0)
+            duphash = hashes[group[0]]
+            size = sizes[group[0]]
+            if not in_size_range(size, min_size, max_size):
+                continue
+            non_ignored = []
+            for i in group:
+                path = file_walk[i]
+                if sizes[i] != size:
+                    raise Exception(f"Hash collision: file {path} size {sizes[i]} has same hash {duphash} as file {file_walk[group[0]]} size {size}")
+                if not ignore_rules.is_ignored(path, root_of(path, roots)):
+                    non_ignored.append((path, inode(i)))
+            num_inodes = len(set(file_inode for _, file_inode in non_ignored))
+            if num_inodes > 1:
+                duplists.append((rotate_to_min([path for path, _ in non_ignored]), duphash, size, num_inodes))
 
         await asyncio.sleep(0)
         duplists.sort(key=lambda l: l[0][0])
         await asyncio.sleep(0)
 
-        used_hashes = set()
+        # groups ordered by their smallest path, each group once
         finlist = []
         prev_item = None
 
-        for path_list, hash_value, size in duplists:
-            if not hash_value in used_hashes:
-                if prev_item == None or not prev_item.append(path_list, hash_value, size):
-                    prev_item = DupItem.create(path_list, hash_value, size)
-                    finlist.append(prev_item)
-                used_hashes.add(hash_value)
+        for path_list, hash_value, size, num_inodes in duplists:
+            if prev_item == None or not prev_item.append(path_list, hash_value, size, num_inodes):
+                prev_item = DupItem.create(path_list, hash_value, size, num_inodes)
+                finlist.append(prev_item)
         await asyncio.sleep(0)
 
-        await callback.on_analysis_finished(DuplicateAnalysis(finlist))
+        hardlinks = []
+        for group in await inode_groups(stats):
+            non_ignored_links = remove_ignored([file_walk[i] for i in group], ignore_rules, roots)
+            if len(non_ignored_links) > 1:
+                hardlinks.append(sorted(non_ignored_links))
+        hardlinks.sort()
+
+        await callback.on_analysis_finished(DuplicateAnalysis(finlist, hardlinks))
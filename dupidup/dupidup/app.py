@@ -1,24 +1,9 @@
-from concurrent import futures
-import os
-
-from dupidup.analysis import  DuplicateAnalysis, FileHashProcessor
-from dupidup.filewalk import FileWalkProcessor, FileSizeProcessor
-from magicur.app import MagicApplication, callback
+from magicur.app import MagicApplication, callback, progress_callback
 from dupidup.view import RootView
+from dupidup.processing import DupidupProcessing, PHASE_STREAMING
 
 
-class DupidupApplication(MagicApplication):
-
-    def __init__(self, temp_datadir, root_folders, ignored_folders):
-        self._temp_datadir = temp_datadir
-        self._root_folders = [os.path.abspath(f) for f in root_folders]
-        self._ignored_folders = ignored_folders
-        if not os.path.exists(self._temp_datadir):
-            os.makedirs(self._temp_datadir, exist_ok=False)
-        self._walk_file = os.path.join(self._temp_datadir, "file_walk.txt")
-        self._size_file = os.path.join(self._temp_datadir, "sizes.txt")
-        self._hash_file = os.path.join(self._temp_datadir, "hashes.txt")
-        self._executor = futures.ThreadPoolExecutor(max_workers=4)
+class DupidupApplication(MagicApplication, DupidupProcessing):
 
     def init_palette(self, palette):
         palette.add_default_colors()
@@ -37,10 +22,28 @@ class DupidupApplication(MagicApplication):
         self._view.resize(new_width, new_height)
 
     def on_start(self):
-        self._view.show_scanning()
-        self.schedule_async(FileWalkProcessor(self._root_folders, self._walk_file, self, self._log).process())
+        phase, processor = self._first_phase()
+        if phase == PHASE_STREAMING:
+            self._view.show_streaming()
+        else:
+            self._view.show_scanning()
+        self.schedule_async(processor)
+
+    @progress_callback
+    def on_streaming_progress(self, folder_count, file_count, hashed_count, hashed_bytes, duplicate_count, timing):
+        self._view.update_streaming(folder_count, file_count, hashed_count, hashed_bytes, duplicate_count, timing)
+
+    @callback
+    def on_streaming_finished(self, file_walk, stats, hashes):
+        self._set_walk(file_walk, stats)
+        self._start_analysis(hashes)
 
     @callback
+    def on_session_loaded(self, file_walk, stats, hashes):
+        self._set_walk(file_walk, stats, stats.sizes)
+        self._start_analysis(hashes)
+
+    @progress_callback
     def on_filewalk_progress(self, folder_count, file_count):
         self._view.update_scanning(folder_count, file_count)
 
@@ -53,40 +56,74 @@ class DupidupApplication(MagicApplication):
         self._view.show_saving(walk_file)
 
     @callback
-    def on_filewalk_finished(self, file_walk):
-        self._file_walk = file_walk
-        self._total_files = len(file_walk)
+    def on_filewalk_finished(self, file_walk, stats=None):
+        self._set_walk(file_walk)
         self._view.show_size_counting(file_walk.folder_count(), self._total_files)
-        self.schedule_async(FileSizeProcessor(file_walk, self._size_file, self, self._log).process())
+        self.schedule_async(self._size_processor(stats))
 
-    @callback
+    @progress_callback
     def on_filesize_progress(self, file_count, byte_count):
         self._view.update_size_counting(file_count, self._total_files, byte_count)
 
     @callback
-    def on_filesize_finished(self, sizes, byte_count):
-        self._sizes = sizes
+    def on_filesize_finished(self, stats, byte_count):
+        self._set_walk(self._file_walk, stats)
         self._total_bytes = byte_count
-        self._view.show_hashing(self._total_files, byte_count)
-        self.schedule_async(FileHashProcessor(self._file_walk, self._sizes, self._hash_file, self, self._log).process())
+        self.schedule_async(self._hash_processor())
 
     @callback
-    def on_hashing_progress(self, file_count, byte_count):
-        self._view.update_hashing(file_count, self._total_files, byte_count, self._total_bytes)
+    def on_hashing_started(self, stage, file_count, byte_count):
+        self._hash_total_files = file_count
+        self._hash_total_bytes = byte_count
+        self._view.show_hashing(stage, file_count, byte_count)
+
+    @progress_callback
+    def on_hashing_progress(self, file_count, byte_count, timing):
+        self._view.update_hashing(file_count, self._hash_total_files, byte_count, self._hash_total_bytes, timing)
 
     @callback
     def on_hashing_finished(self, hashes):
-        self._hashes = hashes
+        self._start_analysis(hashes)
+
+    def _start_analysis(self, hashes):
         self._view.show_analysing()
-        self.schedule_async(DuplicateAnalysis.create(hashes, self._file_walk, self._sizes, self._ignored_folders, self))
+        self.schedule_async(self._analysis_processor(hashes))
 
-    @callback
+    @progress_callback
     def on_analysis_progress(self, file_count):
         self._view.update_analysing(file_count, self._total_files)
 
     @callback
     def on_analysis_finished(self, analysis):
+        if self._verify:
+            self._view.show_verifying()
+            self.schedule_async(self._verification_processor(analysis))
+        else:
+            self._show_result(analysis)
+
+    @callback
+    def on_verification_started(self, file_count, byte_count):
+        self._verify_total_files = file_count
+        self._verify_total_bytes = byte_count
+        self._view.update_verifying(0, file_count, 0, byte_count)
+
+    @progress_callback
+    def on_verification_progress(self, file_count, byte_count):
+        self._view.update_verifying(file_count, self._verify_total_files, byte_count, self._verify_total_bytes)
+
+    @callback
+    def on_verification_finished(self, analysis, mismatches):
+        self._log.debug(f"Verification finished, {len(mismatches)} groups with differing files")
+        self._show_result(analysis)
+
+    def _show_result(self, analysis):
         self._view.show_browser(analysis)
+        if self._export_file is not None:
+            self.schedule_async(self._export_processor(analysis))
+
+    @callback
+    def on_export_finished(self, export_file, group_count):
+        self._log.debug(f"Exported {group_count} duplicate groups to {export_file}")
 
     def on_error(self, error, task=None):
         if task is None:
@@ -102,7 +139,7 @@ class DupidupApplication(MagicApplication):
         elif key == 410:
             self.resize()
         else:
-            pass
+            self._view.on_key(key)
 
     def on_termination(self):
-        self._executor.shutdown()
+        self._close()
@@ -1,26 +1,48 @@
+from bisect import bisect_left, bisect_right
+import curses
 from itertools import repeat
 
 
+def _put_clipped(window, x, y, text):
+    # put_text continues on the next line, which would overwrite a line that isn't redrawn
+    if x < window.width:
+        window.put_text(x, y, text[:window.width - x])
+
+
 class DuplicateBox:
+    '''
+    Lines of one duplicate item starting with box_offset (0 is the top border with folder names),
+    drawn from parent_offset down to end_offset, the bottom of the parent by default
+    '''
 
-    def __init__(self, parent, duplicate_item, columns_above, parent_offset, box_offset, box_width):
+    def __init__(self, parent, duplicate_item, columns_above, parent_offset, box_offset, box_width, end_offset=None):
         self._parent = parent
         self._duplicate_item = duplicate_item
         self._top_border = columns_above == 0
         cols = len(duplicate_item.dirs)
-        parent.put_text(0, parent_offset, self._border(box_width, cols, columns_above))
-        for i, dir1 in enumerate(duplicate_item.dirs):
-            parent.put_text(2 + i * (box_width + 1), parent_offset, self._limit_path(box_width - 2, dir1))
+        if end_offset is None:
+            end_offset = parent.height
+        line_offset = 0
+        if box_offset == 0:
+            _put_clipped(parent, 0, parent_offset, self._border(box_width, cols, columns_above))
+            for i, dir1 in enumerate(duplicate_item.dirs):
+                _put_clipped(parent, 2 + i * (box_width + 1), parent_offset, self._limit_path(box_width - 2, dir1))
+            line_offset = 1
         box_line_idx = 0
-        line_offset = 1
         for row in duplicate_item.rows:
+            row_height = row.get_boxrow_height()
+            if box_line_idx + row_height < box_offset:
+                # rows above the viewport are skipped without looking at their files
+                box_line_idx += row_height
+                continue
             for i in row.idx_range():
-                if box_line_idx >= box_offset and parent_offset + line_offset < parent.height:
+                if parent_offset + line_offset >= end_offset:
+                    return
+                if box_line_idx >= box_offset - 1:
                     line = row.get_line(i)
-                    parent.put_text(0, parent_offset + line_offset, self._line(box_width, cols))
+                    _put_clipped(parent, 0, parent_offset + line_offset, self._line(box_width, cols))
                     for j, file1 in enumerate(line):
-                        parent.put_text(2 + j * (box_width + 1), parent_offset + line_offset, self._limit_line_file(box_width - 2, file1))
-
+                        _put_clipped(parent, 2 + j * (box_width + 1), parent_offset + line_offset, self._limit_line_file(box_width - 2, file1))
                     line_offset += 1
                 box_line_idx += 1
 
@@ -53,33 +75,120 @@ class DuplicateBox:
         elif cols > cols_above:
             return "├" + "┼".join(repeat(line, cols_above)) + "┼" + "┬".join(repeat(line, cols - cols_above)) + "┐"
         else:
-            return "├" + "┼".join(repeat(line, cols_above)) + "┼" + "┴".join(repeat(line, cols_above - cols)) + "┘"
+            return "├" + "┼".join(repeat(line, cols)) + "┼" + "┴".join(repeat(line, cols_above - cols)) + "┘"
 
 
 class DuplicateBrowser(object):
     '''
-    Duplicate browser
+    Duplicate browser. The boxes are stacked in a virtual list of lines, box_tops is the cumulative index
+    of the line where each box starts, so only the boxes that intersect the viewport are drawn and the
+    first of them is found by bisection.
     '''
 
     def __init__(self, parent, analysis):
         self._parent = parent
         self._window = parent.sub_window(parent.width, parent.height - 1, 0, 0)
-        self._window.reset_to(" ", "white blue")
         self._analysis = analysis
-        self._window.put_text(0, 0, "duplicate browser")
-        self._boxes = []
-
-        parent_offset = 0
-        box_offset = 0
-        column_width = (parent.width - 4) // 2
-        columns_above = 0
+        self._column_width = (parent.width - 4) // 2
+        self._box_tops = []
+        top = 0
         for item in analysis.items:
-            box = DuplicateBox(self._window, item, columns_above, parent_offset, box_offset, column_width)
-            columns_above = len(item.dirs)
-            self._boxes.append(box)
-            parent_offset += box.get_height()
-        self._window.put_text(0, parent_offset, "└" + "┴".join(repeat("─"*column_width, columns_above)) + "┘")
+            self._box_tops.append(top)
+            top += item.get_box_height() + 1
+        # the bottom border follows the last box
+        self._total_height = top + 1
+        self._top = 0
+        self.render()
+
+    def get_total_height(self):
+        return self._total_height
+
+    def render(self):
+        '''
+        Draws the whole viewport starting at the virtual line self._top
+        '''
+        self._window.reset_to(" ", "white blue")
+        _put_clipped(self._window, 0, 0, "duplicate browser")
+        self.render_lines(0, self._window.height)
+
+    def render_lines(self, start, end):
+        '''
+        Draws the viewport lines from start to end, which must be blank
+        '''
+        window = self._window
+        items = self._analysis.items
+        first, last = self._top + start, self._top + end
+        k = max(0, bisect_right(self._box_tops, first) - 1)
+        while k < len(items) and self._box_tops[k] < last:
+            parent_offset = max(start, self._box_tops[k] - self._top)
+            box_offset = max(0, first - self._box_tops[k])
+            columns_above = len(items[k - 1].dirs) if k > 0 else 0
+            DuplicateBox(window, items[k], columns_above, parent_offset, box_offset, self._column_width, end)
+            k += 1
+        bottom = self._total_height - 1 - self._top
+        if start <= bottom < end:
+            columns_above = len(items[-1].dirs) if len(items) > 0 else 0
+            _put_clipped(window, 0, bottom, "└" + "┴".join(repeat("─"*self._column_width, columns_above)) + "┘")
+
+    def get_top(self):
+        return self._top
+
+    def scroll_to(self, top):
+        '''
+        Moves the viewport to start at the virtual line top. The lines still visible are moved by scrolling
+        the window and only the exposed lines are drawn. Returns False if the viewport didn't move.
+        '''
+        height = self._window.height
+        top = max(0, min(top, self._total_height - height))
+        delta = top - self._top
+        if delta == 0:
+            return False
+        self._top = top
+        if abs(delta) >= height:
+            self.render()
+        else:
+            self._window.scroll_lines(delta)
+            if delta > 0:
+                self.render_lines(height - delta, height)
+            else:
+                self.render_lines(0, -delta)
+        return True
+
+    def scroll(self, lines):
+        return self.scroll_to(self._top + lines)
+
+    def scroll_pages(self, pages):
+        return self.scroll(pages * max(1, self._window.height - 1))
+
+    def next_group(self):
+        k = bisect_right(self._box_tops, self._top)
+        return k < len(self._box_tops) and self.scroll_to(self._box_tops[k])
+
+    def previous_group(self):
+        k = bisect_left(self._box_tops, self._top) - 1
+        return k >= 0 and self.scroll_to(self._box_tops[k])
+
+    def on_key(self, key):
+        '''
+        Scrolls by a line, a page or a duplicate group, returns True if the viewport moved
+        '''
+        if key == curses.KEY_DOWN:
+            return self.scroll(1)
+        elif key == curses.KEY_UP:
+            return self.scroll(-1)
+        elif key == curses.KEY_NPAGE:
+            return self.scroll_pages(1)
+        elif key == curses.KEY_PPAGE:
+            return self.scroll_pages(-1)
+        elif key == curses.KEY_HOME:
+            return self.scroll_to(0)
+        elif key == curses.KEY_END:
+            return self.scroll_to(self._total_height)
+        elif key == ord("n"):
+            return self.next_group()
+        elif key == ord("p"):
+            return self.previous_group()
+        return False
 
     def refresh(self):
         self._window.refresh()
-
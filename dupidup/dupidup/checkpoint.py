@@ -0,0 +1,114 @@
+'''
+Batched writing of the line based session files with crash-safe checkpoints
+'''
+import os
+import time
+
+CHECKPOINT_ENTRIES = 10000
+CHECKPOINT_INTERVAL = 2.0
+
+
+def checkpoint_path(path):
+    return path + ".checkpoint"
+
+
+def _read_checkpoint(path):
+    try:
+        with open(checkpoint_path(path), "r") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_checkpoint(path, length):
+    marker = checkpoint_path(path)
+    with open(marker + ".tmp", "w") as f:
+        f.write(f"{length}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(marker + ".tmp", marker)
+
+
+def _last_line_end(path, size):
+    with open(path, "rb") as f:
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def recover(path):
+    '''
+    Truncates the tail that a crash may have left torn: everything after the last checkpoint, or after
+    the last complete line if there's no checkpoint of this file. Returns the number of removed bytes.
+    '''
+    size = os.path.getsize(path)
+    valid = _read_checkpoint(path)
+    if valid is None or valid > size:
+        # file written before checkpoints were kept, or replaced since its last checkpoint
+        valid = _last_line_end(path, size)
+    if valid < size:
+        os.truncate(path, valid)
+    return size - valid
+
+
+def discard(path):
+    '''
+    Removes the file with its checkpoint
+    '''
+    for file in (path, checkpoint_path(path)):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+class CheckpointWriter:
+    '''
+    Appends lines to a session file in batches. Buffered lines are written and fsync'd and the file length
+    is recorded in the checkpoint marker every max_entries lines or max_interval seconds, so a crash loses
+    at most the last batch and the file is never resumed from a torn line. With truncate the file is rewritten.
+    '''
+
+    def __init__(self, path, header=None, truncate=False, max_entries=CHECKPOINT_ENTRIES, max_interval=CHECKPOINT_INTERVAL):
+        self._path = path
+        self._max_entries = max_entries
+        self._max_interval = max_interval
+        if not truncate and os.path.exists(path):
+            recover(path)
+        self._file = open(path, "wb" if truncate else "ab")
+        # a marker left by a removed or rewritten file must not cut the lines written from now on
+        _write_checkpoint(path, self._file.tell())
+        self._last_checkpoint = time.monotonic()
+        self._buffer = []
+        if header is not None and self._file.tell() == 0:
+            self._buffer.append(f"{header}\n")
+
+    def write(self, line):
+        self._buffer.append(f"{line}\n")
+        if len(self._buffer) >= self._max_entries or time.monotonic() - self._last_checkpoint >= self._max_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if len(self._buffer) > 0:
+            self._file.write("".join(self._buffer).encode())
+            self._buffer = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        _write_checkpoint(self._path, self._file.tell())
+        self._last_checkpoint = time.monotonic()
+
+    def close(self):
+        try:
+            self.checkpoint()
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,101 @@
+'''
+Machine readable report of the duplicate groups of an analysis
+'''
+import asyncio
+import base64
+import csv
+import json
+import os
+import sys
+
+from dupidup.verify import row_paths
+
+EXPORT_FORMATS = ("jsonl", "csv")
+CSV_HEADER = ("group", "hash", "size", "copies", "reclaimable_bytes", "path")
+
+
+def duplicate_groups(analysis):
+    '''
+    Generates (hash, size, copies, reclaimable bytes, paths) of each duplicate group, copies count hardlinks once
+    '''
+    for item in analysis.items:
+        for row in item.rows:
+            yield row.hash_value, row.size, row.get_num_inodes(), row.get_reclaimable_bytes(), row_paths(item.dirs, row)
+
+
+def _is_utf8(path):
+    try:
+        path.encode("utf-8")
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def _write_jsonl(stream, group_number, hash_value, size, copies, reclaimable_bytes, paths):
+    group = dict(group=group_number, hash=hash_value, size=size, copies=copies, reclaimable_bytes=reclaimable_bytes, paths=paths)
+    if not all(_is_utf8(path) for path in paths):
+        # JSON strings can't hold undecodable bytes of the file names
+        group["paths_base64"] = [base64.b64encode(os.fsencode(path)).decode("ascii") for path in paths]
+    stream.write(json.dumps(group))
+    stream.write("\n")
+
+
+def _csv_writer(stream):
+    writer = csv.writer(stream)
+    writer.writerow(CSV_HEADER)
+
+    def write_group(stream, group_number, hash_value, size, copies, reclaimable_bytes, paths):
+        for path in paths:
+            writer.writerow((group_number, hash_value, size, copies, reclaimable_bytes, path))
+
+    return write_group
+
+
+async def export_analysis(analysis, stream, export_format):
+    '''
+    Writes the groups to the stream one at a time, JSON lines with one group per line or CSV with one file per line.
+    JSON groups with paths that aren't valid UTF-8 also have paths_base64 with the raw bytes of the paths,
+    CSV paths are written as raw bytes if the stream has the surrogateescape error handler. Returns the number of groups.
+    '''
+    if export_format == "jsonl":
+        write_group = _write_jsonl
+    elif export_format == "csv":
+        write_group = _csv_writer(stream)
+    else:
+        raise Exception(f"Unsupported export format {export_format}, available: {', '.join(EXPORT_FORMATS)}")
+    group_count = 0
+    for group in duplicate_groups(analysis):
+        write_group(stream, group_count, *group)
+        group_count += 1
+        if group_count % 1000 == 0:
+            await asyncio.sleep(0)
+    return group_count
+
+
+class ReportExporter:
+    '''
+    Exports the analysis to the export file, - is the standard output. Both are written with the surrogateescape
+    error handler, so that file names that aren't valid in the filesystem encoding keep their bytes.
+    '''
+
+    def __init__(self, analysis, export_file, export_format, callback, log):
+        self._analysis = analysis
+        self._export_file = export_file
+        self._export_format = export_format
+        self._callback = callback
+        self._log = log
+
+    async def process(self):
+        try:
+            self._log.debug(f"Exporting duplicates to {self._export_file}")
+            if self._export_file == "-":
+                if hasattr(sys.stdout, "reconfigure"):
+                    sys.stdout.reconfigure(errors="surrogateescape")
+                group_count = await export_analysis(self._analysis, sys.stdout, self._export_format)
+                sys.stdout.flush()
+            else:
+                with open(self._export_file, "w", newline="", errors="surrogateescape") as f:
+                    group_count = await export_analysis(self._analysis, f, self._export_format)
+            await self._callback.on_export_finished(self._export_file, group_count)
+        except Exception as e:
+            await self._callback.on_task_error("export", e)
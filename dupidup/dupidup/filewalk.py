@@ -1,22 +1,23 @@
 '''
 Efficient representation of a saved os.walk traversal on a filesystem that is possibly slow and inefficient to pass multiple times.
 '''
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from concurrent import futures
 import os
 import stat
+import sys
 import asyncio
 
+from dupidup.checkpoint import CheckpointWriter, recover
 
-class DirListing:
+SCAN_WORKERS = 8
 
-    def __init__(self, folder, files):
-        self.folder = folder
-        self.files = files
+_FS_ENCODING = sys.getfilesystemencoding()
+_FS_ERRORS = sys.getfilesystemencodeerrors()
 
-    def __str__(self):
-        return self.folder + "".join(['\n  ' + f for f in self.files])
-
-    def __eq__(self, other):
-        return self.folder == other.folder and self.files == other.files
+FileStat = namedtuple("FileStat", ["size", "mtime_ns", "dev", "ino"])
 
 
 class NoopProgressCallback:
@@ -30,7 +31,7 @@ class NoopProgressCallback:
     async def on_filewalk_saving(self, walk_file):
         pass
 
-    async def on_filewalk_finished(self, file_walk):
+    async def on_filewalk_finished(self, file_walk, stats=None):
         pass
 
     async def on_task_error(self, task, error):
@@ -40,81 +41,89 @@ class NoopProgressCallback:
 noop_progress_callback = NoopProgressCallback()
 
 
+def root_of(path, roots):
+    '''
+    Nearest of the root folders above the path, / if there's none
+    '''
+    folder = os.path.dirname(path)
+    while folder not in roots and os.path.dirname(folder) != folder:
+        folder = os.path.dirname(folder)
+    return folder
+
+
 class FileWalkIterator(object):
 
-    def __init__(self, walk, idx_dir_listing, idx_file, idx_walk):
+    def __init__(self, walk, idx_folder, idx_walk):
         self._walk = walk
-        self._idx_dir_listing = idx_dir_listing
-        self._idx_file = idx_file
+        self._idx_folder = idx_folder
         self._idx_walk = idx_walk
 
     def __next__(self):
-        if self._idx_dir_listing < len(self._walk._dir_listings):
-            listing = self._walk._dir_listings[self._idx_dir_listing]
-            if self._idx_file < len(listing.files):
-                file = os.path.join(listing.folder, listing.files[self._idx_file])
-                self._idx_file += 1
-                return file
-            else:
-                self._idx_dir_listing += 1
-                self._idx_file = 0
-                return self.__next__()
-        else:
+        if self._idx_walk >= len(self._walk):
             raise StopIteration()
+        while self._idx_walk >= self._walk._folder_end(self._idx_folder):
+            self._idx_folder += 1
+        file = os.path.join(self._walk._folders[self._idx_folder], self._walk._name(self._idx_walk))
+        self._idx_walk += 1
+        return file
 
     def __iter__(self):
         return self
 
 
 class FileWalk(object):
+    '''
+    Files are kept as file names encoded in one bytes blob, delimited by an offset array.
+    Each folder knows the walk index of its first file, so the folder of a file is found by bisection.
+    '''
 
     def __init__(self):
-        self._size = 0
-        self._dir_listings = []
+        self._folders = []
+        self._folder_starts = array("Q")
+        self._names = bytearray()
+        self._name_offsets = array("Q", [0])
 
     def folder_count(self):
-        return len(self._dir_listings)
+        return len(self._folders)
 
     def __len__(self):
-        return self._size
+        return len(self._name_offsets) - 1
 
     def tail(self, skip_count):
-        i, j = self._compute_idxs(skip_count)
-        return FileWalkIterator(self, i, j, skip_count)
+        if skip_count >= len(self):
+            return FileWalkIterator(self, len(self._folders), skip_count)
+        return FileWalkIterator(self, self._folder_of(skip_count), skip_count)
 
     def __iter__(self):
-        return FileWalkIterator(self, 0, 0, 0)
+        return FileWalkIterator(self, 0, 0)
 
     def __getitem__(self, key):
-        i, j = self._compute_idxs(key)
-        l = self._dir_listings[i]
-        return os.path.join(l.folder, l.files[j])
-
-    def _compute_idxs(self, global_idx):
-        if global_idx >= 0:
-            listing_idx = 0
-            while listing_idx < len(self._dir_listings) and global_idx >= len(self._dir_listings[listing_idx].files):
-                global_idx -= len(self._dir_listings[listing_idx].files)
-                listing_idx += 1
-            if listing_idx < len(self._dir_listings):
-                return listing_idx, global_idx
-            else:
-                raise IndexError("Index out of range")
-        else:
-            listing_idx = len(self._dir_listings) - 1
-            while listing_idx >= 0 and -global_idx > len(self._dir_listings[listing_idx].files):
-                global_idx += len(self._dir_listings[listing_idx].files)
-                listing_idx -= 1
-            if listing_idx >= 0:
-                return listing_idx, global_idx
-            else:
-                raise IndexError("Index out of range")
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("Index out of range")
+        return os.path.join(self._folders[self._folder_of(key)], self._name(key))
+
+    def _folder_of(self, idx):
+        # empty folders share the start with the next folder, the rightmost one is the one with files
+        return bisect_right(self._folder_starts, idx) - 1
+
+    def _folder_end(self, idx_folder):
+        if idx_folder + 1 < len(self._folders):
+            return self._folder_starts[idx_folder + 1]
+        return len(self)
+
+    def _name(self, idx):
+        return self._names[self._name_offsets[idx]:self._name_offsets[idx + 1]].decode(_FS_ENCODING, _FS_ERRORS)
+
+    def _folder_files(self, idx_folder):
+        return [self._name(i) for i in range(self._folder_starts[idx_folder], self._folder_end(idx_folder))]
 
     def __str__(self):
-        return "\n".join([str(dir_listing) for dir_listing in self._dir_listings])
+        return "\n".join([folder + "".join(['\n  ' + f for f in files]) for folder, files in self.listings()])
 
     def __repr__(self):
-        return f"FileWalk({self._size} files, {len(self._dir_listings)} folders)"
+        return f"FileWalk({len(self)} files, {len(self._folders)} folders)"
 
     def add_directory(self, folder, files):
         if folder[0] != "/":
@@ -122,18 +131,51 @@ class FileWalk(object):
         for file in files:
             if file[0] == "/":
                 raise Exception(f'Wrong file name: {file}')
-        self._dir_listings.append(DirListing(folder=folder, files=files))
-        self._size += len(files)
+        self._folders.append(folder)
+        self._folder_starts.append(len(self))
+        for file in files:
+            self._names += os.fsencode(file)
+            self._name_offsets.append(len(self._names))
 
     def __eq__(self, other):
-        return self._dir_listings == other._dir_listings
+        return (self._folders == other._folders and self._folder_starts == other._folder_starts
+                and self._name_offsets == other._name_offsets and self._names == other._names)
+
+    def roots(self):
+        '''
+        Folders of the walk whose parent folder isn't in the walk
+        '''
+        folders = set(self._folders)
+        return set(folder for folder in self._folders if os.path.dirname(folder) == folder or os.path.dirname(folder) not in folders)
+
+    def arrays(self):
+        '''
+        Folders, walk indexes of their first files, the file name blob and its offsets
+        '''
+        return self._folders, self._folder_starts, self._names, self._name_offsets
+
+    @staticmethod
+    def from_arrays(folders, folder_starts, names, name_offsets):
+        if len(folder_starts) != len(folders) or len(name_offsets) == 0 or name_offsets[-1] != len(names):
+            raise Exception(f"Inconsistent walk arrays: {len(folders)} folders, {len(folder_starts)} folder starts, "
+                            f"{len(names)} name bytes, {len(name_offsets)} name offsets")
+        file_walk = FileWalk()
+        file_walk._folders = folders
+        file_walk._folder_starts = folder_starts
+        file_walk._names = names
+        file_walk._name_offsets = name_offsets
+        return file_walk
+
+    def listings(self):
+        for idx_folder, folder in enumerate(self._folders):
+            yield folder, self._folder_files(idx_folder)
 
     async def save_to(self, path):
         with open(path, "w") as w:
-            for dir_listing in self._dir_listings:
-                w.write(dir_listing.folder)
+            for folder, files in self.listings():
+                w.write(folder)
                 w.write("\n")
-                for file in dir_listing.files:
+                for file in files:
                     w.write(file)
                     w.write("\n")
                 await asyncio.sleep(0)
@@ -143,7 +185,7 @@ class FileWalk(object):
         with open(path, "r") as r:
             current_dir = None
             current_files = []
-            for line in r.readlines():
+            for i, line in enumerate(r):
                 path = line[:-1]
                 if path[0] == "/":
                     if current_dir != None:
@@ -152,7 +194,8 @@ class FileWalk(object):
                     current_files = []
                 else:
                     current_files.append(path)
-                await asyncio.sleep(0)
+                if i % 1000 == 0:
+                    await asyncio.sleep(0)
             if current_dir != None:
                 self.add_directory(current_dir, current_files)
 
@@ -163,40 +206,121 @@ class FileWalk(object):
         return file_walk
 
     @staticmethod
-    async def from_walk(*roots, callback=noop_progress_callback):
-        file_walk = FileWalk()
-        for root in roots:
-            for folder, _, files in os.walk(root, True, None, False):
-                file_walk.add_directory(folder, files)
-                await callback.on_filewalk_progress(len(file_walk._dir_listings), len(file_walk))
-                await asyncio.sleep(0)
-
+    async def from_walk(*roots, callback=noop_progress_callback, workers=SCAN_WORKERS, ignore_rules=None):
+        file_walk, _ = await FileWalk.scan(*roots, callback=callback, workers=workers, ignore_rules=ignore_rules)
         return file_walk
 
+    @staticmethod
+    async def scan(*roots, callback=noop_progress_callback, workers=SCAN_WORKERS, on_listing=None, ignore_rules=None):
+        '''
+        Walks the roots listing up to workers directories concurrently. Returns the walk and stat records
+        of the walked files collected from the directory listings, in the same order. Files and folders
+        matching ignore_rules are skipped without being stat'ed or listed.
+        If given, on_listing coroutine is awaited with the walk index of the first file, the folder,
+        its files and their stat records right after each folder is added to the walk.
+        '''
+        file_walk = FileWalk()
+        stats = []
+        loop = asyncio.get_running_loop()
+        with futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as executor:
+            # folders are taken from the end, so that the walk is depth first and the queue stays small
+            queued = [root for root in reversed(roots) if not (ignore_rules and ignore_rules.is_ignored(root, root))]
+            pending = {}
+            while len(queued) > 0 or len(pending) > 0:
+                while len(queued) > 0 and len(pending) < workers:
+                    folder = queued.pop()
+                    pending[loop.run_in_executor(executor, _scan_directory, folder, ignore_rules)] = folder
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    folder = pending.pop(future)
+                    listing = future.result()
+                    if listing is None:
+                        continue
+                    files, file_stats, subfolders = listing
+                    file_walk.add_directory(folder, files)
+                    stats.extend(file_stats)
+                    queued.extend(reversed(subfolders))
+                    if on_listing is not None:
+                        await on_listing(len(file_walk) - len(files), folder, files, file_stats)
+                    await callback.on_filewalk_progress(file_walk.folder_count(), len(file_walk))
+
+        return file_walk, stats
+
+
+def _stat_record(stat_result):
+    return FileStat(stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_dev, stat_result.st_ino)
+
+
+def _scan_directory(folder, ignore_rules=None):
+    '''
+    Lists files of the folder with their stat records and subfolders to descend into, following os.walk
+    conventions: unreadable folders are skipped, symlinks to folders are neither files nor descended into.
+    Ignored entries are left out.
+    '''
+    try:
+        scandir_it = os.scandir(folder)
+    except OSError:
+        return None
+    is_ignored_entry = ignore_rules.entry_filter(folder) if ignore_rules else None
+    files, stats, subfolders = [], [], []
+    with scandir_it:
+        for entry in scandir_it:
+            if is_ignored_entry is not None and is_ignored_entry(entry.name, entry.path):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    subfolders.append(entry.path)
+            else:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # dangling symlink or a file removed during the scan
+                    continue
+                files.append(entry.name)
+                stats.append(_stat_record(stat))
+    return files, stats, subfolders
+
 
 class FileWalkProcessor:
+    '''
+    Loads the walk file, or scans the folders if there's none. A new scan may list the files in a different
+    order, so stale_files (results of the later phases indexed by the old walk) are removed before scanning.
+    '''
 
-    def __init__(self, folders, walk_file, callback, log):
+    def __init__(self, folders, walk_file, callback, log, workers=SCAN_WORKERS, stale_files=(), ignore_rules=None):
         self._folders = folders
         self._walk_file = walk_file
         self._callback = callback
         self._log = log
+        self._workers = workers
+        self._stale_files = stale_files
+        self._ignore_rules = ignore_rules
 
     async def process(self):
         try:
             self._log.debug("File scanning started")
             file_walk = None
+            stats = None
             if os.path.exists(self._walk_file):
                 await self._callback.on_filewalk_loading(self._walk_file)
                 file_walk = await FileWalk.from_file(self._walk_file)
             else:
                 if len(self._folders) == 0:
                     raise Exception(f"At least one root folder must be given if walk file {self._walk_file} is not present")
-                file_walk = await FileWalk.from_walk(*self._folders, callback=self._callback)
+                for stale_file in self._stale_files:
+                    if os.path.exists(stale_file):
+                        self._log.debug(f"Removing {stale_file} of the previous walk")
+                        os.remove(stale_file)
+                file_walk, stats = await FileWalk.scan(*self._folders, callback=self._callback, workers=self._workers,
+                                                       ignore_rules=self._ignore_rules)
                 await self._callback.on_filewalk_saving(self._walk_file)
                 await file_walk.save_to(self._walk_file)
 
-            await self._callback.on_filewalk_finished(file_walk)
+            await self._callback.on_filewalk_finished(file_walk, stats)
             self._log.debug("File scanning finished")
         except Exception as e:
             await self._callback.on_task_error("file walk", e)
@@ -207,60 +331,92 @@ def get_size(path):
     return stat_record[stat.ST_SIZE]
 
 
+def get_stat(path):
+    return _stat_record(os.stat(path))
+
+
+def format_stat(stat_record):
+    return f"{stat_record.size} {stat_record.mtime_ns} {stat_record.dev} {stat_record.ino}"
+
+
+def parse_stat(line):
+    fields = line.split()
+    if len(fields) == 1:
+        # size files from before stat records were kept contain only sizes
+        return FileStat(int(fields[0]), None, None, None)
+    return FileStat(*[int(field) for field in fields])
+
+
+async def load_stats(size_file):
+    stats = []
+    with open(size_file, "r") as f:
+        for i, line in enumerate(f):
+            stats.append(parse_stat(line))
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+    return stats
+
+
+async def save_stats(size_file, stats):
+    with CheckpointWriter(size_file, truncate=True) as w:
+        for i, stat_record in enumerate(stats):
+            w.write(format_stat(stat_record))
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+
+
 class FileSizeProcessor:
+    '''
+    Collects stat records of the walked files. If the walk was just scanned, the records gathered
+    by the scan are only saved.
+    '''
 
-    def __init__(self, file_walk, size_file, callback, log):
+    def __init__(self, file_walk, size_file, callback, log, stats=None):
         self._file_walk = file_walk
         self._size_file = size_file
         self._callback = callback
         self._log = log
+        self._scanned_stats = stats
 
-    async def _read_file(self):
-        sizes = []
-        with open(self._size_file, "r") as f:
-            line = f.readline()
-            while line:
-                sizes.append(int(line.strip()))
-                line = f.readline()
-                await asyncio.sleep(0)
-        return sizes
-
-    def _check_last(self, sizes, n):
-        finished = len(sizes)
-        for i in range(finished - n, finished):
+    def _check_last(self, stats, n):
+        finished = len(stats)
+        for i in range(max(0, finished - n), finished):
             file_i = self._file_walk[i]
             size_i = get_size(file_i)
-            if size_i != sizes[i]:
-                raise Exception(f"File {i} {file_i} size is {size_i}, not {sizes[i]}")
+            if size_i != stats[i].size:
+                raise Exception(f"File {i} {file_i} size is {size_i}, not {stats[i].size}")
 
     async def process(self):
         try:
-            sizes = []
-            if os.path.exists(self._size_file):
-                sizes = await self._read_file()
-                self._check_last(sizes, 3)
+            stats = []
+            if self._scanned_stats is not None:
+                stats = self._scanned_stats
+                await save_stats(self._size_file, stats)
+            elif os.path.exists(self._size_file):
+                torn_bytes = recover(self._size_file)
+                if torn_bytes > 0:
+                    self._log.debug(f"Truncated {torn_bytes} bytes after the last checkpoint of {self._size_file}")
+                stats = await load_stats(self._size_file)
+                self._check_last(stats, 3)
 
             total_files = len(self._file_walk)
-            file_count = len(sizes)
-            byte_count = sum(sizes)
+            file_count = len(stats)
+            byte_count = sum(stat_record.size for stat_record in stats)
 
             if file_count < total_files:
-                with open(self._size_file, "a+") as f:
+                with CheckpointWriter(self._size_file) as w:
                     for file_path in self._file_walk.tail(file_count):
-                        size = get_size(file_path)
-                        sizes.append(size)
-                        f.write(str(size))
-                        f.write("\n")
-                        f.flush()
+                        stat_record = get_stat(file_path)
+                        stats.append(stat_record)
+                        w.write(format_stat(stat_record))
                         file_count += 1
-                        byte_count += size
+                        byte_count += stat_record.size
                         await self._callback.on_filesize_progress(file_count, byte_count)
                         if self._callback.terminating():
                             self._log.debug("Terminating file size processor due to application termination")
                             break
                         await asyncio.sleep(0)
 
-            await self._callback.on_filesize_finished(sizes, byte_count)
+            await self._callback.on_filesize_finished(stats, byte_count)
         except Exception as e:
             await self._callback.on_task_error("size computation", e)
-
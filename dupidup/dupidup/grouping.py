@@ -0,0 +1,102 @@
+'''
+Grouping of file indexes by equal digests or inodes. Uses NumPy sorting when NumPy is installed,
+dicts of indexes otherwise. Paths are never touched here, callers resolve them only for the grouped files.
+'''
+import asyncio
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _equal_runs(columns):
+    '''
+    Order that sorts the rows of the key columns and the edges of runs of equal rows in that order
+    '''
+    order = numpy.lexsort(columns[::-1])
+    changed = numpy.zeros(max(len(order) - 1, 0), dtype=bool)
+    for column in columns:
+        sorted_column = column[order]
+        changed |= sorted_column[1:] != sorted_column[:-1]
+    boundary = numpy.ones(len(order) + 1, dtype=bool)
+    boundary[1:-1] = changed
+    return order, numpy.flatnonzero(boundary)
+
+
+def _split_runs(idxs, order, edges):
+    sorted_idxs = idxs[order]
+    return [sorted_idxs[start:end].tolist() for start, end in zip(edges[:-1], edges[1:]) if end - start > 1]
+
+
+def _digest_columns(hashes):
+    '''
+    Indexes of hashed files and key columns of their digests
+    '''
+    if hasattr(hashes, "raw_digests"):
+        # binary session digests are compared as pairs of uint64 without decoding them
+        idxs = numpy.flatnonzero(numpy.frombuffer(hashes.hashed_flags(), dtype=numpy.uint8))
+        digests = numpy.frombuffer(hashes.raw_digests(), dtype=numpy.uint64).reshape(-1, 2)[idxs]
+        return idxs, [digests[:, 0], digests[:, 1]]
+    idxs = numpy.fromiter((i for i, digest in enumerate(hashes) if digest is not None), dtype=numpy.int64)
+    return idxs, [_raw_digests([hashes[i] for i in idxs.tolist()])]
+
+
+def _raw_digests(digests):
+    '''
+    Hex digests as fixed width raw bytes, at a quarter of the size of a unicode array of them.
+    Digests that aren't hex of one length stay strings.
+    '''
+    width = len(digests[0]) if len(digests) > 0 else 0
+    if width >= 2 and all(len(digest) == width for digest in digests):
+        try:
+            return numpy.frombuffer(bytes.fromhex("".join(digests)), dtype=f"S{width // 2}")
+        except ValueError:
+            pass
+    return numpy.array(digests, dtype=str)
+
+
+async def digest_groups(hashes, callback):
+    '''
+    Lists of indexes of files with equal digest. Files that weren't hashed are skipped,
+    no other file has the same size.
+    '''
+    if numpy is not None:
+        idxs, columns = _digest_columns(hashes)
+        await asyncio.sleep(0)
+        order, edges = _equal_runs(columns)
+        await callback.on_analysis_progress(len(hashes))
+        return _split_runs(idxs, order, edges)
+
+    idxs_by_digest = {}
+    for i, digest in enumerate(hashes):
+        if digest is not None:
+            idxs_by_digest.setdefault(digest, []).append(i)
+        if i % 1000 == 0:
+            await callback.on_analysis_progress(i)
+            await asyncio.sleep(0)
+    return [idxs for idxs in idxs_by_digest.values() if len(idxs) > 1]
+
+
+async def inode_groups(stats):
+    '''
+    Lists of indexes of files that are hardlinks to the same inode
+    '''
+    if stats is None:
+        return []
+    if numpy is not None:
+        known = [i for i, stat_record in enumerate(stats) if stat_record.dev is not None]
+        idxs = numpy.array(known, dtype=numpy.int64)
+        devs = numpy.fromiter((stats[i].dev for i in known), dtype=numpy.uint64, count=len(known))
+        inos = numpy.fromiter((stats[i].ino for i in known), dtype=numpy.uint64, count=len(known))
+        await asyncio.sleep(0)
+        order, edges = _equal_runs([devs, inos])
+        return _split_runs(idxs, order, edges)
+
+    idxs_by_inode = {}
+    for i, stat_record in enumerate(stats):
+        if stat_record.dev is not None:
+            idxs_by_inode.setdefault((stat_record.dev, stat_record.ino), []).append(i)
+        if i % 1000 == 0:
+            await asyncio.sleep(0)
+    return [idxs for idxs in idxs_by_inode.values() if len(idxs) > 1]
@@ -0,0 +1,103 @@
+'''
+Persistent hash cache shared by all sessions
+'''
+import sqlite3
+import time
+
+DEFAULT_MAX_ENTRIES = 10000000
+
+
+def _signed(value):
+    # SQLite integers are signed 64-bit, inode and device numbers may use the whole unsigned range
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _key(stat_record, kind):
+    return (_signed(stat_record.dev), _signed(stat_record.ino), stat_record.size, stat_record.mtime_ns, kind)
+
+
+class HashCache:
+    '''
+    SQLite file of digests keyed by device, inode, size and mtime of the hashed file and the kind of hash
+    (algorithm and stage). When there are more than max_entries digests, the least recently used are evicted.
+    '''
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self._path = path
+        self._max_entries = max_entries
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (dev, ino, size, mtime_ns, kind))""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        self._connection.commit()
+        self._entries = self._connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        self._uncommitted = 0
+
+    def __len__(self):
+        return self._entries
+
+    def get(self, stat_record, kind):
+        if stat_record.mtime_ns is None:
+            return None
+        key = _key(stat_record, kind)
+        row = self._connection.execute(
+            "SELECT digest FROM hashes WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND kind = ?", key).fetchone()
+        if row is None:
+            return None
+        self._connection.execute(
+            "UPDATE hashes SET last_used = ? WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND kind = ?",
+            (time.time_ns(),) + key)
+        self._touch()
+        return row[0]
+
+    def put(self, stat_record, kind, digest):
+        if stat_record.mtime_ns is None:
+            return
+        self._connection.execute(
+            "INSERT OR REPLACE INTO hashes (dev, ino, size, mtime_ns, kind, digest, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            _key(stat_record, kind) + (digest, time.time_ns()))
+        # digests are put after a cache miss, a replaced entry only makes the count an estimate
+        self._entries += 1
+        self._touch()
+
+    def _touch(self):
+        self._uncommitted += 1
+        if self._uncommitted >= 1000:
+            self.commit()
+
+    def commit(self):
+        if self._entries > self._max_entries:
+            # evicting a tenth more than necessary, so that the next eviction isn't due right away
+            self._evict(self._max_entries - self._max_entries // 10)
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def _evict(self, max_entries):
+        self._entries = self._connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        if self._entries > max_entries:
+            self._connection.execute(
+                "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)",
+                (self._entries - max_entries,))
+            self._entries = max_entries
+
+    def prune(self, max_entries=None):
+        '''
+        Evicts least recently used digests above max_entries (the cache limit if None) and compacts the file
+        '''
+        self.commit()
+        self._evict(self._max_entries if max_entries is None else max_entries)
+        self._connection.commit()
+        self._connection.execute("VACUUM")
+        return self._entries
+
+    def close(self):
+        self.commit()
+        self._connection.close()
@@ -0,0 +1,228 @@
+'''
+Headless mode running the session without curses, for cron jobs and batch nodes
+'''
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from dupidup.processing import DupidupProcessing
+from dupidup.progress import StageMeter
+
+PROGRESS_INTERVAL = 1.0
+PROGRESS_FORMATS = ("text", "json")
+
+
+class TextProgress:
+    '''
+    Writes progress as plain text lines. Progress events are written at most once per interval,
+    other events always.
+    '''
+
+    def __init__(self, stream=None, interval=PROGRESS_INTERVAL):
+        self._stream = sys.stderr if stream is None else stream
+        self._interval = interval
+        self._last_progress = None
+
+    def due(self):
+        '''
+        True if a progress event would be written now, callers skip measuring and formatting it otherwise
+        '''
+        return self._last_progress is None or time.monotonic() - self._last_progress >= self._interval
+
+    def report(self, event, progress=False, **values):
+        if progress:
+            if not self.due():
+                return
+            self._last_progress = time.monotonic()
+        self._stream.write(self.format(event, values))
+        self._stream.flush()
+
+    def format(self, event, values):
+        return " ".join([event] + [f"{key}={value}" for key, value in values.items()]) + "\n"
+
+
+class JsonProgress(TextProgress):
+    '''
+    Writes progress as JSON lines with event name and time
+    '''
+
+    def format(self, event, values):
+        return json.dumps(dict(event=event, time=time.time(), **values)) + "\n"
+
+
+def create_progress(progress_format, stream=None, interval=PROGRESS_INTERVAL):
+    if progress_format == "text":
+        return TextProgress(stream, interval)
+    elif progress_format == "json":
+        return JsonProgress(stream, interval)
+    raise Exception(f"Unsupported progress format {progress_format}, available: {', '.join(PROGRESS_FORMATS)}")
+
+
+def create_logger(debug_log_file=None):
+    log = logging.getLogger("dupidup")
+    if debug_log_file is None:
+        log.addHandler(logging.NullHandler())
+    else:
+        handler = logging.FileHandler(debug_log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+        log.addHandler(handler)
+        log.setLevel(logging.DEBUG)
+    return log
+
+
+class HeadlessApplication(DupidupProcessing):
+    '''
+    Runs the phases of the session one after another in a plain asyncio loop, each finished phase
+    awaits the next one. Progress goes to the progress writer instead of the screen, with the throughput,
+    elapsed time, ETA and I/O vs. hashing time of the stage. Each finished hashing stage is reported as hashed.
+    run() returns the exit status: 0 if the session finished, 1 if any phase failed.
+    '''
+
+    def __init__(self, *args, progress=None, log=None, **kwargs):
+        self._progress = TextProgress() if progress is None else progress
+        self._log = create_logger() if log is None else log
+        self._error = None
+        self._meter = StageMeter()
+        self._hash_stage = None
+        self._hash_counts = None
+        self.analysis = None
+        super().__init__(*args, **kwargs)
+
+    def run(self):
+        try:
+            asyncio.run(self._run_async())
+        except KeyboardInterrupt:
+            self._progress.report("interrupted")
+            return 130
+        finally:
+            self._close()
+        return 0 if self._error is None else 1
+
+    async def _run_async(self):
+        phase, processor = self._first_phase()
+        self._progress.report("started", phase=phase)
+        await processor
+
+    def terminating(self):
+        return False
+
+    async def on_task_error(self, task, error):
+        self._error = error
+        self._log.error(f"Error while executing task {task}: {str(error)}", exc_info=error)
+        self._progress.report("error", task=task, message=str(error))
+
+    async def on_filewalk_progress(self, folder_count, file_count):
+        self._progress.report("scanning", progress=True, folders=folder_count, files=file_count)
+
+    async def on_filewalk_loading(self, walk_file):
+        self._progress.report("loading", file=walk_file)
+
+    async def on_filewalk_saving(self, walk_file):
+        self._progress.report("saving", file=walk_file)
+
+    async def on_filewalk_finished(self, file_walk, stats=None):
+        self._set_walk(file_walk)
+        self._progress.report("scanned", folders=file_walk.folder_count(), files=self._total_files)
+        self._meter.reset()
+        await self._size_processor(stats)
+
+    async def on_filesize_progress(self, file_count, byte_count):
+        if not self._progress.due():
+            return
+        self._meter.update(file_count, total_files=self._total_files)
+        self._progress.report("sizing", progress=True, files=file_count, total_files=self._total_files, bytes=byte_count,
+                              **self._meter.values())
+
+    async def on_filesize_finished(self, stats, byte_count):
+        self._set_walk(self._file_walk, stats)
+        self._progress.report("sized", files=self._total_files, bytes=byte_count)
+        await self._hash_processor()
+
+    async def on_streaming_progress(self, folder_count, file_count, hashed_count, hashed_bytes, duplicate_count, timing):
+        if not self._progress.due():
+            return
+        self._meter.update(hashed_count, hashed_bytes, timing=timing)
+        self._progress.report("streaming", progress=True, folders=folder_count, files=file_count, hashed_files=hashed_count,
+                              hashed_bytes=hashed_bytes, duplicates=duplicate_count, **self._meter.values())
+
+    async def on_streaming_finished(self, file_walk, stats, hashes):
+        self._set_walk(file_walk, stats)
+        await self._analyse(hashes)
+
+    async def on_session_loaded(self, file_walk, stats, hashes):
+        self._set_walk(file_walk, stats, stats.sizes)
+        await self._analyse(hashes)
+
+    async def on_hashing_started(self, stage, file_count, byte_count):
+        self._finish_stage()
+        self._hash_stage = stage
+        self._hash_total_files = file_count
+        self._hash_total_bytes = byte_count
+        self._hash_counts = None
+        self._meter.reset()
+        self._progress.report("hashing", stage=stage, files=0, total_files=file_count, bytes=0, total_bytes=byte_count)
+
+    async def on_hashing_progress(self, file_count, byte_count, timing):
+        self._hash_counts = (file_count, byte_count, timing)
+        if not self._progress.due():
+            return
+        self._meter.update(file_count, byte_count, self._hash_total_files, self._hash_total_bytes, timing)
+        self._progress.report("hashing", progress=True, stage=self._hash_stage, files=file_count, total_files=self._hash_total_files,
+                              bytes=byte_count, total_bytes=self._hash_total_bytes, **self._meter.values())
+
+    async def on_hashing_finished(self, hashes):
+        self._finish_stage()
+        await self._analyse(hashes)
+
+    def _finish_stage(self):
+        if self._hash_stage is not None:
+            if self._hash_counts is not None:
+                # progress is measured only when it's reported, the stage ends with the last counts
+                file_count, byte_count, timing = self._hash_counts
+                self._meter.update(file_count, byte_count, self._hash_total_files, self._hash_total_bytes, timing)
+            self._progress.report("hashed", stage=self._hash_stage, **self._meter.values())
+            self._hash_stage = None
+
+    async def _analyse(self, hashes):
+        self._progress.report("analysing", files=self._total_files)
+        await self._analysis_processor(hashes)
+
+    async def on_analysis_progress(self, file_count):
+        self._progress.report("analysing", progress=True, files=file_count, total_files=self._total_files)
+
+    async def on_analysis_finished(self, analysis):
+        if self._verify:
+            await self._verification_processor(analysis)
+        else:
+            await self._finish(analysis)
+
+    async def on_verification_started(self, file_count, byte_count):
+        self._verify_total_files = file_count
+        self._verify_total_bytes = byte_count
+        self._meter.reset()
+        self._progress.report("verifying", files=0, total_files=file_count, bytes=0, total_bytes=byte_count)
+
+    async def on_verification_progress(self, file_count, byte_count):
+        if not self._progress.due():
+            return
+        self._meter.update(file_count, byte_count, self._verify_total_files, self._verify_total_bytes)
+        self._progress.report("verifying", progress=True, files=file_count, total_files=self._verify_total_files,
+                              bytes=byte_count, total_bytes=self._verify_total_bytes, **self._meter.values())
+
+    async def on_verification_finished(self, analysis, mismatches):
+        for hash_value, paths, identical in mismatches:
+            self._progress.report("mismatch", hash=hash_value, files=len(paths), identical_files=len(identical))
+        await self._finish(analysis)
+
+    async def on_export_finished(self, export_file, group_count):
+        self._progress.report("exported", file=export_file, groups=group_count)
+
+    async def _finish(self, analysis):
+        self.analysis = analysis
+        rows = [row for item in analysis.items for row in item.rows]
+        self._progress.report("finished", groups=len(rows), duplicate_files=sum(row.get_num_files() for row in rows),
+                              duplicated_bytes=analysis.get_duplicated_bytes(), hardlinks=len(analysis.hardlinks))
+        if self._export_file is not None:
+            await self._export_processor(analysis)
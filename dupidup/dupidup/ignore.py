@@ -0,0 +1,90 @@
+'''
+Compiled --ignore rules
+'''
+from fnmatch import fnmatchcase
+import os
+
+_SUBTREE = object()
+
+
+def _is_glob(rule):
+    return any(c in rule for c in "*?[")
+
+
+class IgnoreRules:
+    '''
+    Ignore rules of three kinds. A plain path ignores the file or folder with its subtree, the paths are kept
+    in a trie of path components, so matching costs one dict lookup per component regardless of the number of rules.
+    A glob without path separator (e.g. .Trash-*) ignores every file and folder of matching name below the root.
+    A glob with path separator is matched against whole paths, it also ignores the subtrees of matching folders.
+    '''
+
+    def __init__(self, rules=()):
+        self._trie = {}
+        self._name_globs = []
+        self._path_globs = []
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        if _is_glob(rule):
+            if os.sep in rule:
+                self._path_globs.append(rule)
+            else:
+                self._name_globs.append(rule)
+        else:
+            node = self._trie
+            for component in _components(os.path.abspath(rule)):
+                node = node.setdefault(component, {})
+            node[_SUBTREE] = True
+
+    def __bool__(self):
+        return len(self._trie) > 0 or len(self._name_globs) > 0 or len(self._path_globs) > 0
+
+    def is_ignored_name(self, name):
+        return any(fnmatchcase(name, glob) for glob in self._name_globs)
+
+    def is_ignored(self, path, root=None):
+        '''
+        True if the path or any of its parent folders is ignored. With root, names are matched only below it,
+        the folders above the root weren't walked. A root checked against itself is matched only by paths.
+        '''
+        skip_count = 0 if root is None else len(_components(root))
+        node = self._trie
+        prefix = ""
+        for n, component in enumerate(_components(path)):
+            if n >= skip_count and self.is_ignored_name(component):
+                return True
+            if node is not None:
+                node = node.get(component)
+                if node is not None and _SUBTREE in node:
+                    return True
+            if len(self._path_globs) > 0:
+                prefix += os.sep + component
+                if any(fnmatchcase(prefix, glob) for glob in self._path_globs):
+                    return True
+        return False
+
+    def entry_filter(self, folder):
+        '''
+        Function of entry name and path telling whether an entry of the folder is ignored. The folder itself
+        must not be ignored, so only the entry's own component is looked up, once per folder listing.
+        '''
+        node = self._trie
+        for component in _components(folder):
+            node = node.get(component) if node is not None else None
+
+        def is_ignored_entry(name, path):
+            if self.is_ignored_name(name):
+                return True
+            if node is not None:
+                child = node.get(name)
+                if child is not None and _SUBTREE in child:
+                    return True
+            return any(fnmatchcase(path, glob) for glob in self._path_globs)
+
+        return is_ignored_entry
+
+
+def _components(path):
+    return [component for component in path.split(os.sep) if component != ""]
@@ -8,27 +8,125 @@ Options:
   -h, --help                     Show this screen.
   --version                      Show version.
   --temp-datadir <temp-datadir>  Use given temp datadir file.
-  --ignore <ignored-dir>         Ignore directory and it's subtree
+  --convert-session              Convert finished text session files in temp datadir to the binary format
+                                 that is loaded instead of them, then exit. Give the hashing options
+                                 the session was hashed with
+  --headless                     Run without the curses UI, write progress to stderr and exit with status 0
+                                 if the session finished or 1 if it failed
+  --progress-format <format>     Progress format of the headless mode: text or json (JSON lines) [default: text]
+  --export <export-file>         Write the duplicate groups to the export file, - for standard output
+                                 (only with --headless)
+  --export-format <format>       Export format: jsonl (one group per line) or csv (one file per line) [default: jsonl]
+  --rescan                       Scan the folders of an existing session again and hash only new and modified files
+  --ignore <ignored-dir>         Ignore directory or file with its subtree. A glob ignores all files and folders
+                                 of matching name (e.g. '.Trash-*'), or of matching path if it contains /.
+                                 Ignored subtrees aren't scanned at all
+  --hash-all                     Hash all files, not only the ones sharing their size with another file
+  --min-size <bytes>             Ignore files smaller than this when looking for duplicates [default: 0]
+  --max-size <bytes>             Ignore files larger than this when looking for duplicates
+  --head-size <bytes>            Size of the block at the beginning of file hashed before the full hash,
+                                 0 disables this stage [default: 4096]
+  --tail-size <bytes>            Size of the block at the end of file hashed before the full hash,
+                                 0 disables this stage [default: 0]
+  --streaming                    Hash files while the folders are still being scanned, as soon as another file
+                                 of the same size is found. Only used for a new session, computes only full hashes
+  --scan-workers <n>             Number of folders listed concurrently while scanning [default: 8]
+  --hash <algorithm>             Hash algorithm: md5, blake2b or xxh128 (needs xxhash package).
+                                 A session datadir can only be used with one algorithm [default: md5]
+  --hash-cache <cache-file>      Look up and store digests in a hash cache file shared by all sessions
+  --hash-cache-size <n>          Maximum number of digests in the hash cache, least recently used
+                                 are evicted [default: 10000000]
+  --prune-hash-cache             Evict digests over the hash cache size, compact the hash cache file and exit
+  --workers <n>                  Number of parallel hashing workers [default: 4]
+  --block-size <bytes>           Size of the reads of full hashing, larger for network or spinning disks,
+                                 smaller for SSDs [default: 1048576]
+  --mmap-threshold <bytes>       Hash files of at least this size through mmap, for large files on local disks,
+                                 0 disables mmap [default: 0]
+  --process-pool                 Hash in worker processes instead of threads, for CPU bound hashing
+                                 on fast local disks
+  --verify                       Compare the files of each duplicate group byte for byte after the analysis,
+                                 groups that differ aren't shown
   --debug-level          Set DEBUG level for server log
   --debug-log <log-file> Debug logging to file exactly.log in current directory
   --debug <debug-string> Start PyDev debug server. Debug string format: host:port:pydev_src  
 """
+import asyncio
+import os
 import sys
 
 from magicur.app import MagicBootstrap
 
 from docopt import docopt
 from dupidup.app import DupidupApplication
+from dupidup.analysis import HASH_ALGORITHMS
+from dupidup.session import convert_session
+from dupidup.hashcache import HashCache
+from dupidup.export import EXPORT_FORMATS
+from dupidup.headless import HeadlessApplication, PROGRESS_FORMATS, create_progress, create_logger
 
 VERSION = '0.1.0'
 
 if __name__ == '__main__':
     args = docopt(__doc__, version=VERSION)
+    if args["--hash"] not in HASH_ALGORITHMS:
+        sys.exit(f"Unsupported hash algorithm {args['--hash']}, available: {', '.join(HASH_ALGORITHMS)}")
     temp_datadir = "session"
     if "--temp-datadir" in args and args["--temp-datadir"] != None:
         temp_datadir = args["--temp-datadir"]
 
-    application = DupidupApplication(temp_datadir, args["<folder>"], args["--ignore"])
+    if args["--prune-hash-cache"]:
+        if args["--hash-cache"] is None:
+            sys.exit("--prune-hash-cache needs --hash-cache")
+        hash_cache = HashCache(args["--hash-cache"], int(args["--hash-cache-size"]))
+        entries = hash_cache.prune()
+        hash_cache.close()
+        print(f"Hash cache {args['--hash-cache']} pruned to {entries:,} digests")
+        sys.exit(0)
+
+    if args["--convert-session"]:
+        asyncio.run(convert_session(os.path.join(temp_datadir, "file_walk.txt"),
+                                    os.path.join(temp_datadir, "sizes.txt"),
+                                    os.path.join(temp_datadir, "hashes.txt"),
+                                    temp_datadir, args["--hash"], hash_all=args["--hash-all"],
+                                    head_size=int(args["--head-size"]), tail_size=int(args["--tail-size"]),
+                                    min_size=int(args["--min-size"]),
+                                    max_size=None if args["--max-size"] is None else int(args["--max-size"])))
+        print(f"Session in {temp_datadir} converted to binary format")
+        sys.exit(0)
+
+    options = dict(hash_all=args["--hash-all"],
+                   head_size=int(args["--head-size"]),
+                   tail_size=int(args["--tail-size"]),
+                   workers=int(args["--workers"]),
+                   process_pool=args["--process-pool"],
+                   algorithm=args["--hash"],
+                   scan_workers=int(args["--scan-workers"]),
+                   streaming=args["--streaming"],
+                   rescan=args["--rescan"],
+                   hash_cache=args["--hash-cache"],
+                   hash_cache_size=int(args["--hash-cache-size"]),
+                   verify=args["--verify"],
+                   block_size=int(args["--block-size"]),
+                   mmap_threshold=int(args["--mmap-threshold"]),
+                   min_size=int(args["--min-size"]),
+                   max_size=None if args["--max-size"] is None else int(args["--max-size"]),
+                   export_file=args["--export"],
+                   export_format=args["--export-format"])
+
+    if args["--export-format"] not in EXPORT_FORMATS:
+        sys.exit(f"Unsupported export format {args['--export-format']}, available: {', '.join(EXPORT_FORMATS)}")
+    if args["--export"] == "-" and not args["--headless"]:
+        # curses owns the terminal, the export would corrupt the screen and be lost with it
+        sys.exit("Export to standard output needs --headless")
+
+    if args["--headless"]:
+        if args["--progress-format"] not in PROGRESS_FORMATS:
+            sys.exit(f"Unsupported progress format {args['--progress-format']}, available: {', '.join(PROGRESS_FORMATS)}")
+        application = HeadlessApplication(temp_datadir, args["<folder>"], args["--ignore"],
+                                          progress=create_progress(args["--progress-format"]),
+                                          log=create_logger(args["--debug-log"]), **options)
+        sys.exit(application.run())
+
+    application = DupidupApplication(temp_datadir, args["<folder>"], args["--ignore"], **options)
     magic = MagicBootstrap(debug_log_file=args['--debug-log'], debug_string=args['--debug'])
     sys.exit(magic.run(application))
-
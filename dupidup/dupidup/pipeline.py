@@ -0,0 +1,148 @@
+'''
+Streaming mode of the scan, size and hash phases, for sessions that don't have a walk file yet.
+'''
+from functools import partial
+import asyncio
+import os
+
+from dupidup.analysis import get_hash, get_empty_hash, in_size_range, save_hashes, DEFAULT_HASH_ALGORITHM, READ_BLOCK_SIZE, \
+    MMAP_THRESHOLD, HashTiming, timed_hash
+from dupidup.filewalk import FileWalk, SCAN_WORKERS, save_stats
+
+HASH_QUEUE_SIZE = 1024
+
+
+class StreamingProcessor:
+    '''
+    Scans, stats and hashes in one pass. A file is queued for hashing as soon as the scan finds another
+    file of the same size. The hash queue is bounded, so the scan waits when hashing can't keep up.
+    Walk, size and hash files are saved when everything is processed, a resumed session then continues
+    with the regular processors. They are saved also when hashing of some file failed, with the hashes
+    computed so far, so that the resumed session only hashes the rest. Hardlinks to an inode seen before aren't queued, they get the digest of the first link.
+    Files out of the min_size, max_size range aren't queued either, zero-length files get the empty digest
+    without being opened.
+    '''
+
+    def __init__(self, folders, walk_file, size_file, hash_file, callback, log, executor=None, workers=4,
+                 scan_workers=SCAN_WORKERS, algorithm=DEFAULT_HASH_ALGORITHM, queue_size=HASH_QUEUE_SIZE,
+                 hash_cache=None, block_size=READ_BLOCK_SIZE, mmap_threshold=MMAP_THRESHOLD, ignore_rules=None,
+                 min_size=0, max_size=None):
+        self._folders = folders
+        self._walk_file = walk_file
+        self._size_file = size_file
+        self._hash_file = hash_file
+        self._callback = callback
+        self._log = log
+        self._executor = executor
+        self._workers = workers
+        self._scan_workers = scan_workers
+        self._algorithm = algorithm
+        self._queue_size = queue_size
+        self._hash_cache = hash_cache
+        self._block_size = block_size
+        self._mmap_threshold = mmap_threshold
+        self._ignore_rules = ignore_rules
+        self._min_size = min_size
+        self._max_size = max_size
+
+    async def _on_listing(self, first_idx, folder, files, stats):
+        for i, file, stat_record in zip(range(first_idx, first_idx + len(files)), files, stats):
+            inode = (stat_record.dev, stat_record.ino)
+            first_link = self._first_link_by_inode.setdefault(inode, i)
+            if first_link != i:
+                self._links[i] = first_link
+                continue
+            if not in_size_range(stat_record.size, self._min_size, self._max_size):
+                continue
+            path = os.path.join(folder, file)
+            first = self._first_by_size.get(stat_record.size)
+            if first is None:
+                self._first_by_size[stat_record.size] = (i, path, stat_record)
+                continue
+            if first != ():
+                # the first file of this size is queued only once the size collides
+                await self._queue.put(first)
+                self._first_by_size[stat_record.size] = ()
+            await self._queue.put((i, path, stat_record))
+        self._folder_count += 1
+        self._file_count += len(files)
+        await self._report_progress()
+
+    async def _report_progress(self):
+        await self._callback.on_streaming_progress(self._folder_count, self._file_count, len(self._hashes),
+                                                   self._hashed_bytes, self._duplicate_count, self._timing)
+
+    async def _hash_worker(self):
+        loop = asyncio.get_running_loop()
+        hash_function = partial(get_hash, algorithm=self._algorithm, block_size=self._block_size,
+                                mmap_threshold=self._mmap_threshold)
+        empty_hash = get_empty_hash(self._algorithm)
+        while True:
+            i, path, stat_record = await self._queue.get()
+            try:
+                digest = None
+                if stat_record.size == 0:
+                    digest = empty_hash
+                elif self._hash_cache is not None:
+                    digest = self._hash_cache.get(stat_record, self._algorithm)
+                if digest is None:
+                    digest, io_time, hash_time = await loop.run_in_executor(self._executor, timed_hash, hash_function, path)
+                    self._timing.add(io_time, hash_time)
+                    if self._hash_cache is not None:
+                        self._hash_cache.put(stat_record, self._algorithm, digest)
+                self._hashes[i] = digest
+                self._hashed_bytes += stat_record.size
+                key = (stat_record.size, digest)
+                copies = self._copies_by_key.get(key, 0) + 1
+                self._copies_by_key[key] = copies
+                if copies == 2:
+                    self._duplicate_count += 1
+                    if self._duplicate_count == 1:
+                        self._log.debug(f"First duplicate found: {path}")
+                await self._report_progress()
+            except Exception as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    async def _save(self, file_walk, stats, hashes):
+        await self._callback.on_filewalk_saving(self._walk_file)
+        await file_walk.save_to(self._walk_file)
+        await save_stats(self._size_file, stats)
+        await save_hashes(self._hash_file, hashes, self._algorithm)
+
+    async def process(self):
+        try:
+            if len(self._folders) == 0:
+                raise Exception(f"At least one root folder must be given if walk file {self._walk_file} is not present")
+            self._queue = asyncio.Queue(maxsize=self._queue_size)
+            self._first_by_size = {}
+            self._first_link_by_inode = {}
+            self._links = {}
+            self._copies_by_key = {}
+            self._hashes = {}
+            self._errors = []
+            self._folder_count = 0
+            self._file_count = 0
+            self._hashed_bytes = 0
+            self._duplicate_count = 0
+            self._timing = HashTiming()
+
+            hash_workers = [asyncio.ensure_future(self._hash_worker()) for _ in range(self._workers)]
+            try:
+                file_walk, stats = await FileWalk.scan(*self._folders, workers=self._scan_workers, on_listing=self._on_listing,
+                                                       ignore_rules=self._ignore_rules)
+                await self._queue.join()
+            finally:
+                for hash_worker in hash_workers:
+                    hash_worker.cancel()
+                if self._hash_cache is not None:
+                    self._hash_cache.commit()
+            hashes = [self._hashes.get(self._links.get(i, i)) for i in range(len(file_walk))]
+            await self._save(file_walk, stats, hashes)
+            if len(self._errors) > 0:
+                self._log.debug(f"Hashing of {len(self._errors)} files failed, saved {len(self._hashes)} computed hashes")
+                raise self._errors[0]
+            await self._callback.on_streaming_finished(file_walk, stats, hashes)
+        except Exception as e:
+            await self._callback.on_task_error("streaming", e)
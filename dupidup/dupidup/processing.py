@@ -0,0 +1,121 @@
+'''
+Session options and creation of the processors of each phase, shared by the curses and the headless application
+'''
+from concurrent import futures
+import os
+
+from dupidup.analysis import DuplicateAnalysis, FileHashProcessor, HEAD_BLOCK_SIZE, DEFAULT_HASH_ALGORITHM, hash_stage_files, \
+    READ_BLOCK_SIZE, MMAP_THRESHOLD
+from dupidup.filewalk import FileWalkProcessor, FileSizeProcessor, SCAN_WORKERS
+from dupidup.pipeline import StreamingProcessor
+from dupidup.session import BinarySessionLoader, has_binary_session, binary_session_files
+from dupidup.rescan import RescanProcessor
+from dupidup.hashcache import HashCache, DEFAULT_MAX_ENTRIES
+from dupidup.verify import DuplicateVerifier
+from dupidup.ignore import IgnoreRules
+from dupidup.export import ReportExporter
+
+PHASE_RESCAN = "rescan"
+PHASE_SESSION = "session"
+PHASE_STREAMING = "streaming"
+PHASE_SCAN = "scan"
+
+
+class DupidupProcessing:
+    '''
+    Holds the session state and creates the processor coroutines of the phases. The subclass is the callback
+    of the processors, it starts the next phase when it's notified that the previous one finished.
+    '''
+
+    def __init__(self, temp_datadir, root_folders, ignored_folders, hash_all=False, head_size=HEAD_BLOCK_SIZE, tail_size=0,
+                 workers=4, process_pool=False, algorithm=DEFAULT_HASH_ALGORITHM, scan_workers=SCAN_WORKERS,
+                 streaming=False, rescan=False, hash_cache=None, hash_cache_size=DEFAULT_MAX_ENTRIES,
+                 verify=False, block_size=READ_BLOCK_SIZE, mmap_threshold=MMAP_THRESHOLD,
+                 min_size=0, max_size=None, export_file=None, export_format="jsonl"):
+        self._temp_datadir = temp_datadir
+        self._root_folders = [os.path.abspath(f) for f in root_folders]
+        self._ignore_rules = IgnoreRules(ignored_folders)
+        self._hash_all = hash_all
+        self._head_size = head_size
+        self._tail_size = tail_size
+        self._algorithm = algorithm
+        self._scan_workers = scan_workers
+        self._streaming = streaming
+        self._rescan = rescan
+        self._verify = verify
+        self._block_size = block_size
+        self._mmap_threshold = mmap_threshold
+        self._min_size = min_size
+        self._max_size = max_size
+        self._export_file = export_file
+        self._export_format = export_format
+        if not os.path.exists(self._temp_datadir):
+            os.makedirs(self._temp_datadir, exist_ok=False)
+        self._walk_file = os.path.join(self._temp_datadir, "file_walk.txt")
+        self._size_file = os.path.join(self._temp_datadir, "sizes.txt")
+        self._hash_file = os.path.join(self._temp_datadir, "hashes.txt")
+        if process_pool:
+            self._executor = futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self._workers = workers
+        self._hash_cache = None if hash_cache is None else HashCache(hash_cache, hash_cache_size)
+
+    def _first_phase(self):
+        '''
+        Name and processor of the phase the session starts with
+        '''
+        if self._rescan and os.path.exists(self._walk_file):
+            for binary_file in binary_session_files(self._temp_datadir):
+                if os.path.exists(binary_file):
+                    os.remove(binary_file)
+            return PHASE_RESCAN, RescanProcessor(self._root_folders, self._walk_file, self._size_file, hash_stage_files(self._hash_file),
+                                                 self, self._log, self._algorithm, workers=self._scan_workers,
+                                                 ignore_rules=self._ignore_rules).process()
+        elif has_binary_session(self._temp_datadir):
+            return PHASE_SESSION, BinarySessionLoader(self._temp_datadir, self, self._log, self._algorithm).process()
+        elif self._streaming and not os.path.exists(self._walk_file):
+            return PHASE_STREAMING, StreamingProcessor(self._root_folders, self._walk_file, self._size_file, self._hash_file, self, self._log,
+                                                       executor=self._executor, workers=self._workers, scan_workers=self._scan_workers,
+                                                       algorithm=self._algorithm, hash_cache=self._hash_cache,
+                                                       block_size=self._block_size, mmap_threshold=self._mmap_threshold,
+                                                       ignore_rules=self._ignore_rules, min_size=self._min_size,
+                                                       max_size=self._max_size).process()
+        else:
+            return PHASE_SCAN, FileWalkProcessor(self._root_folders, self._walk_file, self, self._log, workers=self._scan_workers,
+                                                 stale_files=hash_stage_files(self._hash_file), ignore_rules=self._ignore_rules).process()
+
+    def _set_walk(self, file_walk, stats=None, sizes=None):
+        self._file_walk = file_walk
+        self._total_files = len(file_walk)
+        self._stats = stats
+        if sizes is None and stats is not None:
+            sizes = [stat_record.size for stat_record in stats]
+        self._sizes = sizes
+
+    def _size_processor(self, stats=None):
+        return FileSizeProcessor(self._file_walk, self._size_file, self, self._log, stats=stats).process()
+
+    def _hash_processor(self):
+        return FileHashProcessor(self._file_walk, self._sizes, self._hash_file, self, self._log,
+                                 hash_all=self._hash_all, head_size=self._head_size, tail_size=self._tail_size,
+                                 executor=self._executor, max_pending=4 * self._workers,
+                                 algorithm=self._algorithm, stats=self._stats, hash_cache=self._hash_cache,
+                                 block_size=self._block_size, mmap_threshold=self._mmap_threshold,
+                                 min_size=self._min_size, max_size=self._max_size).process()
+
+    def _analysis_processor(self, hashes):
+        self._hashes = hashes
+        return DuplicateAnalysis.create(hashes, self._file_walk, self._sizes, self._ignore_rules, self, stats=self._stats,
+                                       min_size=self._min_size, max_size=self._max_size)
+
+    def _verification_processor(self, analysis):
+        return DuplicateVerifier(analysis, self, self._log, executor=self._executor, max_pending=4 * self._workers).process()
+
+    def _export_processor(self, analysis):
+        return ReportExporter(analysis, self._export_file, self._export_format, self, self._log).process()
+
+    def _close(self):
+        self._executor.shutdown()
+        if self._hash_cache is not None:
+            self._hash_cache.close()
@@ -1,3 +1,4 @@
+from magicur.progress import RateMeter, format_duration
 
 
 def sizeof_fmt(num, suffix='B'):
@@ -8,6 +9,12 @@ def sizeof_fmt(num, suffix='B'):
     return "%.1f %s%s" % (num, 'Yi', suffix)
 
 
+LABELS = ("Folders", "Files", "Size")
+METER_LABELS = ("Speed", "Time")
+MIN_HEIGHT = 5 + 2 * len(LABELS)
+HEIGHT = MIN_HEIGHT + 2 * len(METER_LABELS)
+
+
 def _get_segment_dims(width):
     width_in = width - 3
     width_labels = max((width_in * 30) // 100, 9)
@@ -25,9 +32,94 @@ def _get_segment_dims(width):
     return width_in + 1, width_labels, width_values
 
 
+class StageMeter(object):
+    '''
+    Throughput, elapsed time and ETA of a processing stage from the counts of processed files and bytes,
+    with the I/O and hashing time reported by the hashing processors
+    '''
+
+    def __init__(self):
+        self.files = RateMeter()
+        self.bytes = RateMeter()
+        self.timing = None
+
+    def reset(self):
+        self.files.reset()
+        self.bytes.reset()
+        self.timing = None
+
+    def update(self, file_count, byte_count=None, total_files=None, total_bytes=None, timing=None):
+        self.files.update(file_count, total_files)
+        if byte_count is not None:
+            self.bytes.update(byte_count, total_bytes)
+        if timing is not None:
+            self.timing = timing
+
+    def eta(self):
+        '''
+        Seconds left, estimated from bytes if their total is known
+        '''
+        eta = self.bytes.eta()
+        return self.files.eta() if eta is None else eta
+
+    def values(self):
+        '''
+        Measured values for the progress log, unknown ones are left out
+        '''
+        values = dict(files_per_s=self.files.rate(), bytes_per_s=self.bytes.rate(), avg_files_per_s=self.files.average(),
+                      avg_bytes_per_s=self.bytes.average(), elapsed=self.files.elapsed(), eta=self.eta())
+        if self.timing is not None:
+            values.update(io_time=self.timing.io_time, hash_time=self.timing.hash_time)
+        return {key: round(value, 2) for key, value in values.items() if value is not None}
+
+
+def _format_speed(bytes_rate, files_rate):
+    '''
+    Variants of the speed value from the longest
+    '''
+    if bytes_rate is None:
+        return [] if files_rate is None else [f"{files_rate:,.0f} files/s"]
+    elif files_rate is None:
+        return [f"{sizeof_fmt(bytes_rate)}/s"]
+    return [f"{sizeof_fmt(bytes_rate)}/s, {files_rate:,.0f} files/s", f"{sizeof_fmt(bytes_rate)}/s"]
+
+
+def _format_speeds(current, average):
+    '''
+    Variants of the current speed followed by the shortest average one, then of the current speed alone
+    '''
+    if len(current) == 0 or len(average) == 0:
+        return current
+    return [f"{speed} (avg {average[-1]})" for speed in current] + current
+
+
+def _format_time(elapsed, eta):
+    if eta is None:
+        return [format_duration(elapsed)]
+    return [f"{format_duration(elapsed)}, ETA {format_duration(eta)}", f"ETA {format_duration(eta)}"]
+
+
+def _format_io(io_time, hash_time):
+    total = io_time + hash_time
+    io_percent = 0 if total == 0 else round(100 * io_time / total)
+    return [f"read {format_duration(io_time)}, hash {format_duration(hash_time)}", f"{io_percent}% read"]
+
+
+def _format_times(elapsed, eta, timing):
+    '''
+    Variants of the time with the read vs. hash time, then of the time alone
+    '''
+    times = _format_time(elapsed, eta)
+    if timing is None:
+        return times
+    return [f"{duration}, {io}" for duration in times for io in _format_io(timing.io_time, timing.hash_time)] + times
+
+
 class ProgressWindow(object):
     '''
-    Window that displays information about file scanning, file size counting and file hashing progress
+    Window that displays information about file scanning, file size counting and file hashing progress,
+    with the current and average speed, elapsed time and ETA of the stage and the time spent reading vs. hashing.
+    The speed and time rows are left out if the terminal isn't high enough for them.
     '''
 
     def __init__(self, parent):
@@ -39,14 +131,18 @@ class ProgressWindow(object):
         self._value_files = None
         self._value_files_total = None
         self._value_folders = None
+        self._value_meter = None
 
     def draw(self):
         width = min(102, self._parent.width)
         if width < 35:
             raise Exception(f"Terminal too narrow. Needs width 35")
-        if self._parent.height < 11:
-            raise Exception(f"Terminal too small. Needs height 11")
-        win = self._parent.sub_window(width, 11, (self._parent.width - width) // 2, (self._parent.height - 11) // 2)
+        if self._parent.height < MIN_HEIGHT:
+            raise Exception(f"Terminal too small. Needs height {MIN_HEIGHT}")
+        self._show_meter = self._parent.height >= HEIGHT
+        labels = LABELS + METER_LABELS if self._show_meter else LABELS
+        height = 5 + 2 * len(labels)
+        win = self._parent.sub_window(width, height, (self._parent.width - width) // 2, (self._parent.height - height) // 2)
 
         width_in, width_labels, width_values = _get_segment_dims(width)
 
@@ -56,12 +152,11 @@ class ProgressWindow(object):
         win.put_text(0, 2, "│" + " "*width_in + "│")
         win.put_text(0, 3, "│" + " "*width_in + "│")
         win.put_text(0, 4, "╞" + "═"*width_labels + "╤" + "═"*width_values + "╡")
-        win.put_text(0, 5, "│" + "Folders ".rjust(width_labels, " ") + "│" + " "*width_values + "│")
-        win.put_text(0, 6, "├" + "─"*width_labels + "┼" + "─"*width_values + "┤")
-        win.put_text(0, 7, "│" + "Files ".rjust(width_labels, " ") + "│" + " "*width_values + "│")
-        win.put_text(0, 8, "├" + "─"*width_labels + "┼" + "─"*width_values + "┤")
-        win.put_text(0, 9, "│" + "Size ".rjust(width_labels, " ") + "│" + " "*width_values + "│")
-        win.put_text(0, 10, "└" + "─"*width_labels + "┴" + "─"*width_values + "┘")
+        for i, label in enumerate(labels):
+            if i > 0:
+                win.put_text(0, 4 + 2 * i, "├" + "─"*width_labels + "┼" + "─"*width_values + "┤")
+            win.put_text(0, 5 + 2 * i, "│" + f"{label} ".rjust(width_labels, " ") + "│" + " "*width_values + "│")
+        win.put_text(0, height - 1, "└" + "─"*width_labels + "┴" + "─"*width_values + "┘")
 
         return win
 
@@ -75,6 +170,8 @@ class ProgressWindow(object):
             self.set_num_files(self._value_folders)
         if self._value_size is not None:
             self.set_num_files(self._value_size, total=self._value_size_total)
+        if self._value_meter is not None:
+            self.set_meter(self._value_meter)
 
     def set_action_msg(self, action_msg):
         self._value_action_msg = action_msg
@@ -97,6 +194,17 @@ class ProgressWindow(object):
             val = "ERROR"
         self._window.put_text(2 + w_lab, y, (val + " ").rjust(w_val))
 
+    def _set_value_fit(self, y, variants):
+        '''
+        Sets the first of the variants that fits the value column, clears the value if none does
+        '''
+        _, _, w_val = _get_segment_dims(self._window.width)
+        for val in variants:
+            if len(val) <= w_val - 1:
+                self._set_value(y, val)
+                return
+        self._clear_value(y)
+
     def clear_num_folders(self):
         self._value_folders = None
         self._clear_value(5)
@@ -123,5 +231,13 @@ class ProgressWindow(object):
         self._value_size_total = total
         self._set_value(9, sizeof_fmt(size) if total is None else sizeof_fmt(size) + " / " + sizeof_fmt(total))
 
+    def set_meter(self, meter):
+        self._value_meter = meter
+        if not self._show_meter:
+            return
+        self._set_value_fit(11, _format_speeds(_format_speed(meter.bytes.rate(), meter.files.rate()),
+                                               _format_speed(meter.bytes.average(), meter.files.average())))
+        self._set_value_fit(13, _format_times(meter.files.elapsed(), meter.eta(), meter.timing))
+
     def refresh(self):
         self._window.refresh()
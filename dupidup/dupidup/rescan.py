@@ -0,0 +1,92 @@
+'''
+Incremental rescan of a finished or partially finished session
+'''
+import asyncio
+import os
+
+from dupidup.analysis import kind_algorithm, load_hashes, read_hash_kind, save_hashes
+from dupidup.filewalk import FileWalk, SCAN_WORKERS, load_stats, save_stats
+
+
+def _is_unchanged(old_stat, new_stat):
+    return old_stat.mtime_ns is not None and old_stat == new_stat
+
+
+class RescanProcessor:
+    '''
+    Scans the roots again and replaces the walk and size files of the session with the new scan.
+    Each of the hash files keeps the digests of files whose path, size, mtime, device and inode
+    didn't change, re-indexed to the new walk, so the hash processor hashes only new and modified files.
+    '''
+
+    def __init__(self, folders, walk_file, size_file, hash_files, callback, log, algorithm, workers=SCAN_WORKERS,
+                 ignore_rules=None):
+        self._folders = folders
+        self._walk_file = walk_file
+        self._size_file = size_file
+        self._hash_files = hash_files
+        self._callback = callback
+        self._log = log
+        self._algorithm = algorithm
+        self._workers = workers
+        self._ignore_rules = ignore_rules
+
+    async def _load_previous(self):
+        await self._callback.on_filewalk_loading(self._walk_file)
+        old_walk = await FileWalk.from_file(self._walk_file)
+        old_stats = await load_stats(self._size_file) if os.path.exists(self._size_file) else []
+        old_digests = {}
+        for hash_file in self._hash_files:
+            if os.path.exists(hash_file):
+                # partial hashes keep the kind with their block size
+                kind = read_hash_kind(hash_file) or self._algorithm
+                if kind_algorithm(kind) != self._algorithm:
+                    raise Exception(f"Hash file {hash_file} was computed with {kind}, not {self._algorithm}")
+                digests = [None] * len(old_walk)
+                await load_hashes(hash_file, digests, kind)
+                old_digests[hash_file] = (kind, digests)
+        return old_walk, old_stats, old_digests
+
+    async def _reindex(self, old_walk, old_stats, new_walk, new_stats):
+        '''
+        Maps new walk indexes of unchanged files to their old walk indexes
+        '''
+        old_idx_by_path = {}
+        for i, path in zip(range(len(old_stats)), old_walk):
+            old_idx_by_path[path] = i
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+        old_idxs = {}
+        for i, path, new_stat in zip(range(len(new_walk)), new_walk, new_stats):
+            old_i = old_idx_by_path.get(path)
+            if old_i is not None and _is_unchanged(old_stats[old_i], new_stat):
+                old_idxs[i] = old_i
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+        return old_idxs
+
+    async def process(self):
+        try:
+            self._log.debug("Incremental rescan started")
+            if len(self._folders) == 0:
+                raise Exception("At least one root folder must be given for rescan")
+            old_walk, old_stats, old_digests = await self._load_previous()
+            file_walk, stats = await FileWalk.scan(*self._folders, callback=self._callback, workers=self._workers,
+                                                   ignore_rules=self._ignore_rules)
+            old_idxs = await self._reindex(old_walk, old_stats, file_walk, stats)
+            self._log.debug(f"Rescan found {len(old_idxs)} unchanged of {len(file_walk)} files")
+
+            await self._callback.on_filewalk_saving(self._walk_file)
+            # if interrupted from here on, missing walk file makes the next run scan from scratch
+            os.remove(self._walk_file)
+            for hash_file in self._hash_files:
+                if hash_file in old_digests:
+                    kind, digests = old_digests[hash_file]
+                    await save_hashes(hash_file, [digests[old_idxs[i]] if i in old_idxs else None for i in range(len(file_walk))], kind)
+            await save_stats(self._size_file, stats)
+            await file_walk.save_to(self._walk_file)
+
+            await self._callback.on_filewalk_finished(file_walk, stats)
+            self._log.debug("Incremental rescan finished")
+        except Exception as e:
+            await self._callback.on_task_error("rescan", e)
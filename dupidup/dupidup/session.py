@@ -0,0 +1,291 @@
+'''
+Compact binary format of the session datadir, read through mmap instead of parsing text lines.
+
+file_walk.bin - header with folder and file counts and name blob length, length-prefixed folder paths, walk index
+                of the first file of each folder, offsets of the file names in the blob and the blob itself
+sizes.bin     - header, then arrays of sizes, mtimes, devices and inodes, each with one uint64 per file
+hashes.bin    - header with hash algorithm, one byte per file telling whether it was hashed, 16-byte raw digests
+
+Numbers are stored in native byte order.
+'''
+from array import array
+from concurrent import futures
+import asyncio
+import logging
+import mmap
+import os
+import struct
+
+from dupidup.analysis import FileHashProcessor, HEAD_BLOCK_SIZE
+from dupidup.filewalk import FileWalk, FileStat, load_stats
+
+WALK_MAGIC = b"DDWALK02"
+STATS_MAGIC = b"DDSTAT01"
+HASHES_MAGIC = b"DDHASH01"
+DIGEST_SIZE = 16
+
+_WALK_HEADER = struct.Struct("=8sQQQ")
+_STATS_HEADER = struct.Struct("=8sQQ")
+_HASHES_HEADER = struct.Struct("=8sQ16s")
+_LENGTH = struct.Struct("=I")
+
+WALK_FILE = "file_walk.bin"
+STATS_FILE = "sizes.bin"
+HASHES_FILE = "hashes.bin"
+
+
+def binary_session_files(datadir):
+    return tuple(os.path.join(datadir, name) for name in (WALK_FILE, STATS_FILE, HASHES_FILE))
+
+
+def has_binary_session(datadir):
+    return all(os.path.exists(path) for path in binary_session_files(datadir))
+
+
+def _map(path, magic):
+    with open(path, "rb") as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if m[:len(magic)] != magic:
+        m.close()
+        raise Exception(f"File {path} is not a binary session file of the expected type")
+    return m
+
+
+def _write_string(w, value):
+    encoded = os.fsencode(value)
+    w.write(_LENGTH.pack(len(encoded)))
+    w.write(encoded)
+
+
+def _read_string(m, offset):
+    (length,) = _LENGTH.unpack_from(m, offset)
+    offset += _LENGTH.size
+    return os.fsdecode(m[offset:offset + length]), offset + length
+
+
+async def write_walk(file_walk, path):
+    folders, folder_starts, names, name_offsets = file_walk.arrays()
+    with open(path, "wb") as w:
+        w.write(_WALK_HEADER.pack(WALK_MAGIC, len(folders), len(file_walk), len(names)))
+        for i, folder in enumerate(folders):
+            _write_string(w, folder)
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+        folder_starts.tofile(w)
+        name_offsets.tofile(w)
+        w.write(names)
+
+
+def _read_array(m, offset, count):
+    values = array("Q")
+    values.frombytes(m[offset:offset + count * values.itemsize])
+    return values, offset + count * values.itemsize
+
+
+async def read_walk(path):
+    '''
+    Only the folder paths are decoded, the file names and offsets are copied as blocks
+    '''
+    with _map(path, WALK_MAGIC) as m:
+        _, folder_count, file_count, names_length = _WALK_HEADER.unpack_from(m, 0)
+        offset = _WALK_HEADER.size
+        folders = []
+        for i in range(folder_count):
+            folder, offset = _read_string(m, offset)
+            folders.append(folder)
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+        folder_starts, offset = _read_array(m, offset, folder_count)
+        name_offsets, offset = _read_array(m, offset, file_count + 1)
+        names = bytearray(m[offset:offset + names_length])
+    return FileWalk.from_arrays(folders, folder_starts, names, name_offsets)
+
+
+class StatArray:
+    '''
+    Read-only sequence of FileStat records backed by uint64 arrays. Sizes-only records
+    from legacy size files have no mtimes, devices and inodes.
+    '''
+
+    def __init__(self, sizes, mtimes=None, devs=None, inos=None):
+        self.sizes = sizes
+        self._mtimes = mtimes
+        self._devs = devs
+        self._inos = inos
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, i):
+        if self._mtimes is None:
+            return FileStat(self.sizes[i], None, None, None)
+        return FileStat(self.sizes[i], self._mtimes[i], self._devs[i], self._inos[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+async def write_stats(stats, path):
+    full = all(stat_record.mtime_ns is not None for stat_record in stats)
+    with open(path, "wb") as w:
+        w.write(_STATS_HEADER.pack(STATS_MAGIC, len(stats), 4 if full else 1))
+        for field in range(4 if full else 1):
+            array("Q", (stat_record[field] for stat_record in stats)).tofile(w)
+            await asyncio.sleep(0)
+
+
+async def read_stats(path):
+    m = _map(path, STATS_MAGIC)
+    _, count, field_count = _STATS_HEADER.unpack_from(m, 0)
+    view = memoryview(m)
+    fields = []
+    for field in range(field_count):
+        offset = _STATS_HEADER.size + field * count * 8
+        fields.append(view[offset:offset + count * 8].cast("Q"))
+    await asyncio.sleep(0)
+    return StatArray(*fields)
+
+
+class DigestArray:
+    '''
+    Read-only sequence of hex digests backed by raw 16-byte digests, None for files that weren't hashed
+    '''
+
+    def __init__(self, algorithm, flags, digests):
+        self.algorithm = algorithm
+        self._flags = flags
+        self._digests = digests
+
+    def __len__(self):
+        return len(self._flags)
+
+    def __getitem__(self, i):
+        if self._flags[i] == 0:
+            return None
+        return self._digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE].hex()
+
+    def raw(self, i):
+        return bytes(self._digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE])
+
+    def hashed_flags(self):
+        return self._flags
+
+    def raw_digests(self):
+        return self._digests
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+async def write_hashes(hashes, algorithm, path):
+    with open(path, "wb") as w:
+        w.write(_HASHES_HEADER.pack(HASHES_MAGIC, len(hashes), algorithm.encode()))
+        w.write(bytes(0 if digest is None else 1 for digest in hashes))
+        empty = bytes(DIGEST_SIZE)
+        for i, digest in enumerate(hashes):
+            if digest is None:
+                w.write(empty)
+            else:
+                raw = bytes.fromhex(digest)
+                if len(raw) != DIGEST_SIZE:
+                    raise Exception(f"Digest {digest} of file {i} is not {DIGEST_SIZE} bytes long")
+                w.write(raw)
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+
+
+async def read_hashes(path, algorithm):
+    m = _map(path, HASHES_MAGIC)
+    _, count, file_algorithm = _HASHES_HEADER.unpack_from(m, 0)
+    file_algorithm = file_algorithm.rstrip(b"\0").decode()
+    if file_algorithm != algorithm:
+        m.close()
+        raise Exception(f"Hash file {path} was computed with {file_algorithm}, not {algorithm}")
+    view = memoryview(m)
+    offset = _HASHES_HEADER.size
+    flags = view[offset:offset + count]
+    digests = view[offset + count:offset + count + count * DIGEST_SIZE]
+    await asyncio.sleep(0)
+    return DigestArray(file_algorithm, flags, digests)
+
+
+async def load_session(datadir, algorithm):
+    walk_path, stats_path, hashes_path = binary_session_files(datadir)
+    file_walk = await read_walk(walk_path)
+    stats = await read_stats(stats_path)
+    hashes = await read_hashes(hashes_path, algorithm)
+    if len(stats) != len(file_walk) or len(hashes) != len(file_walk):
+        raise Exception(f"Integrity error: binary session in {datadir} has {len(file_walk)} files, {len(stats)} sizes and {len(hashes)} hashes")
+    return file_walk, stats, hashes
+
+
+class _UnfinishedHashing(futures.Executor):
+
+    def __init__(self, hash_file):
+        self._hash_file = hash_file
+
+    def submit(self, fn, *args, **kwargs):
+        raise Exception(f"Hashing of the session {self._hash_file} isn't finished, finish it before converting the session")
+
+
+class _ConversionCallback:
+
+    def __init__(self):
+        self.hashes = None
+        self.error = None
+
+    async def on_hashing_started(self, stage, file_count, byte_count):
+        pass
+
+    async def on_hashing_progress(self, file_count, byte_count, timing):
+        pass
+
+    async def on_hashing_finished(self, hashes):
+        self.hashes = hashes
+
+    async def on_task_error(self, task, error):
+        self.error = error
+
+
+async def convert_session(walk_file, size_file, hash_file, datadir, algorithm, hash_all=False, head_size=HEAD_BLOCK_SIZE,
+                          tail_size=0, min_size=0, max_size=None):
+    '''
+    Converts finished text session files to the binary session format in datadir. The digests are collected
+    from the hash files of all stages like the hashing does, with the options the session was hashed with.
+    Fails without converting if any file still needs to be hashed.
+    '''
+    walk_path, stats_path, hashes_path = binary_session_files(datadir)
+    file_walk = await FileWalk.from_file(walk_file)
+    stats = await load_stats(size_file)
+    if len(stats) != len(file_walk):
+        raise Exception(f"Size file {size_file} isn't finished, it has {len(stats)} of {len(file_walk)} sizes")
+    callback = _ConversionCallback()
+    await FileHashProcessor(file_walk, [stat_record.size for stat_record in stats], hash_file, callback,
+                            logging.getLogger(__name__), hash_all=hash_all, head_size=head_size, tail_size=tail_size,
+                            executor=_UnfinishedHashing(hash_file), algorithm=algorithm, stats=stats,
+                            min_size=min_size, max_size=max_size).process()
+    if callback.error is not None:
+        raise callback.error
+    await write_walk(file_walk, walk_path)
+    await write_stats(stats, stats_path)
+    await write_hashes(callback.hashes, algorithm, hashes_path)
+
+
+class BinarySessionLoader:
+
+    def __init__(self, datadir, callback, log, algorithm):
+        self._datadir = datadir
+        self._callback = callback
+        self._log = log
+        self._algorithm = algorithm
+
+    async def process(self):
+        try:
+            self._log.debug(f"Loading binary session from {self._datadir}")
+            await self._callback.on_filewalk_loading(binary_session_files(self._datadir)[0])
+            file_walk, stats, hashes = await load_session(self._datadir, self._algorithm)
+            await self._callback.on_session_loaded(file_walk, stats, hashes)
+        except Exception as e:
+            await self._callback.on_task_error("binary session loading", e)
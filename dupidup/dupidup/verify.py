@@ -0,0 +1,131 @@
+'''
+Byte-for-byte verification of the duplicates found by the analysis
+'''
+from collections import deque
+import asyncio
+import os
+
+from dupidup.analysis import DuplicateAnalysis, DupItem
+
+VERIFY_CHUNK_SIZE = 1024 * 1024
+MAX_OPEN_FILES = 64
+MAX_PENDING_GROUPS = 16
+
+
+def row_paths(dirs, row):
+    return [os.path.join(folder, file) for folder, files in zip(dirs, row.files) for file in files]
+
+
+def _open(path):
+    try:
+        return open(path, "rb", buffering=0)
+    except OSError:
+        return None
+
+
+def _compare_batch(reference, paths, chunk_size):
+    '''
+    Reads the reference and the other files in lockstep, returns the paths whose content
+    equals the reference. A file stops being read at its first mismatching chunk or read error.
+    '''
+    files = [_open(path) for path in paths]
+    try:
+        with open(reference, "rb", buffering=0) as ref:
+            ref_buf = bytearray(chunk_size)
+            buf = bytearray(chunk_size)
+            ref_view = memoryview(ref_buf)
+            view = memoryview(buf)
+            matching = [j for j in range(len(paths)) if files[j] is not None]
+            while len(matching) > 0:
+                n = ref.readinto(ref_view)
+                still_matching = []
+                for j in matching:
+                    try:
+                        read = files[j].readinto(view)
+                    except OSError:
+                        continue
+                    # short reads are only expected at the end of the file
+                    if read == n and view[:n] == ref_view[:n]:
+                        still_matching.append(j)
+                matching = still_matching
+                if n == 0:
+                    break
+            return [paths[j] for j in matching]
+    finally:
+        for f in files:
+            if f is not None:
+                f.close()
+
+
+def verify_group(paths, chunk_size=VERIFY_CHUNK_SIZE, max_open_files=MAX_OPEN_FILES):
+    '''
+    Paths of the group that are byte-for-byte equal to its first path. Files that can't be read
+    aren't identical to any other, if it's the first path the result is empty.
+    '''
+    reference = paths[0]
+    others = paths[1:]
+    identical = [reference]
+    try:
+        for start in range(0, len(others), max_open_files - 1):
+            identical.extend(_compare_batch(reference, others[start:start + max_open_files - 1], chunk_size))
+    except OSError:
+        return []
+    return identical
+
+
+class DuplicateVerifier:
+    '''
+    Compares the members of each duplicate group of the analysis chunk by chunk in the given executor
+    (loop's default one if None). Rows whose members aren't all identical are removed from the verified analysis
+    and reported as mismatches, i.e. lists of (hash, paths, identical paths).
+    '''
+
+    def __init__(self, analysis, callback, log, executor=None, chunk_size=VERIFY_CHUNK_SIZE,
+                 max_pending=MAX_PENDING_GROUPS):
+        self._analysis = analysis
+        self._callback = callback
+        self._log = log
+        self._executor = executor
+        self._chunk_size = chunk_size
+        self._max_pending = max_pending
+
+    async def process(self):
+        try:
+            groups = [(item, row, row_paths(item.dirs, row)) for item in self._analysis.items for row in item.rows]
+            total_files = sum(len(paths) for _, _, paths in groups)
+            total_bytes = sum(row.size * len(paths) for _, row, paths in groups)
+            self._log.debug(f"Verifying {len(groups)} duplicate groups, {total_files} files")
+            await self._callback.on_verification_started(total_files, total_bytes)
+
+            loop = asyncio.get_running_loop()
+            pending = deque()
+            verified_rows = {}
+            mismatches = []
+            file_count = 0
+            byte_count = 0
+            submitted = 0
+            try:
+                while submitted < len(groups) or len(pending) > 0:
+                    while submitted < len(groups) and len(pending) < self._max_pending:
+                        item, row, paths = groups[submitted]
+                        future = loop.run_in_executor(self._executor, verify_group, paths, self._chunk_size)
+                        pending.append((item, row, paths, future))
+                        submitted += 1
+                    item, row, paths, future = pending.popleft()
+                    identical = await future
+                    if len(identical) == len(paths):
+                        verified_rows.setdefault(id(item), []).append(row)
+                    else:
+                        self._log.warning(f"Files with hash {row.hash_value} differ: {repr(paths)}")
+                        mismatches.append((row.hash_value, paths, identical))
+                    file_count += len(paths)
+                    byte_count += row.size * len(paths)
+                    await self._callback.on_verification_progress(file_count, byte_count)
+            finally:
+                for _, _, _, future in pending:
+                    future.cancel()
+
+            items = [DupItem(item.dirs, verified_rows[id(item)]) for item in self._analysis.items if id(item) in verified_rows]
+            await self._callback.on_verification_finished(DuplicateAnalysis(items, self._analysis.hardlinks), mismatches)
+        except Exception as e:
+            await self._callback.on_task_error("verification", e)
@@ -1,12 +1,21 @@
-from dupidup.progress import ProgressWindow, sizeof_fmt
+from dupidup.progress import ProgressWindow, StageMeter, sizeof_fmt
 from dupidup.browser import DuplicateBrowser
 import traceback
 
+HASHING_MESSAGES = {
+    "head": "Hashing beginnings of files ...",
+    "tail": "Hashing ends of files ...",
+    "full": "Computing file hashes ..."
+}
+
 
 class RootView:
 
     def __init__(self, screen):
         self._screen = screen
+        self._progress = None
+        self._browser = None
+        self._meter = StageMeter()
 
     def clear(self):
         bg = self._screen.sub_window(self._screen.width, self._screen.height, 0, 0)
@@ -32,6 +41,13 @@ class RootView:
         if self._progress is not None:
             self._progress.resize(new_width, new_height)
 
+    def _reset_rates(self):
+        self._meter.reset()
+
+    def _show_rates(self, file_count, byte_count=None, total_files=None, total_bytes=None, timing=None):
+        self._meter.update(file_count, byte_count, total_files, total_bytes, timing)
+        self._progress.set_meter(self._meter)
+
     def show_error(self, exception):
         self.clear()
         self._progress = None
@@ -52,6 +68,20 @@ class RootView:
         self._progress.set_num_files(file_count)
         self._progress.refresh()
 
+    def show_streaming(self):
+        self._progress = ProgressWindow(self)
+        self._progress.set_action_msg("Scanning and hashing files ...")
+        self._reset_rates()
+        self._progress.refresh()
+
+    def update_streaming(self, folder_count, file_count, hashed_count, hashed_bytes, duplicate_count, timing=None):
+        self._progress.set_action_msg(f"Scanning and hashing files, {duplicate_count:,} duplicates found ...")
+        self._progress.set_num_folders(folder_count)
+        self._progress.set_num_files(hashed_count, total=file_count)
+        self._progress.set_size(hashed_bytes)
+        self._show_rates(hashed_count, hashed_bytes, timing=timing)
+        self._progress.refresh()
+
     def show_loading(self, walk_file):
         self._progress.set_action_msg(f"Loading walk file {walk_file} ...")
         self._progress.refresh()
@@ -64,22 +94,26 @@ class RootView:
         self._progress.set_num_folders(folder_count)
         self._progress.set_num_files(file_count)
         self._progress.set_action_msg("Counting file sizes ...")
+        self._reset_rates()
         self._progress.refresh()
 
     def update_size_counting(self, file_count, total_files, byte_count):
         self._progress.set_num_files(file_count, total=total_files)
         self._progress.set_size(byte_count)
+        self._show_rates(file_count, total_files=total_files)
         self._progress.refresh()
 
-    def show_hashing(self, total_files, total_bytes):
+    def show_hashing(self, stage, total_files, total_bytes):
         self._progress.set_num_files(total_files)
         self._progress.set_size(total_bytes)
-        self._progress.set_action_msg("Computing file hashes ...")
+        self._progress.set_action_msg(HASHING_MESSAGES.get(stage, f"Computing {stage} hashes ..."))
+        self._reset_rates()
         self._progress.refresh()
 
-    def update_hashing(self, file_count, total_files, byte_count, total_bytes):
+    def update_hashing(self, file_count, total_files, byte_count, total_bytes, timing=None):
         self._progress.set_num_files(file_count, total=total_files)
         self._progress.set_size(byte_count, total=total_bytes)
+        self._show_rates(file_count, byte_count, total_files, total_bytes, timing)
         self._progress.refresh()
 
     def show_analysing(self):
@@ -90,15 +124,33 @@ class RootView:
         self._progress.set_num_files(file_count, total=total_files)
         self._progress.refresh()
 
+    def show_verifying(self):
+        self._progress.set_action_msg("Verifying duplicates byte for byte ...")
+        self._reset_rates()
+        self._progress.refresh()
+
+    def update_verifying(self, file_count, total_files, byte_count, total_bytes):
+        self._progress.set_num_files(file_count, total=total_files)
+        self._progress.set_size(byte_count, total=total_bytes)
+        self._show_rates(file_count, byte_count, total_files, total_bytes)
+        self._progress.refresh()
+
     def show_browser(self, analysis):
         self._progress = None
         self.clear()
         self._browser = DuplicateBrowser(self, analysis)
         self._browser.refresh()
         self._status = Status(self)
-        self._status.message(f"Duplicated bytes: {sizeof_fmt(analysis.get_duplicated_bytes())}")
+        message = f"Duplicated bytes: {sizeof_fmt(analysis.get_duplicated_bytes())}"
+        if len(analysis.hardlinks) > 0:
+            message += f", hardlinked inodes: {len(analysis.hardlinks)}"
+        self._status.message(message)
         self._status.refresh()
 
+    def on_key(self, key):
+        if self._browser is not None and self._browser.on_key(key):
+            self._browser.refresh()
+
 
 class Status():
 
@@ -11,4 +11,8 @@ setup(name='dupidup',
       zip_safe=False,
       install_requires=[
           'docopt', 'magicur'
-      ])
+      ],
+      extras_require={
+          'xxhash': ['xxhash'],
+          'numpy': ['numpy']
+      })
@@ -1,10 +1,30 @@
-from dupidup.filewalk import FileWalk, get_size
+from dupidup.filewalk import FileWalk, FileStat, NoopProgressCallback, get_size, get_stat, save_stats
 import unittest
 import tempfile
 import os
 from os.path import dirname
 import asyncio
-from dupidup.analysis import get_hash
+import hashlib
+import time
+from dupidup.analysis import get_hash, get_candidates, FileHashProcessor, load_hashes, hash_stage_files, DuplicateAnalysis, DupItem, \
+    HashTiming, timed_hash, get_head_hash
+import logging
+from concurrent import futures
+from dupidup.pipeline import StreamingProcessor
+from dupidup.session import convert_session, load_session, has_binary_session, write_hashes, read_hashes, write_walk, read_walk
+from dupidup.rescan import RescanProcessor
+from dupidup.hashcache import HashCache
+from dupidup.verify import DuplicateVerifier, verify_group
+from dupidup import grouping
+from dupidup.ignore import IgnoreRules
+from dupidup.checkpoint import CheckpointWriter, checkpoint_path, recover
+from dupidup.headless import HeadlessApplication, JsonProgress
+from dupidup.export import export_analysis, ReportExporter, EXPORT_FORMATS
+import base64
+import csv
+import io
+import json
+from functools import partial
 
 
 class TestFileWalk(unittest.TestCase):
@@ -86,6 +106,22 @@ class TestFileWalk(unittest.TestCase):
         with self.assertRaises(IndexError) as _:
             f[-5]
 
+    def test_filewalk_empty_folders(self):
+        f = FileWalk()
+        f.add_directory("/e1", [])
+        f.add_directory("/home/u", ["a.txt"])
+        f.add_directory("/e2", [])
+        f.add_directory("/e3", [])
+        f.add_directory("/home/v", ["b.txt", "c.txt"])
+        f.add_directory("/e4", [])
+        self.assertEqual(3, len(f))
+        self.assertEqual(6, f.folder_count())
+        self.assertEqual(["/home/u/a.txt", "/home/v/b.txt", "/home/v/c.txt"], [f[i] for i in range(3)])
+        self.assertEqual(["/home/u/a.txt", "/home/v/b.txt", "/home/v/c.txt"], list(f))
+        self.assertEqual(["/home/v/c.txt"], list(f.tail(2)))
+        self.assertEqual([], list(f.tail(3)))
+        self.assertEqual([("/e1", []), ("/home/u", ["a.txt"])], list(f.listings())[:2])
+
     def test_filewalk_iteration(self):
         f = [file for file in self._create_test_firewalk()]
         self.assertEquals(len(f), 4)
@@ -109,8 +145,992 @@ class TestFileWalk(unittest.TestCase):
                 f2 = await FileWalk.from_file(os.path.join(tmpdirname, "file_walk.txt"))
                 self.assertEquals(f, f2)
 
+                f3, stats = await FileWalk.scan(tmpdirname, workers=1)
+                self.assertEqual(sorted(list(f) + [os.path.join(tmpdirname, "file_walk.txt")]), sorted(f3))
+                self.assertEqual([get_stat(path) for path in f3], stats)
+
+            asyncio.run(async_test())
+
+    def test_scan_skips_unreadable_entries(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            self._create_test_directory(tmpdirname)
+            os.symlink(os.path.join(tmpdirname, "missing.txt"), os.path.join(tmpdirname, "d", "dangling.txt"))
+            f, stats = asyncio.run(FileWalk.scan(tmpdirname, workers=1))
+            self.assertEqual(9, len(f))
+            self.assertNotIn(os.path.join(tmpdirname, "d", "dangling.txt"), f)
+            self.assertEqual([get_stat(path) for path in f], stats)
+
+
+class RecordingCallback:
+
+    def __init__(self):
+        self.hashes = None
+        self.hashing_started = []
+        self.error = None
+
+    async def on_hashing_started(self, stage, file_count, byte_count):
+        self.hashing_started.append((stage, file_count, byte_count))
+
+    async def on_hashing_progress(self, file_count, byte_count, timing):
+        self.timing = timing
+
+    async def on_hashing_finished(self, hashes):
+        self.hashes = hashes
+
+    async def on_task_error(self, task, error):
+        self.error = error
+
+
+class TestFileHash(unittest.TestCase):
+
+    def test_candidates(self):
+        self.assertEqual([0, 2, 3, 4], get_candidates([1, 2, 1, 3, 3]))
+        self.assertEqual([], get_candidates([1, 2, 3]))
+
+    def _create_files(self, tmpdirname, contents):
+        names = [f"{i}.txt" for i in range(len(contents))]
+        for name, content in zip(names, contents):
+            with open(os.path.join(tmpdirname, name), "w") as f:
+                f.write(content)
+        f = FileWalk()
+        f.add_directory(tmpdirname, names)
+        return f
+
+    def _hash(self, file_walk, sizes, hash_file, **kwargs):
+        callback = RecordingCallback()
+        processor = FileHashProcessor(file_walk, sizes, hash_file, callback, logging.getLogger("test"), **kwargs)
+        asyncio.run(processor.process())
+        self.assertIsNone(callback.error)
+        return callback
+
+    def test_hash_only_candidates(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = self._create_files(tmpdirname, ["AA", "B", "CC", "AA"])
+            hash_file = os.path.join(tmpdirname, "hashes.txt")
+            callback = self._hash(f, [2, 1, 2, 2], hash_file)
+            self.assertEqual([("head", 3, 6), ("full", 2, 4)], callback.hashing_started)
+            self.assertEqual([get_hash(f[0]), None, None, get_hash(f[0])], callback.hashes)
+
+            # resumed run reads the indexed hash files and doesn't need to hash anything
+            callback = self._hash(f, [2, 1, 2, 2], hash_file)
+            self.assertEqual([get_hash(f[0]), None, None, get_hash(f[0])], callback.hashes)
+
+            callback = self._hash(f, [2, 1, 2, 2], os.path.join(tmpdirname, "all.txt"), hash_all=True)
+            self.assertEqual([("full", 4, 7)], callback.hashing_started)
+            self.assertEqual([get_hash(path) for path in f], callback.hashes)
+
+    def test_hash_stages(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = self._create_files(tmpdirname, ["AAx", "AAy", "AAx", "BBx"])
+            hash_file = os.path.join(tmpdirname, "hashes.txt")
+            callback = self._hash(f, [3, 3, 3, 3], hash_file, head_size=2, tail_size=1)
+            self.assertEqual([("head", 4, 8), ("tail", 3, 3), ("full", 2, 6)], callback.hashing_started)
+            self.assertEqual([get_hash(f[0]), None, get_hash(f[0]), None], callback.hashes)
+            self.assertTrue(os.path.exists(os.path.join(tmpdirname, "hashes_head.txt")))
+            self.assertTrue(os.path.exists(os.path.join(tmpdirname, "hashes_tail.txt")))
+
+            # partial hashes of another block size are thrown away, not checked against the new ones
+            callback = self._hash(f, [3, 3, 3, 3], hash_file, head_size=1, tail_size=2)
+            self.assertEqual([("head", 4, 4), ("tail", 3, 6), ("full", 2, 6)], callback.hashing_started)
+            self.assertEqual([get_hash(f[0]), None, get_hash(f[0]), None], callback.hashes)
+            with open(os.path.join(tmpdirname, "hashes_head.txt")) as hf:
+                self.assertEqual("#md5:head:1", hf.readline().strip())
+
+    def test_hash_in_executors(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            contents = [str(i % 3) * 10 for i in range(20)]
+            f = self._create_files(tmpdirname, contents)
+            for name, executor in [("threads", futures.ThreadPoolExecutor(4)), ("processes", futures.ProcessPoolExecutor(2))]:
+                with executor:
+                    hash_file = os.path.join(tmpdirname, f"{name}.txt")
+                    callback = self._hash(f, [10] * 20, hash_file, hash_all=True, executor=executor, max_pending=3)
+                    self.assertEqual([get_hash(path) for path in f], callback.hashes)
+                    with open(hash_file) as hf:
+                        self.assertEqual(["#md5"] + [f"{i} {get_hash(f[i])}" for i in range(20)], hf.read().splitlines())
+
+    def test_hash_algorithms(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = self._create_files(tmpdirname, ["Hello", "Hello"])
+            self.assertEqual("8b1a9953c4611296a827abf8c47804d7", get_hash(f[0], "md5"))
+            self.assertEqual(32, len(get_hash(f[0], "blake2b")))
+            hash_file = os.path.join(tmpdirname, "hashes.txt")
+            callback = self._hash(f, [5, 5], hash_file, algorithm="blake2b")
+            self.assertEqual([get_hash(f[0], "blake2b")] * 2, callback.hashes)
+
+            # session hashed with one algorithm can't be continued with another one
+            callback = RecordingCallback()
+            processor = FileHashProcessor(f, [5, 5], hash_file, callback, logging.getLogger("test"), algorithm="md5")
+            asyncio.run(processor.process())
+            self.assertIsNotNone(callback.error)
+
+            with self.assertRaises(Exception) as _:
+                get_hash(f[0], "crc0")
+
+    def test_size_range(self):
+        self.assertEqual([3, 4], get_candidates([1, 2, 1, 3, 3], min_size=2))
+        self.assertEqual([0, 2], get_candidates([1, 2, 1, 3, 3], max_size=2))
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = self._create_files(tmpdirname, ["", "", "ab", "ab", "abcd", "abcd"])
+            hash_file = os.path.join(tmpdirname, "hashes.txt")
+            callback = self._hash(f, [0, 0, 2, 2, 4, 4], hash_file, min_size=0, max_size=3)
+            self.assertEqual([get_hash(path) for path in f][:4] + [None, None], callback.hashes)
+            self.assertEqual([("head", 4, 4), ("full", 4, 4)], callback.hashing_started)
+
+            # resumed with a smaller range, the stage files have digests of files that are out of it now
+            callback = self._hash(f, [0, 0, 2, 2, 4, 4], hash_file, min_size=1, max_size=3)
+            self.assertEqual([None, None] + [get_hash(path) for path in f][2:4] + [None, None], callback.hashes)
+            analysis_callback = AnalysisCallback()
+            asyncio.run(DuplicateAnalysis.create([get_hash(path) for path in f], f, [0, 0, 2, 2, 4, 4], IgnoreRules(),
+                                                 analysis_callback, min_size=1, max_size=3))
+            self.assertEqual([[["2.txt", "3.txt"]]], [item.rows[0].files for item in analysis_callback.analysis.items])
+
+    def test_empty_files_not_opened(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = FileWalk()
+            # zero-length files that don't exist would fail if opened
+            f.add_directory(tmpdirname, ["missing1", "missing2"])
+            callback = self._hash(f, [0, 0], os.path.join(tmpdirname, "hashes.txt"), executor=FailingExecutor())
+            self.assertEqual([hashlib.md5().hexdigest()] * 2, callback.hashes)
+
+    def test_empty_files_yield(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = FileWalk()
+            f.add_directory(tmpdirname, [f"missing{i}" for i in range(5000)])
+            ticks, callback = ticks_while_hashing(f, [0] * 5000, os.path.join(tmpdirname, "hashes.txt"), executor=FailingExecutor())
+            self.assertIsNone(callback.error)
+            self.assertEqual([hashlib.md5().hexdigest()] * 5000, callback.hashes)
+            self.assertGreaterEqual(ticks, 4)
+
+    def test_read_paths(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            content = os.urandom(100000)
+            path = os.path.join(tmpdirname, "data")
+            with open(path, "wb") as f:
+                f.write(content)
+            expected = hashlib.md5(content).hexdigest()
+            self.assertEqual(expected, get_hash(path))
+            self.assertEqual(expected, get_hash(path, block_size=4096))
+            self.assertEqual(expected, get_hash(path, block_size=3000, mmap_threshold=1))
+            self.assertEqual(expected, get_hash(path, mmap_threshold=len(content) + 1))
+
+    def test_hash_timing(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            content = os.urandom(100000)
+            path = os.path.join(tmpdirname, "data")
+            with open(path, "wb") as f:
+                f.write(content)
+            timing = HashTiming()
+            get_hash(path, block_size=4096, timing=timing)
+            self.assertGreater(timing.io_time, 0)
+            self.assertGreater(timing.hash_time, 0)
+            digest, io_time, hash_time = timed_hash(get_hash, path)
+            self.assertEqual(hashlib.md5(content).hexdigest(), digest)
+            self.assertGreater(io_time + hash_time, 0)
+            digest, io_time, hash_time = timed_hash(partial(get_head_hash, block_size=10), path)
+            self.assertEqual(hashlib.md5(content[:10]).hexdigest(), digest)
+            self.assertGreater(io_time + hash_time, 0)
+
+
+class StreamingCallback(RecordingCallback):
+
+    def __init__(self):
+        super().__init__()
+        self.duplicate_count = 0
+        self.result = None
+
+    async def on_streaming_progress(self, folder_count, file_count, hashed_count, hashed_bytes, duplicate_count, timing):
+        self.duplicate_count = duplicate_count
+
+    async def on_filewalk_saving(self, walk_file):
+        pass
+
+    async def on_streaming_finished(self, file_walk, stats, hashes):
+        self.result = (file_walk, stats, hashes)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_streaming(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            session = [os.path.join(tmpdirname, name) for name in ["file_walk.txt", "sizes.txt", "hashes.txt"]]
+            callback = StreamingCallback()
+            processor = StreamingProcessor([root], *session, callback, logging.getLogger("test"), workers=2, queue_size=1)
+            asyncio.run(processor.process())
+            self.assertIsNone(callback.error)
+            self.assertEqual(3, callback.duplicate_count)
+            file_walk, stats, hashes = callback.result
+            self.assertEqual(9, len(file_walk))
+            self.assertEqual([get_hash(path) for path in file_walk], hashes)
+
+            # saved session is continued by the regular processors without any more hashing
+            loaded_walk = asyncio.run(FileWalk.from_file(session[0]))
+            self.assertEqual(file_walk, loaded_walk)
+            callback = RecordingCallback()
+            processor = FileHashProcessor(loaded_walk, [stat_record.size for stat_record in stats], session[2], callback,
+                                          logging.getLogger("test"), hash_all=True)
+            asyncio.run(processor.process())
+            self.assertEqual([("full", 9, 9)], callback.hashing_started)
+            self.assertEqual(hashes, callback.hashes)
+
+    def test_streaming_error_saves_session(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            session = [os.path.join(tmpdirname, name) for name in ["file_walk.txt", "sizes.txt", "hashes.txt"]]
+            callback = StreamingCallback()
+            with PathFailingExecutor("c.txt", max_workers=2) as executor:
+                processor = StreamingProcessor([root], *session, callback, logging.getLogger("test"), executor=executor, workers=2)
+                asyncio.run(processor.process())
+            self.assertIsInstance(callback.error, OSError)
+            self.assertIsNone(callback.result)
+
+            # the hashes computed before the error are kept, only the failed file is hashed again
+            loaded_walk = asyncio.run(FileWalk.from_file(session[0]))
+            self.assertEqual(9, len(loaded_walk))
+            sizes = [get_size(path) for path in loaded_walk]
+            callback = RecordingCallback()
+            with PathFailingExecutor(None, max_workers=2) as executor:
+                processor = FileHashProcessor(loaded_walk, sizes, session[2], callback, logging.getLogger("test"), hash_all=True,
+                                              executor=executor)
+                asyncio.run(processor.process())
+            self.assertEqual([os.path.join(root, "c.txt")], executor.submitted)
+            self.assertEqual([get_hash(path) for path in loaded_walk], callback.hashes)
+
+
+class PathFailingExecutor(futures.ThreadPoolExecutor):
+
+    def __init__(self, failing_name, **kwargs):
+        super().__init__(**kwargs)
+        self._failing_name = failing_name
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        if self._failing_name is not None and args[-1].endswith(self._failing_name):
+            raise OSError(f"Can't read {args[-1]}")
+        self.submitted.append(args[-1])
+        return super().submit(fn, *args, **kwargs)
+
+
+class TestSession(unittest.TestCase):
+
+    def test_convert_and_load(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            log = logging.getLogger("test")
+
+            async def async_test(datadir, head_size):
+                os.makedirs(datadir)
+                walk_file, size_file, hash_file = [os.path.join(datadir, name) for name in ["file_walk.txt", "sizes.txt", "hashes.txt"]]
+                file_walk, stats = await FileWalk.scan(root)
+                await file_walk.save_to(walk_file)
+                await save_stats(size_file, stats)
+                sizes = [stat_record.size for stat_record in stats]
+
+                # a session that isn't hashed yet isn't converted
+                with self.assertRaises(Exception) as _:
+                    await convert_session(walk_file, size_file, hash_file, datadir, "md5", head_size=head_size)
+                self.assertFalse(has_binary_session(datadir))
+
+                callback = RecordingCallback()
+                await FileHashProcessor(file_walk, sizes, hash_file, callback, log, head_size=head_size, stats=stats).process()
+                self.assertIsNone(callback.error)
+                hashes = callback.hashes
+                self.assertEqual([None if digest is None else get_hash(path) for path, digest in zip(file_walk, hashes)], hashes)
+                self.assertGreaterEqual(len([digest for digest in hashes if digest is not None]), 6)
+
+                await convert_session(walk_file, size_file, hash_file, datadir, "md5", head_size=head_size)
+                self.assertTrue(has_binary_session(datadir))
+                file_walk2, stats2, hashes2 = await load_session(datadir, "md5")
+                self.assertEqual(file_walk, file_walk2)
+                self.assertEqual(stats, list(stats2))
+                self.assertEqual(sizes, list(stats2.sizes))
+                self.assertEqual(hashes, list(hashes2))
+                with self.assertRaises(Exception) as _:
+                    await load_session(datadir, "blake2b")
+
+            # small files are covered by the head stage and never get to the full hash file
+            asyncio.run(async_test(os.path.join(tmpdirname, "covered"), 4096))
+            self.assertFalse(os.path.exists(os.path.join(tmpdirname, "covered", "hashes.txt")))
+            asyncio.run(async_test(os.path.join(tmpdirname, "full"), 0))
+            self.assertTrue(os.path.exists(os.path.join(tmpdirname, "full", "hashes.txt")))
+
+    def test_walk_blocks(self):
+        file_walk = FileWalk()
+        file_walk.add_directory("/a", ["b", "caf\udce9"])
+        file_walk.add_directory("/a/empty", [])
+        file_walk.add_directory("/a/c", ["d"])
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            walk_path = os.path.join(tmpdirname, "file_walk.bin")
+            asyncio.run(write_walk(file_walk, walk_path))
+            loaded = asyncio.run(read_walk(walk_path))
+        self.assertEqual(file_walk, loaded)
+        self.assertEqual(["/a/b", "/a/caf\udce9", "/a/c/d"], list(loaded))
+        loaded.add_directory("/e", ["f"])
+        self.assertEqual("/e/f", loaded[3])
+
+
+class RescanCallback(NoopProgressCallback):
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+
+    async def on_filewalk_finished(self, file_walk, stats=None):
+        self.result = (file_walk, stats)
+
+    async def on_task_error(self, task, error):
+        self.error = error
+
+
+class TestRescan(unittest.TestCase):
+
+    def test_rescan_keeps_unchanged_hashes(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            walk_file, size_file, hash_file = [os.path.join(tmpdirname, name) for name in ["file_walk.txt", "sizes.txt", "hashes.txt"]]
+            log = logging.getLogger("test")
+
+            async def async_test():
+                file_walk, stats = await FileWalk.scan(root)
+                await file_walk.save_to(walk_file)
+                await save_stats(size_file, stats)
+                callback = RecordingCallback()
+                await FileHashProcessor(file_walk, [s.size for s in stats], hash_file, callback, log, hash_all=True).process()
+
+                modified = os.path.join(root, "d", "e.txt")
+                with open(modified, "w") as f:
+                    f.write("X")
+                os.utime(modified, ns=(0, 0))
+                TestFileWalk()._create_file(os.path.join(root, "new.txt"), "N")
+
+                callback = RescanCallback()
+                await RescanProcessor([root], walk_file, size_file, hash_stage_files(hash_file), callback, log, "md5").process()
+                self.assertIsNone(callback.error)
+                new_walk, new_stats = callback.result
+                self.assertEqual(10, len(new_walk))
+                self.assertEqual(new_walk, await FileWalk.from_file(walk_file))
+                digests = [None] * len(new_walk)
+                await load_hashes(hash_file, digests, "md5")
+                for path, digest in zip(new_walk, digests):
+                    if path in (modified, os.path.join(root, "new.txt")):
+                        self.assertIsNone(digest)
+                    else:
+                        self.assertEqual(get_hash(path), digest)
+
+                callback = RecordingCallback()
+                await FileHashProcessor(new_walk, [s.size for s in new_stats], hash_file, callback, log, hash_all=True).process()
+                self.assertEqual([("full", 10, 10)], callback.hashing_started)
+                self.assertEqual([get_hash(path) for path in new_walk], callback.hashes)
+
             asyncio.run(async_test())
 
 
+class FailingExecutor(futures.Executor):
+
+    def submit(self, fn, *args, **kwargs):
+        raise Exception("Nothing should be hashed")
+
+
+class ConstantHashCache:
+
+    def __init__(self, digest):
+        self._digest = digest
+
+    def get(self, stat_record, kind):
+        return self._digest
+
+    def put(self, stat_record, kind, digest):
+        pass
+
+    def commit(self):
+        pass
+
+
+def ticks_while_hashing(file_walk, sizes, hash_file, **kwargs):
+    '''
+    Number of times another task ran while the files were hashed
+    '''
+    async def async_test():
+        ticks = 0
+        finished = False
+
+        async def ticker():
+            nonlocal ticks
+            while not finished:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(ticker())
+        callback = RecordingCallback()
+        await FileHashProcessor(file_walk, sizes, hash_file, callback, logging.getLogger("test"), **kwargs).process()
+        finished = True
+        await task
+        return ticks, callback
+
+    return asyncio.run(async_test())
+
+
+class TestHashCache(unittest.TestCase):
+
+    def test_get_put_evict(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            cache = HashCache(os.path.join(tmpdirname, "cache.sqlite"), max_entries=10)
+            big_inode = FileStat(5, 1, 2, (1 << 64) - 1)
+            cache.put(big_inode, "md5", "abc")
+            self.assertEqual("abc", cache.get(big_inode, "md5"))
+            self.assertIsNone(cache.get(big_inode, "blake2b"))
+            self.assertIsNone(cache.get(FileStat(5, 2, 2, (1 << 64) - 1), "md5"))
+            for i in range(20):
+                cache.put(FileStat(i, 1, 1, i), "md5", str(i))
+            cache.get(big_inode, "md5")
+            self.assertEqual(5, cache.prune(5))
+            self.assertEqual("abc", cache.get(big_inode, "md5"))
+            self.assertIsNone(cache.get(FileStat(0, 1, 1, 0), "md5"))
+            self.assertEqual("19", cache.get(FileStat(19, 1, 1, 19), "md5"))
+            cache.close()
+
+            cache = HashCache(os.path.join(tmpdirname, "cache.sqlite"), max_entries=10)
+            self.assertEqual(5, len(cache))
+            cache.close()
+
+    def test_cached_hashing(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            log = logging.getLogger("test")
+
+            async def async_test():
+                file_walk, stats = await FileWalk.scan(root)
+                sizes = [s.size for s in stats]
+                cache = HashCache(os.path.join(tmpdirname, "cache.sqlite"))
+                callback = RecordingCallback()
+                await FileHashProcessor(file_walk, sizes, os.path.join(tmpdirname, "a.txt"), callback, log,
+                                        tail_size=1, stats=stats, hash_cache=cache).process()
+                self.assertIsNone(callback.error)
+                hashes = callback.hashes
+
+                callback = RecordingCallback()
+                await FileHashProcessor(file_walk, sizes, os.path.join(tmpdirname, "b.txt"), callback, log,
+                                        tail_size=1, stats=stats, hash_cache=cache, executor=FailingExecutor()).process()
+                self.assertIsNone(callback.error)
+                self.assertEqual(hashes, callback.hashes)
+                cache.close()
+
+            asyncio.run(async_test())
+
+    def test_cached_hashing_yields(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = FileWalk()
+            f.add_directory(tmpdirname, [f"missing{i}" for i in range(5000)])
+            stats = [FileStat(5, 1, 1, i) for i in range(5000)]
+            ticks, callback = ticks_while_hashing(f, [5] * 5000, os.path.join(tmpdirname, "hashes.txt"), hash_all=True,
+                                                  stats=stats, hash_cache=ConstantHashCache("abc"), executor=FailingExecutor())
+            self.assertIsNone(callback.error)
+            self.assertEqual(["abc"] * 5000, callback.hashes)
+            self.assertGreaterEqual(ticks, 4)
+
+
+class AnalysisCallback:
+
+    def __init__(self):
+        self.analysis = None
+
+    async def on_analysis_progress(self, i):
+        pass
+
+    async def on_analysis_finished(self, analysis):
+        self.analysis = analysis
+
+
+class TestHardlinks(unittest.TestCase):
+
+    def test_candidates(self):
+        # 0 and 2 are links to the same inode, 3 has unknown inode
+        inodes = [(1, 10), (1, 11), (1, 10), None, (1, 12)]
+        self.assertEqual([], get_candidates([1, 2, 1, 3, 4], inodes))
+        self.assertEqual([0, 1, 2], get_candidates([1, 1, 1, 3, 4], inodes))
+        self.assertEqual([3, 4], get_candidates([1, 2, 1, 3, 3], inodes))
+
+    def test_hardlinks(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            os.makedirs(root)
+            for name, content in [("a", "same"), ("b", "same"), ("c", "only"), ("e", "diff")]:
+                with open(os.path.join(root, name), "w") as f:
+                    f.write(content)
+            os.link(os.path.join(root, "a"), os.path.join(root, "a2"))
+            os.link(os.path.join(root, "c"), os.path.join(root, "c2"))
+            log = logging.getLogger("test")
+
+            async def async_test():
+                file_walk, stats = await FileWalk.scan(root)
+                sizes = [s.size for s in stats]
+                callback = RecordingCallback()
+                await FileHashProcessor(file_walk, sizes, os.path.join(tmpdirname, "hashes.txt"), callback, log,
+                                        stats=stats).process()
+                self.assertIsNone(callback.error)
+                # c and c2 are one inode, so they are hashed only in the head stage with a and b
+                hashed = sorted(os.path.basename(path) for path, digest in zip(file_walk, callback.hashes) if digest is not None)
+                self.assertEqual(["a", "a2", "b"], hashed)
+
+                analysis_callback = AnalysisCallback()
+                await DuplicateAnalysis.create(callback.hashes, file_walk, sizes, IgnoreRules(), analysis_callback, stats=stats)
+                analysis = analysis_callback.analysis
+                self.assertEqual(1, len(analysis.items))
+                row = analysis.items[0].rows[0]
+                self.assertEqual(3, row.get_num_files())
+                self.assertEqual(2, row.get_num_inodes())
+                self.assertEqual(4, analysis.get_duplicated_bytes())
+                self.assertEqual([[os.path.join(root, "a"), os.path.join(root, "a2")],
+                                  [os.path.join(root, "c"), os.path.join(root, "c2")]], analysis.hardlinks)
+
+            asyncio.run(async_test())
+
+    def test_links_hashed_once(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = TestFileHash()._create_files(tmpdirname, ["same", "abcd", "same", "efgh", "same", "ijkl"])
+            # 0, 2 and 4 are links to one inode, collected far apart with one hash in flight
+            stats = [FileStat(4, 1, 1, 10 if i % 2 == 0 else i) for i in range(6)]
+            with PathFailingExecutor(None, max_workers=1) as executor:
+                callback = RecordingCallback()
+                asyncio.run(FileHashProcessor(f, [4] * 6, os.path.join(tmpdirname, "hashes.txt"), callback, logging.getLogger("test"),
+                                              hash_all=True, stats=stats, executor=executor, max_pending=1).process())
+            self.assertIsNone(callback.error)
+            self.assertEqual([get_hash(path) for path in f], callback.hashes)
+            self.assertEqual([f[0], f[1], f[3], f[5]], executor.submitted)
+
+    def test_streaming_hardlinks(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            os.makedirs(root)
+            for name in ["a", "b"]:
+                with open(os.path.join(root, name), "w") as f:
+                    f.write(name)
+            os.link(os.path.join(root, "a"), os.path.join(root, "a2"))
+            session = [os.path.join(tmpdirname, name) for name in ["file_walk.txt", "sizes.txt", "hashes.txt"]]
+            callback = StreamingCallback()
+            asyncio.run(StreamingProcessor([root], *session, callback, logging.getLogger("test"), workers=2).process())
+            self.assertIsNone(callback.error)
+            self.assertEqual(0, callback.duplicate_count)
+            file_walk, _, hashes = callback.result
+            self.assertEqual([get_hash(path) for path in file_walk], hashes)
+
+
+class VerificationCallback:
+
+    def __init__(self):
+        self.started = None
+        self.progress = []
+        self.analysis = None
+        self.mismatches = None
+        self.error = None
+
+    async def on_verification_started(self, file_count, byte_count):
+        self.started = (file_count, byte_count)
+
+    async def on_verification_progress(self, file_count, byte_count):
+        self.progress.append((file_count, byte_count))
+
+    async def on_verification_finished(self, analysis, mismatches):
+        self.analysis = analysis
+        self.mismatches = mismatches
+
+    async def on_task_error(self, task, error):
+        self.error = error
+
+
+class TestVerify(unittest.TestCase):
+
+    def _write(self, path, content):
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_verify_group(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            content = os.urandom(10000)
+            paths = [self._write(os.path.join(tmpdirname, f"{i}"), content) for i in range(5)]
+            self._write(paths[2], content[:-1] + bytes([content[-1] ^ 1]))
+            self.assertEqual([paths[0], paths[1], paths[3], paths[4]], verify_group(paths, chunk_size=4096, max_open_files=3))
+            self._write(paths[3], content[:5000])
+            self.assertEqual([paths[0], paths[1], paths[4]], verify_group(paths, chunk_size=4096))
+            os.remove(paths[1])
+            self.assertEqual([paths[0], paths[4]], verify_group(paths, chunk_size=4096))
+            os.remove(paths[0])
+            self.assertEqual([], verify_group(paths, chunk_size=4096))
+
+    def test_verifier(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            a = os.path.join(tmpdirname, "a")
+            b = os.path.join(tmpdirname, "b")
+            os.makedirs(a)
+            os.makedirs(b)
+            for folder in [a, b]:
+                self._write(os.path.join(folder, "same"), b"same")
+                self._write(os.path.join(folder, "diff"), b"diff" if folder == a else b"DIFF")
+            item = DupItem.create([os.path.join(a, "same"), os.path.join(b, "same")], "h1", 4)
+            item.append([os.path.join(a, "diff"), os.path.join(b, "diff")], "h2", 4)
+            callback = VerificationCallback()
+            asyncio.run(DuplicateVerifier(DuplicateAnalysis([item]), callback, logging.getLogger("test")).process())
+            self.assertIsNone(callback.error)
+            self.assertEqual((4, 16), callback.started)
+            self.assertEqual([(2, 8), (4, 16)], callback.progress)
+            self.assertEqual(1, len(callback.analysis.items))
+            self.assertEqual(["h1"], [row.hash_value for row in callback.analysis.items[0].rows])
+            self.assertEqual([("h2", [os.path.join(a, "diff"), os.path.join(b, "diff")], [os.path.join(a, "diff")])],
+                             callback.mismatches)
+
+            # a member removed since the analysis makes a mismatch, not a failure of the verification
+            os.remove(os.path.join(b, "same"))
+            callback = VerificationCallback()
+            asyncio.run(DuplicateVerifier(DuplicateAnalysis([item]), callback, logging.getLogger("test")).process())
+            self.assertIsNone(callback.error)
+            self.assertEqual([], callback.analysis.items)
+            self.assertEqual(["h1", "h2"], [hash_value for hash_value, _, _ in callback.mismatches])
+            self.assertEqual([os.path.join(a, "same")], callback.mismatches[0][2])
+
+
+class TestGrouping(unittest.TestCase):
+
+    def _engines(self):
+        # grouping must give the same result with and without NumPy
+        engines = [None] if grouping.numpy is None else [grouping.numpy, None]
+        original = grouping.numpy
+        try:
+            for engine in engines:
+                grouping.numpy = engine
+                yield engine
+        finally:
+            grouping.numpy = original
+
+    def test_digest_groups(self):
+        digests = ["aa" * 16, None, "bb" * 16, "aa" * 16, "cc" * 16, "bb" * 16, "aa" * 16]
+        for _ in self._engines():
+            groups = asyncio.run(grouping.digest_groups(digests, AnalysisCallback()))
+            self.assertEqual([[0, 3, 6], [2, 5]], sorted(groups))
+        # digests ending with zero bytes and digests that aren't hex
+        for digests in [["00" * 16, "00" * 15 + "01", "00" * 16, "10" + "00" * 15], ["h1", "h10", "h1", "h2"]]:
+            for _ in self._engines():
+                self.assertEqual([[0, 2]], asyncio.run(grouping.digest_groups(digests, AnalysisCallback())))
+        if grouping.numpy is not None:
+            self.assertEqual(16, grouping._raw_digests(["aa" * 16, "bb" * 16]).itemsize)
+
+    def test_binary_digest_groups(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, "hashes.bin")
+            digests = [None, "01" * 16, "02" * 16, "01" * 16, None]
+            asyncio.run(write_hashes(digests, "md5", path))
+            hashes = asyncio.run(read_hashes(path, "md5"))
+            for _ in self._engines():
+                self.assertEqual([[1, 3]], asyncio.run(grouping.digest_groups(hashes, AnalysisCallback())))
+
+    def test_inode_groups(self):
+        stats = [FileStat(1, 1, 1, 10), FileStat(1, 1, 1, 11), FileStat(1, 1, 1, 10), FileStat(1, 1, 2, 10)]
+        for _ in self._engines():
+            self.assertEqual([[0, 2]], asyncio.run(grouping.inode_groups(stats)))
+            self.assertEqual([], asyncio.run(grouping.inode_groups([FileStat(1, None, None, None)] * 2)))
+
+
+class TestAnalysisScaling(unittest.TestCase):
+
+    def _analyse(self, file_walk, hashes, sizes):
+        callback = AnalysisCallback()
+        asyncio.run(DuplicateAnalysis.create(hashes, file_walk, sizes, IgnoreRules(), callback))
+        return callback.analysis
+
+    def _reference_items(self, file_walk, hashes, sizes):
+        # grouping of all rotations of each group sorted by first path, as it was done before
+        paths_by_hash = {}
+        for path, digest in zip(file_walk, hashes):
+            paths_by_hash.setdefault(digest, []).append(path)
+        duplists = []
+        for digest, paths in paths_by_hash.items():
+            if len(paths) > 1:
+                duplists.extend((paths[i:] + paths[:i], digest) for i in range(len(paths)))
+        duplists.sort(key=lambda l: l[0][0])
+        used, items = set(), []
+        for path_list, digest in duplists:
+            if digest not in used:
+                if len(items) == 0 or not items[-1].append(path_list, digest, 1):
+                    items.append(DupItem.create(path_list, digest, 1))
+                used.add(digest)
+        return items
+
+    def _shape(self, items):
+        return [(item.dirs, [(row.hash_value, row.files) for row in item.rows]) for item in items]
+
+    def test_same_items_as_rotations(self):
+        file_walk = FileWalk()
+        file_walk.add_directory("/b", ["x", "a", "m"])
+        file_walk.add_directory("/a", ["q", "c", "b", "z"])
+        file_walk.add_directory("/c", ["b", "y"])
+        hashes = ["h1", "h2", "h3", "h1", "h3", "h2", "h4", "h4", "h1"]
+        sizes = [1] * len(hashes)
+        self.assertEqual(self._shape(self._reference_items(file_walk, hashes, sizes)),
+                         self._shape(self._analyse(file_walk, hashes, sizes).items))
+
+    def test_large_duplicate_group(self):
+        # 5000 copies of one file, e.g. an empty file, and 5000 pairs
+        file_walk = FileWalk()
+        hashes = []
+        for d in range(100):
+            file_walk.add_directory(f"/data/{d:03}", [f"empty{i}" for i in range(50)] + [f"pair{i}" for i in range(100)])
+            hashes.extend(["0" * 32] * 50 + [f"{(d // 2) * 100 + i + 1:032x}" for i in range(100)])
+        sizes = [0 if digest == "0" * 32 else 1 for digest in hashes]
+        start = time.perf_counter()
+        analysis = self._analyse(file_walk, hashes, sizes)
+        elapsed = time.perf_counter() - start
+        self.assertEqual(5001, sum(len(item.rows) for item in analysis.items))
+        empty_row = analysis.items[0].rows[0]
+        self.assertEqual(5000, empty_row.get_num_files())
+        self.assertEqual(100, len(empty_row.files))
+        self.assertLess(elapsed, 10)
+
+
+class TestIgnoreRules(unittest.TestCase):
+
+    def test_rules(self):
+        rules = IgnoreRules(["/data/snapshots", "/data/a/b.txt", ".Trash-*", "/home/*/cache"])
+        self.assertTrue(rules.is_ignored("/data/snapshots"))
+        self.assertTrue(rules.is_ignored("/data/snapshots/2020/x.txt"))
+        self.assertFalse(rules.is_ignored("/data/snapshots2/x.txt"))
+        self.assertFalse(rules.is_ignored("/data"))
+        self.assertTrue(rules.is_ignored("/data/a/b.txt"))
+        self.assertFalse(rules.is_ignored("/data/a/c.txt"))
+        self.assertTrue(rules.is_ignored("/mnt/.Trash-1000/files/x.txt"))
+        self.assertTrue(rules.is_ignored("/home/u/cache"))
+        self.assertTrue(rules.is_ignored("/home/u/cache/thumbnails/x.jpg"))
+        self.assertFalse(rules.is_ignored("/home/u/cached/x.jpg"))
+        self.assertFalse(rules.is_ignored("/home/u/docs"))
+        self.assertFalse(IgnoreRules())
+
+        is_ignored_entry = rules.entry_filter("/data")
+        self.assertTrue(is_ignored_entry("snapshots", "/data/snapshots"))
+        self.assertTrue(is_ignored_entry(".Trash-1000", "/data/.Trash-1000"))
+        self.assertFalse(is_ignored_entry("a", "/data/a"))
+
+    def test_scan_prunes_ignored(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            full_walk, _ = asyncio.run(FileWalk.scan(root))
+            rules = IgnoreRules([os.path.join(root, "d"), "g.*", os.path.join(root, "f", "sub", "*")])
+            file_walk, stats = asyncio.run(FileWalk.scan(root, ignore_rules=rules))
+            self.assertEqual([path for path in full_walk if not rules.is_ignored(path)], list(file_walk))
+            self.assertEqual(len(file_walk), len(stats))
+            self.assertEqual(4, len(file_walk))
+            self.assertEqual(0, len(asyncio.run(FileWalk.scan(root, ignore_rules=IgnoreRules([root])))[0]))
+
+    def test_names_above_root(self):
+        rules = IgnoreRules(["backup-*", "/data/*/old"])
+        self.assertTrue(rules.is_ignored("/tmp/backup-xyz/data/a.txt"))
+        self.assertFalse(rules.is_ignored("/tmp/backup-xyz/data/a.txt", "/tmp/backup-xyz/data"))
+        self.assertTrue(rules.is_ignored("/tmp/backup-xyz/data/backup-1/a.txt", "/tmp/backup-xyz/data"))
+        self.assertFalse(rules.is_ignored("/tmp/backup-xyz", "/tmp/backup-xyz"))
+        self.assertTrue(rules.is_ignored("/data/x/old", "/data/x/old"))
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "backup-xyz", "data")
+            TestFileWalk()._create_test_directory(root)
+            TestFileWalk()._create_file(os.path.join(root, "backup-1", "a.txt"), "A")
+            file_walk, stats = asyncio.run(FileWalk.scan(root, ignore_rules=rules))
+            self.assertEqual(9, len(file_walk))
+            self.assertEqual({root}, file_walk.roots())
+
+            # the full walk of a resumed session is filtered by the analysis
+            file_walk, stats = asyncio.run(FileWalk.scan(root))
+            callback = AnalysisCallback()
+            asyncio.run(DuplicateAnalysis.create([get_hash(path) for path in file_walk], file_walk,
+                                                 [s.size for s in stats], rules, callback, stats=stats))
+            self.assertEqual([[root, os.path.join(root, "d")], [os.path.join(root, "d"), os.path.join(root, "f")]],
+                             [list(item.dirs) for item in callback.analysis.items])
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def _read(self, path):
+        with open(path, "r") as f:
+            return f.read()
+
+    def test_writer_batches(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, "hashes.txt")
+            w = CheckpointWriter(path, header="#md5", max_entries=3, max_interval=3600)
+            for i in range(4):
+                w.write(f"{i} x")
+            # header and the first two lines make the first batch, the fourth line is still buffered
+            self.assertEqual("#md5\n0 x\n1 x\n", self._read(path))
+            self.assertEqual("13", self._read(checkpoint_path(path)).strip())
+            w.close()
+            self.assertEqual("#md5\n0 x\n1 x\n2 x\n3 x\n", self._read(path))
+
+            with CheckpointWriter(path, header="#md5") as w:
+                w.write("4 x")
+            self.assertEqual("#md5\n0 x\n1 x\n2 x\n3 x\n4 x\n", self._read(path))
+            with CheckpointWriter(path, header="#md5", truncate=True) as w:
+                w.write("5 x")
+            self.assertEqual("#md5\n5 x\n", self._read(path))
+
+    def test_recover(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, "sizes.txt")
+            with CheckpointWriter(path) as w:
+                w.write("1 2 3 4")
+            with open(path, "a") as f:
+                f.write("5 6 7 8\n9 1")
+            # lines after the checkpoint were not fsync'd, the torn tail is cut with them
+            self.assertEqual(len("5 6 7 8\n9 1"), recover(path))
+            self.assertEqual("1 2 3 4\n", self._read(path))
+
+            os.remove(checkpoint_path(path))
+            with open(path, "a") as f:
+                f.write("5 6 7 8\n9 1")
+            self.assertEqual(3, recover(path))
+            self.assertEqual("1 2 3 4\n5 6 7 8\n", self._read(path))
+
+    def test_torn_hash_file_resumed(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            f = TestFileHash()._create_files(tmpdirname, ["A", "A", "B", "B"])
+            hash_file = os.path.join(tmpdirname, "hashes.txt")
+            with open(hash_file, "w") as h:
+                h.write(f"#md5\n0 {get_hash(f[0])}\n1 {get_hash(f[1])[:7]}")
+            callback = RecordingCallback()
+            asyncio.run(FileHashProcessor(f, [1, 1, 1, 1], hash_file, callback, logging.getLogger("test"), hash_all=True).process())
+            self.assertIsNone(callback.error)
+            self.assertEqual([get_hash(path) for path in f], callback.hashes)
+            self.assertEqual([0, 1, 2, 3], asyncio.run(load_hashes(hash_file, [None] * 4, "md5")))
+
+
+class TestHeadless(unittest.TestCase):
+
+    def _run(self, datadir, folders, interval=0, **kwargs):
+        stream = io.StringIO()
+        application = HeadlessApplication(datadir, folders, [], progress=JsonProgress(stream, interval=interval),
+                                          log=logging.getLogger("test"), **kwargs)
+        status = application.run()
+        return status, [json.loads(line) for line in stream.getvalue().splitlines()], application
+
+    def test_headless(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            for streaming in [False, True]:
+                datadir = os.path.join(tmpdirname, f"session{streaming}")
+                status, events, application = self._run(datadir, [root], streaming=streaming, verify=True)
+                self.assertEqual(0, status)
+                self.assertEqual("started", events[0]["event"])
+                finished = events[-1]
+                self.assertEqual("finished", finished["event"])
+                self.assertEqual(3, finished["groups"])
+                self.assertEqual(6, finished["duplicate_files"])
+                self.assertEqual(3, finished["duplicated_bytes"])
+                self.assertIn("verifying", [event["event"] for event in events])
+                if not streaming:
+                    hashed = [event for event in events if event["event"] == "hashed"]
+                    self.assertEqual(["head", "full"], [event["stage"] for event in hashed])
+                    # the small files are hashed whole by the head stage
+                    self.assertIn("io_time", hashed[0])
+                    self.assertIn("hash_time", hashed[0])
+                    self.assertIn("elapsed", hashed[-1])
+                self.assertEqual(3, sum(len(item.rows) for item in application.analysis.items))
+
+                # finished session is loaded without scanning again
+                status, events, _ = self._run(datadir, [root])
+                self.assertEqual(0, status)
+                self.assertEqual("loading", events[1]["event"])
+                self.assertNotIn("scanning", [event["event"] for event in events])
+                self.assertEqual(3, events[-1]["groups"])
+
+    def test_headless_throttled(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            status, events, application = self._run(os.path.join(tmpdirname, "session"), [root], interval=3600)
+            self.assertEqual(0, status)
+            # only the first progress event is written, the stage still ends with its measured values
+            progress = [event["event"] for event in events if event["event"] in ("scanning", "sizing")
+                        or event["event"] in ("hashing", "analysing") and "total_files" in event and event["files"] > 0]
+            self.assertEqual(["scanning"], progress)
+            hashed = [event for event in events if event["event"] == "hashed"]
+            self.assertIn("io_time", hashed[0])
+
+    def test_headless_error(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            status, events, _ = self._run(os.path.join(tmpdirname, "session"), [])
+            self.assertEqual(1, status)
+            self.assertEqual("error", events[-1]["event"])
+
+
+class ExportCallback:
+
+    def __init__(self):
+        self.exported = None
+        self.error = None
+
+    async def on_export_finished(self, export_file, group_count):
+        self.exported = (export_file, group_count)
+
+    async def on_task_error(self, task, error):
+        self.error = error
+
+
+class TestExport(unittest.TestCase):
+
+    def _analysis(self):
+        item = DupItem.create(["/a/x", "/b/x", "/b/y"], "h1", 10, num_inodes=2)
+        item.append(["/a/z", "/b/z"], "h2", 5)
+        return DuplicateAnalysis([item, DupItem.create(["/c/1", "/d/1"], "h3", 7)])
+
+    def test_jsonl(self):
+        stream = io.StringIO()
+        self.assertEqual(3, asyncio.run(export_analysis(self._analysis(), stream, "jsonl")))
+        groups = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(dict(group=0, hash="h1", size=10, copies=2, reclaimable_bytes=10, paths=["/a/x", "/b/x", "/b/y"]), groups[0])
+        self.assertEqual(["h1", "h2", "h3"], [group["hash"] for group in groups])
+        self.assertEqual([10, 5, 7], [group["reclaimable_bytes"] for group in groups])
+
+    def test_csv(self):
+        stream = io.StringIO()
+        self.assertEqual(3, asyncio.run(export_analysis(self._analysis(), stream, "csv")))
+        rows = list(csv.reader(io.StringIO(stream.getvalue())))
+        self.assertEqual(["group", "hash", "size", "copies", "reclaimable_bytes", "path"], rows[0])
+        self.assertEqual(["0", "h1", "10", "2", "10", "/a/x"], rows[1])
+        self.assertEqual(8, len(rows))
+        with self.assertRaises(Exception) as _:
+            asyncio.run(export_analysis(self._analysis(), stream, "xml"))
+
+    def test_headless_export(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = os.path.join(tmpdirname, "root")
+            TestFileWalk()._create_test_directory(root)
+            export_file = os.path.join(tmpdirname, "duplicates.jsonl")
+            status, events, _ = TestHeadless()._run(os.path.join(tmpdirname, "session"), [root], export_file=export_file)
+            self.assertEqual(0, status)
+            self.assertEqual(dict(event="exported", file=export_file, groups=3), {k: v for k, v in events[-1].items() if k != "time"})
+            with open(export_file, "r") as f:
+                self.assertEqual(3, len(f.readlines()))
+
+    def test_undecodable_names(self):
+        analysis = DuplicateAnalysis([DupItem.create(["/a/caf\udce9", "/b/cafe"], "h1", 4)])
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            for export_format in EXPORT_FORMATS:
+                export_file = os.path.join(tmpdirname, f"duplicates.{export_format}")
+                callback = ExportCallback()
+                asyncio.run(ReportExporter(analysis, export_file, export_format, callback, logging.getLogger("test")).process())
+                self.assertIsNone(callback.error)
+                self.assertEqual((export_file, 1), callback.exported)
+                with open(export_file, "rb") as f:
+                    content = f.read()
+                if export_format == "jsonl":
+                    group = json.loads(content)
+                    self.assertEqual([b"/a/caf\xe9", b"/b/cafe"], [base64.b64decode(path) for path in group["paths_base64"]])
+                else:
+                    self.assertIn(b"/a/caf\xe9", content)
+
+
 if __name__ == '__main__':
     unittest.main()
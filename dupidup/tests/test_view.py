@@ -3,11 +3,69 @@ Created on 18 Sep 2019
 
 @author: mlinhard
 '''
+import asyncio
+import curses
+import logging
+import time
 import unittest
+from magicur.app import MagicApplication, callback, progress_callback
+from magicur.event import KeyEvent
+from magicur.progress import RateMeter, format_duration
+from magicur.screen import CellBuffer, MagicScreen, MagicWindow
 from tests.testview import TestMagicWindow
-from dupidup.progress import ProgressWindow
+from dupidup.progress import ProgressWindow, StageMeter
 from dupidup.browser import DuplicateBrowser
-from dupidup.analysis import DuplicateAnalysis, DupItem, DupItemRow
+from dupidup.analysis import DuplicateAnalysis, DupItem, DupItemRow, HashTiming
+
+
+class BufferedScreen:
+
+    def __init__(self, width, height):
+        self.back = CellBuffer(width, height)
+
+    def scroll(self, x, y, width, height, lines, char, color_pair_key):
+        self.back.scroll(x, y, width, height, lines, char, color_pair_key)
+
+    def rows(self):
+        return ["".join(row) for row in self.back.chars]
+
+
+class ScrollingStdscr:
+
+    def __init__(self, width, height):
+        self._width, self._height = width, height
+        self.calls = []
+
+    def getmaxyx(self):
+        return self._height, self._width
+
+    def idlok(self, flag):
+        pass
+
+    def scrollok(self, flag):
+        pass
+
+    def setscrreg(self, top, bottom):
+        self.calls.append(("setscrreg", top, bottom))
+
+    def scroll(self, lines):
+        self.calls.append(("scroll", lines))
+
+
+class CountingMagicWindow(TestMagicWindow):
+
+    def __init__(self, width, height, x, y):
+        super().__init__(width, height, x, y)
+        self.put_count = 0
+
+    def put_text(self, x, y, text):
+        self.put_count += 1
+        super().put_text(x, y, text)
+
+    def sub_window(self, width, height, x, y):
+        child = CountingMagicWindow(width, height, x, y)
+        self.children.append(child)
+        return child
 
 
 class Test(unittest.TestCase):
@@ -49,6 +107,10 @@ class Test(unittest.TestCase):
 │   Files │                       │
 ├─────────┼───────────────────────┤
 │    Size │                       │
+├─────────┼───────────────────────┤
+│   Speed │                       │
+├─────────┼───────────────────────┤
+│    Time │                       │
 └─────────┴───────────────────────┘
 """)
         self.assertEmptyProgressWindow(70,
@@ -63,6 +125,10 @@ class Test(unittest.TestCase):
 │              Files │                                               │
 ├────────────────────┼───────────────────────────────────────────────┤
 │               Size │                                               │
+├────────────────────┼───────────────────────────────────────────────┤
+│              Speed │                                               │
+├────────────────────┼───────────────────────────────────────────────┤
+│               Time │                                               │
 └────────────────────┴───────────────────────────────────────────────┘
 """)
 
@@ -74,6 +140,46 @@ class Test(unittest.TestCase):
         # print(child_win.contents())
         self.assertEqual(contents, "\n" + child_win.contents())
 
+    def test_progress_window_meter(self):
+        root_win = TestMagicWindow(35, 20, 0, 0)
+        prog_win = ProgressWindow(root_win)
+        meter = StageMeter()
+        start = time.monotonic() - 20
+        meter.reset()
+        meter.files.reset(now=start)
+        meter.bytes.reset(now=start)
+        for t, files in ((0, 0), (10, 100), (20, 300)):
+            meter.files.update(files, 1000, now=start + t)
+            meter.bytes.update(files * 1024 * 1024, 1000 * 1024 * 1024, now=start + t)
+        meter.timing = HashTiming(90.0, 30.0)
+        prog_win.set_meter(meter)
+        self.assertEqual(
+"""
+├─────────┼───────────────────────┤
+│   Speed │20.0 MiB/s, 20 files/s │
+├─────────┼───────────────────────┤
+│    Time │ ETA 0:00:35, 75% read │
+└─────────┴───────────────────────┘
+""", "\n" + "\n".join(root_win.children[0].line[10:]) + "\n")
+        root_win = TestMagicWindow(70, 20, 0, 0)
+        ProgressWindow(root_win).set_meter(meter)
+        self.assertEqual(["│              Speed │       20.0 MiB/s, 20 files/s (avg 15.0 MiB/s) │",
+                          "│               Time │                0:00:20, ETA 0:00:35, 75% read │"],
+                         [root_win.children[0].line[11], root_win.children[0].line[13]])
+
+        # without room for the meter rows the window keeps the height of the counters
+        root_win = TestMagicWindow(35, 12, 0, 0)
+        ProgressWindow(root_win).set_meter(meter)
+        self.assertEqual(11, root_win.children[0].height)
+        self.assertEqual("└─────────┴───────────────────────┘", root_win.children[0].line[10])
+        with self.assertRaises(Exception) as _:
+            ProgressWindow(TestMagicWindow(35, 10, 0, 0))
+        values = meter.values()
+        self.assertEqual(dict(files_per_s=20.0, bytes_per_s=20.0 * 1024 * 1024, avg_files_per_s=15.0,
+                              avg_bytes_per_s=15.0 * 1024 * 1024, eta=35.0, io_time=90.0, hash_time=30.0),
+                         {key: value for key, value in values.items() if key != "elapsed"})
+        self.assertAlmostEqual(20.0, values["elapsed"], delta=1.0)
+
     def test_progress_window_values(self):
         root_win = TestMagicWindow(35, 20, 0, 0)
         prog_win = ProgressWindow(root_win)
@@ -96,6 +202,10 @@ class Test(unittest.TestCase):
 │   Files │                10,000 │
 ├─────────┼───────────────────────┤
 │    Size │              50.0 MiB │
+├─────────┼───────────────────────┤
+│   Speed │                       │
+├─────────┼───────────────────────┤
+│    Time │                       │
 └─────────┴───────────────────────┘
 """, "\n" + child_win.contents())
         prog_win.set_action_msg("AAAAAAAAAABBBBBBBBBBCCCCCCCCCCDDDDDDDDDD")
@@ -111,6 +221,10 @@ class Test(unittest.TestCase):
 │   Files │                10,000 │
 ├─────────┼───────────────────────┤
 │    Size │              50.0 MiB │
+├─────────┼───────────────────────┤
+│   Speed │                       │
+├─────────┼───────────────────────┤
+│    Time │                       │
 └─────────┴───────────────────────┘
 """, "\n" + child_win.contents())
 
@@ -144,6 +258,246 @@ class Test(unittest.TestCase):
 └───────────────────────┴───────────────────────┘ 
 """, "\n" + root_win.children[0].contents())
 
+    def test_browser_renders_viewport_only(self):
+        root_win = CountingMagicWindow(50, 8, 0, 0)
+        items = [DupItem((f"/home/u/{i:04d}",), [DupItemRow([[f"f{i}a", f"f{i}b"]], 10, f"hash{i}")]) for i in range(10000)]
+        browser = DuplicateBrowser(root_win, DuplicateAnalysis(items))
+        window = root_win.children[0]
+        self.assertEqual(10000 * 3 + 1, browser.get_total_height())
+        # three boxes of three lines intersect the viewport of 7 lines
+        self.assertLess(window.put_count, 20)
+        window.put_count = 0
+        browser._top = 3 * 5000 + 2
+        browser.render()
+        self.assertLess(window.put_count, 20)
+        self.assertEqual(
+"""
+│ f5000b                │                         
+├─/home/u/5001──────────┤                         
+│ f5001a                │                         
+│ f5001b                │                         
+├─/home/u/5002──────────┤                         
+│ f5002a                │                         
+│ f5002b                │                         
+""", "\n" + window.contents())
+        browser._top = browser.get_total_height() - 3
+        browser.render()
+        self.assertEqual("└───────────────────────┘                         ", window.line[2])
+
+    def test_browser_scrolling(self):
+        root_win = CountingMagicWindow(50, 8, 0, 0)
+        items = [DupItem((f"/home/u/{i:04d}",), [DupItemRow([[f"f{i}a", f"f{i}b"]], 10, f"hash{i}")]) for i in range(100)]
+        browser = DuplicateBrowser(root_win, DuplicateAnalysis(items))
+        window = root_win.children[0]
+        reference_win = TestMagicWindow(50, 8, 0, 0)
+        reference = DuplicateBrowser(reference_win, DuplicateAnalysis(items))
+
+        def assertScrolledTo(top):
+            reference._top = top
+            reference.render()
+            self.assertEqual(top, browser.get_top())
+            self.assertEqual(reference_win.children[0].contents(), window.contents())
+
+        window.put_count = 0
+        self.assertTrue(browser.on_key(curses.KEY_DOWN))
+        # only the exposed line is drawn
+        self.assertLess(window.put_count, 3)
+        assertScrolledTo(1)
+        self.assertTrue(browser.on_key(curses.KEY_NPAGE))
+        assertScrolledTo(7)
+        self.assertTrue(browser.on_key(ord("n")))
+        assertScrolledTo(9)
+        self.assertTrue(browser.on_key(ord("p")))
+        assertScrolledTo(6)
+        self.assertTrue(browser.on_key(curses.KEY_UP))
+        assertScrolledTo(5)
+        self.assertTrue(browser.on_key(curses.KEY_END))
+        assertScrolledTo(301 - 7)
+        self.assertFalse(browser.on_key(curses.KEY_DOWN))
+        self.assertFalse(browser.on_key(ord("n")))
+        self.assertTrue(browser.on_key(curses.KEY_PPAGE))
+        assertScrolledTo(301 - 13)
+        self.assertTrue(browser.on_key(curses.KEY_HOME))
+        assertScrolledTo(0)
+        self.assertFalse(browser.on_key(curses.KEY_UP))
+        self.assertFalse(browser.on_key(ord("x")))
+
+    def test_browser_scrolling_mixed_columns(self):
+        root_win = TestMagicWindow(40, 6, 0, 0)
+        items = []
+        for i in range(6):
+            dirs = tuple(f"/home/u/{i}{c}" for c in "abc"[:[2, 1, 3][i % 3]])
+            items.append(DupItem(dirs, [DupItemRow([[f"f{i}"] for _ in dirs], 10, f"hash{i}")]))
+        browser = DuplicateBrowser(root_win, DuplicateAnalysis(items))
+        window = root_win.children[0]
+        reference_win = TestMagicWindow(40, 6, 0, 0)
+        reference = DuplicateBrowser(reference_win, DuplicateAnalysis(items))
+        self.assertEqual("├─/home/u/1a───────┼──────────────────┘ ", window.line[2])
+        self.assertTrue(all(len(line) == 40 for line in window.line))
+
+        for lines in [1] * 15 + [-1] * 15 + [4, -1, 3, -2]:
+            browser.scroll(lines)
+            reference._top = browser.get_top()
+            reference.render()
+            self.assertEqual(reference_win.children[0].contents(), window.contents())
+
+    def test_cell_buffer_changes(self):
+        front = CellBuffer(10, 3)
+        back = front.copy()
+        self.assertEqual([], list(back.changes(front)))
+        back.put(2, 1, "abc", "white blue")
+        back.put(7, 1, "d", "white blue")
+        back.paint(8, 1, 2, "white red")
+        back.put(0, 2, "  ", "default")
+        self.assertEqual([(2, 1, "abc", "white blue"), (7, 1, "d", "white blue"), (8, 1, "  ", "white red")],
+                         list(back.changes(front)))
+        back.copy_rows_to(front)
+        self.assertEqual([], list(back.changes(front)))
+        back.put(3, 1, "b", "white blue")
+        self.assertEqual([], list(back.changes(front)))
+        self.assertEqual(10 * 3, sum(len(text) for _, _, text, _ in CellBuffer(10, 3).changes(None)))
+
+    def test_buffered_window(self):
+        screen = BufferedScreen(8, 4)
+        window = MagicWindow(screen, screen, 2, 1, 4, 2, logging.getLogger("test"), None)
+        window.reset_to(".", "white blue")
+        window.put_text(1, 0, "abcdefgh")
+        self.assertEqual(["        ", "  .abc  ", "  defg  ", "        "], screen.rows())
+        window.scroll_lines(1)
+        self.assertEqual(["        ", "  defg  ", "        ", "        "], screen.rows())
+        window.scroll_lines(-1)
+        self.assertEqual(["        ", "        ", "  defg  ", "        "], screen.rows())
+
+    def test_screen_scroll(self):
+        stdscr = ScrollingStdscr(4, 4)
+        screen = MagicScreen(stdscr, logging.getLogger("test"), None)
+        for y, text in enumerate(["head", "aaaa", "bbbb", "cccc"]):
+            screen.back.put(0, y, text, "default")
+        screen._front = screen.back.copy()
+
+        # a full width scroll moves the terminal lines, only the exposed line is written
+        window = screen.sub_window(4, 3, 0, 1)
+        window.scroll_lines(1)
+        window.put_text(0, 2, "dddd")
+        self.assertEqual([("setscrreg", 1, 3), ("scroll", 1), ("setscrreg", 0, 3)], stdscr.calls)
+        self.assertEqual([(0, 3, "dddd", "default")], list(screen.back.changes(screen._front)))
+        screen.back.copy_rows_to(screen._front)
+        window.scroll_lines(-2)
+        self.assertEqual([(0, 1, "    ", "default"), (0, 2, "    ", "default")],
+                         list(screen.back.changes(screen._front)))
+        screen.back.copy_rows_to(screen._front)
+
+        # a narrower region can't be scrolled on the terminal, its rows are compared with the front buffer
+        stdscr.calls = []
+        screen.sub_window(2, 4, 0, 0).scroll_lines(1)
+        self.assertEqual([], stdscr.calls)
+        self.assertEqual([(0, 0, "  ", "default"), (0, 2, "bb", "default"), (0, 3, "  ", "default")],
+                         list(screen.back.changes(screen._front)))
+
+    def test_rate_meter(self):
+        meter = RateMeter(window=10.0)
+        meter.update(0, total=1000, now=100.0)
+        self.assertIsNone(meter.rate())
+        self.assertIsNone(meter.eta())
+        meter.update(100, now=105.0)
+        self.assertEqual(20.0, meter.rate())
+        self.assertEqual(45.0, meter.eta())
+        # the rate follows the last 10 seconds, the slow start drops out of the window
+        meter.update(200, now=110.0)
+        meter.update(600, now=120.0)
+        self.assertEqual(40.0, meter.rate())
+        self.assertEqual(10.0, meter.eta())
+        self.assertEqual(20.0, meter.elapsed(now=120.0))
+        self.assertEqual("0:00:10", format_duration(meter.eta()))
+        self.assertEqual("30:01:05", format_duration(30 * 3600 + 65))
+
+        # updates closer than the minimum interval replace the last sample
+        meter = RateMeter(window=10.0, min_interval=0.1)
+        for i in range(1001):
+            meter.update(i, now=100.0 + i * 0.001)
+        self.assertLessEqual(len(meter._samples), 12)
+        self.assertEqual(1000, meter.count())
+        self.assertAlmostEqual(1000.0, meter.rate())
+
+    def test_progress_callback_coalesced(self):
+
+        class ProgressApp(MagicApplication):
+            progress_rate = 20
+
+            @progress_callback
+            def on_progress(self, count):
+                self.delivered.append(("progress", count))
+
+            @callback
+            def on_finished(self):
+                self.delivered.append(("finished",))
+
+        async def report(app):
+            app._loop = asyncio.get_running_loop()
+            app._event_queue = asyncio.Queue()
+            app._last_frame = app._last_progress = 0
+            app._pending_progress = {}
+            app._progress_timer = None
+            app.delivered = []
+            for i in range(1000):
+                await app.on_progress(i)
+            await asyncio.sleep(0.01)
+            # the latest value comes in one event
+            self.assertEqual(1, app._event_queue.qsize())
+            for i in range(1000, 2000):
+                await app.on_progress(i)
+            # the next one waits for the interval, unless a regular callback comes first
+            await asyncio.sleep(0.01)
+            self.assertEqual(1, app._event_queue.qsize())
+            await app.on_finished()
+            while not app._event_queue.empty():
+                event = app._event_queue.get_nowait()
+                event.method(*event.args)
+            self.assertEqual([("progress", 999), ("progress", 1999), ("finished",)], app.delivered)
+            self.assertIsNone(app._progress_timer)
+
+        asyncio.run(report(ProgressApp()))
+
+    def test_error_screen_drawn(self):
+
+        class FrameScreen:
+
+            def __init__(self):
+                self.requested = False
+                self.frames = 0
+
+            def request_update(self):
+                self.requested = True
+
+            def update_requested(self):
+                return self.requested
+
+            def update(self):
+                self.requested = False
+                self.frames += 1
+
+        class FailingApp(MagicApplication):
+
+            def on_key(self, key):
+                raise Exception("Terminal too small")
+
+            def on_error(self, error, task=None):
+                # like an error view drawn to the back buffer
+                self._screen.request_update()
+                self._terminating = True
+
+        async def dispatch(app):
+            app._log = logging.getLogger("test")
+            app._screen = FrameScreen()
+            app._event_queue = asyncio.Queue()
+            app._last_frame = 0
+            app._terminating = False
+            await app._event_queue.put(KeyEvent(410))
+            await app._dispatch_events()
+            self.assertEqual(1, app._screen.frames)
+
+        asyncio.run(dispatch(FailingApp()))
+
 # 0         1         2         3         4
 # 01234567890123456789012345678901234567890123456789
 #  01234567890123456789012
@@ -32,6 +32,13 @@ class TestMagicWindow(MagicWindow):
     def reset_to(self, char, color_pair_key):
         self.line = [char * self._width for _ in range(self._height)]
 
+    def scroll_lines(self, lines):
+        blank = [" " * self._width for _ in range(min(abs(lines), self._height))]
+        if lines > 0:
+            self.line = self.line[lines:] + blank
+        elif lines < 0:
+            self.line = blank + self.line[:lines]
+
     def sub_window(self, width, height, x, y):
         child = TestMagicWindow(width, height, x, y)
         self.children.append(child)
@@ -13,6 +13,10 @@ import asyncio
 import sys
 from threading import Thread
 import queue
+import time
+
+FRAME_INTERVAL = 1 / 30
+PROGRESS_RATE = 10
 
 
 class MagicBootstrap:
@@ -73,6 +77,16 @@ def callback(method):
     return scheduled_callback
 
 
+def progress_callback(method):
+    """Like callback, but the calls are coalesced: the latest arguments of each method are delivered
+       at most progress_rate times per second, earlier ones are dropped"""
+
+    async def scheduled_progress(obj, *args):
+        obj.schedule_progress(method, *(tuple([obj]) + args))
+
+    return scheduled_progress
+
+
 class ThreadSafeEvent(asyncio.Event):
 
     def set(self):
@@ -82,6 +96,8 @@ class ThreadSafeEvent(asyncio.Event):
 class MagicApplication:
     """Base Application class, initialized by MagicCurses.run() method"""
 
+    progress_rate = PROGRESS_RATE
+
     def get_logger(self, name):
         return self._logger_factory(name)
 
@@ -106,6 +122,7 @@ class MagicApplication:
         pass
 
     def resize(self):
+        self._screen.resize()
         self.on_resize(self._screen.width, self._screen.height)
 
     def terminate(self):
@@ -138,8 +155,26 @@ class MagicApplication:
         self._loop.create_task(task)
 
     async def schedule_hook(self, method, *args):
+        # progress reported before the hook must not be delivered after it
+        self._flush_progress()
         await self._event_queue.put(HookEvent(method, *args))
 
+    def schedule_progress(self, method, *args):
+        self._pending_progress[method] = args
+        if self._progress_timer is None:
+            delay = max(0, self._last_progress + 1 / self.progress_rate - time.monotonic())
+            self._progress_timer = self._loop.call_later(delay, self._flush_progress)
+
+    def _flush_progress(self):
+        if self._progress_timer is not None:
+            self._progress_timer.cancel()
+            self._progress_timer = None
+        if len(self._pending_progress) > 0:
+            for method, args in self._pending_progress.items():
+                self._event_queue.put_nowait(HookEvent(method, *args))
+            self._pending_progress = {}
+            self._last_progress = time.monotonic()
+
     async def _read_key_events(self):
 
         # curses getch() method needs to be called in blocking mode
@@ -190,11 +225,30 @@ class MagicApplication:
                     event.method(*(event.args))
                 else:
                     raise Exception("unknown event type")
+                self._update_screen()
             except Exception as e:
                 self.on_error(e)
+                # the error screen is drawn like any other change, it must end the frame as well
+                self._update_screen()
         self._log.debug("Finishing event dispatcher")
 
+    def _update_screen(self):
+        '''
+        Ends the frame: the changed cells are written to the terminal once the queued events are handled,
+        or after FRAME_INTERVAL while events keep coming
+        '''
+        if not self._screen.update_requested():
+            return
+        now = time.monotonic()
+        if self._event_queue.empty() or now - self._last_frame >= FRAME_INTERVAL:
+            self._screen.update()
+            self._last_frame = now
+
     async def _run_async(self):
+        self._last_frame = time.monotonic()
+        self._last_progress = 0
+        self._pending_progress = {}
+        self._progress_timer = None
         self._kill_getch_loop = asyncio.Event()
         self._event_queue = asyncio.Queue()
         try:
@@ -203,6 +257,8 @@ class MagicApplication:
                 self._read_key_events(),
                 self._dispatch_events())
         finally:
+            if self._progress_timer is not None:
+                self._progress_timer.cancel()
             self._log.debug(f"Event queue {repr(self._event_queue)}")
             self.on_termination()
             self._log.debug(f"Event loop terminated")
@@ -0,0 +1,93 @@
+'''
+Progress measurement
+'''
+from collections import deque
+import time
+
+RATE_WINDOW = 10.0
+# samples closer to the previous one replace the last sample, so that frequent updates don't pile up
+MIN_SAMPLE_INTERVAL = 0.1
+
+
+class RateMeter(object):
+    '''
+    Rate of a growing count over the samples of the last window seconds, the average rate since
+    the first sample, and the estimated time left until the count reaches the total.
+    Elapsed time counts from the reset, or from the first sample if there was none.
+    '''
+
+    def __init__(self, window=RATE_WINDOW, min_interval=MIN_SAMPLE_INTERVAL):
+        self._window = window
+        self._min_interval = min_interval
+        self._samples = deque()
+        self._start = None
+        self._first = None
+        self._total = None
+
+    def reset(self, total=None, now=None):
+        self._samples.clear()
+        self._start = time.monotonic() if now is None else now
+        self._first = None
+        self._total = total
+
+    def update(self, count, total=None, now=None):
+        now = time.monotonic() if now is None else now
+        if self._start is None:
+            self._start = now
+        if self._first is None:
+            self._first = (now, count)
+        if total is not None:
+            self._total = total
+        if len(self._samples) >= 2 and now - self._samples[-2][0] < self._min_interval:
+            self._samples[-1] = (now, count)
+        else:
+            self._samples.append((now, count))
+        # the oldest sample within the window is kept as the base of the rate
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self._window:
+            self._samples.popleft()
+
+    def count(self):
+        return self._samples[-1][1] if len(self._samples) > 0 else 0
+
+    def rate(self):
+        '''
+        Count per second in the window, None until there are two samples
+        '''
+        if len(self._samples) < 2:
+            return None
+        (start, start_count), (end, end_count) = self._samples[0], self._samples[-1]
+        if end <= start:
+            return None
+        return (end_count - start_count) / (end - start)
+
+    def average(self):
+        '''
+        Count per second since the first sample, None until there are two samples
+        '''
+        if self._first is None or len(self._samples) == 0:
+            return None
+        (start, start_count), (end, end_count) = self._first, self._samples[-1]
+        if end <= start:
+            return None
+        return (end_count - start_count) / (end - start)
+
+    def elapsed(self, now=None):
+        if self._start is None:
+            return 0.0
+        return (time.monotonic() if now is None else now) - self._start
+
+    def eta(self):
+        '''
+        Seconds left at the current rate, None if the total or the rate is unknown
+        '''
+        rate = self.rate()
+        if self._total is None or rate is None or rate <= 0:
+            return None
+        return max(0, self._total - self.count()) / rate
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
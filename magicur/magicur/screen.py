@@ -3,39 +3,153 @@ Created on 12 Sep 2019
 
 @author: mlinhard
 '''
+import curses
+
 from magicur.palette import Palette
 
 
+class CellBuffer(object):
+    '''
+    Characters and color pair keys of the screen cells. Rows changed since the last flush are kept in dirty,
+    so a frame compares only those rows with the front buffer.
+    '''
+
+    def __init__(self, width, height, char=" ", color_pair_key="default"):
+        self.width = width
+        self.height = height
+        self.chars = [[char] * width for _ in range(height)]
+        self.colors = [[color_pair_key] * width for _ in range(height)]
+        self.dirty = set(range(height))
+
+    def put(self, x, y, text, color_pair_key):
+        '''
+        Writes the text to the row y, clipped at the right edge, returns the number of written cells
+        '''
+        if y < 0 or y >= self.height or x >= self.width:
+            return 0
+        text = text[:self.width - x]
+        self.chars[y][x:x + len(text)] = text
+        self.colors[y][x:x + len(text)] = [color_pair_key] * len(text)
+        self.dirty.add(y)
+        return len(text)
+
+    def fill(self, x, y, width, height, char, color_pair_key):
+        for row in range(max(0, y), min(y + height, self.height)):
+            self.put(x, row, char * width, color_pair_key)
+
+    def paint(self, x, y, length, color_pair_key):
+        if 0 <= y < self.height:
+            length = max(0, min(length, self.width - x))
+            self.colors[y][x:x + length] = [color_pair_key] * length
+            self.dirty.add(y)
+
+    def scroll(self, x, y, width, height, lines, char, color_pair_key):
+        '''
+        Moves the contents of the region up by lines (down if negative), exposed lines are filled with char.
+        A moved row is dirty only if its source row was, the caller marks the region dirty unless the
+        front buffer is moved the same way.
+        '''
+        dirty = set(self.dirty)
+        rows = range(y, y + height) if lines > 0 else range(y + height - 1, y - 1, -1)
+        for row in rows:
+            source = row + lines
+            if y <= source < y + height:
+                self.chars[row][x:x + width] = self.chars[source][x:x + width]
+                self.colors[row][x:x + width] = self.colors[source][x:x + width]
+                if source in dirty:
+                    self.dirty.add(row)
+            else:
+                self.put(x, row, char * width, color_pair_key)
+
+    def changes(self, front):
+        '''
+        Runs of cells of the dirty rows that differ from the front buffer, as (x, y, text, color_pair_key).
+        Each run has a single color pair. With front None all cells are returned.
+        '''
+        for y in sorted(self.dirty):
+            chars, colors = self.chars[y], self.colors[y]
+            if front is None:
+                front_chars, front_colors = None, None
+            else:
+                front_chars, front_colors = front.chars[y], front.colors[y]
+                if chars == front_chars and colors == front_colors:
+                    continue
+            x = 0
+            while x < self.width:
+                if front_chars is not None and chars[x] == front_chars[x] and colors[x] == front_colors[x]:
+                    x += 1
+                    continue
+                start = x
+                color_pair_key = colors[x]
+                x += 1
+                while x < self.width and colors[x] == color_pair_key and \
+                        (front_chars is None or chars[x] != front_chars[x] or colors[x] != front_colors[x]):
+                    x += 1
+                yield start, y, "".join(chars[start:x]), color_pair_key
+
+    def copy_rows_to(self, front):
+        for y in self.dirty:
+            front.chars[y] = list(self.chars[y])
+            front.colors[y] = list(self.colors[y])
+        self.dirty = set()
+
+    def copy(self):
+        buffer = CellBuffer(self.width, self.height)
+        buffer.chars = [list(row) for row in self.chars]
+        buffer.colors = [list(row) for row in self.colors]
+        buffer.dirty = set()
+        self.dirty = set()
+        return buffer
+
+
 class MagicWindow(object):
+    '''
+    Rectangle of the screen's back buffer. Drawing only changes the buffer, the screen
+    writes the changed cells to the terminal once per frame. The position is in screen coordinates.
+    '''
 
-    def __init__(self, parent, window, log, app):
+    def __init__(self, parent, screen, x, y, width, height, log, app):
         self._parent = parent
-        self._window = window
+        self._screen = screen
+        self._x, self._y = x, y
+        self._width, self._height = width, height
+        self._color_pair_key = "default"
         self._log = log
         self._app = app
 
     def put_text(self, x, y, text):
-        try:
-            self._window.addstr(y, x, text)
-        except:
-            self._log.debug("addstr thrown")
+        # like curses addstr the text continues on the next line
+        while len(text) > 0:
+            if x >= self._width or y >= self._height:
+                self._log.debug("put_text outside of window")
+                return
+            written = self._screen.back.put(self._x + x, self._y + y, text[:self._width - x], self._color_pair_key)
+            if written == 0:
+                return
+            text = text[self._width - x:]
+            x, y = 0, y + 1
 
     def set_paint(self, x, y, length, color_pair_key):
-        self._window.chgat(y, x, length, self._app._palette.color_pair(color_pair_key))
+        self._screen.back.paint(self._x + x, self._y + y, min(length, self._width - x), color_pair_key)
 
     def reset_to(self, char, color_pair_key):
-        self._window.bkgd(char, Palette.instance().color_pair(color_pair_key))
-        self._window.erase()
+        self._color_pair_key = color_pair_key
+        self._screen.back.fill(self._x, self._y, self._width, self._height, char, color_pair_key)
+
+    def scroll_lines(self, lines):
+        '''
+        Moves the contents up by lines (down if negative), the exposed lines are blank
+        '''
+        self._screen.scroll(self._x, self._y, self._width, self._height, lines, " ", self._color_pair_key)
 
     def sub_window(self, width, height, x, y):
-        return MagicWindow(self, self._window.subwin(height, width, y, x), self._log, self._app)
+        return MagicWindow(self, self._screen, x, y, width, height, self._log, self._app)
 
     def refresh(self):
-        self._window.refresh()
+        self._screen.request_update()
 
     def size(self):
-        height, width = self._window.getmaxyx()
-        return width, height
+        return self._width, self._height
 
     @property
     def width(self):
@@ -47,15 +161,76 @@ class MagicWindow(object):
 
 
 class MagicScreen(object):
+    '''
+    Screen with a back buffer that the windows draw to and a front buffer of what the terminal shows.
+    update() writes only the cells that differ and calls doupdate once.
+    '''
 
     def __init__(self, stdscr, log, app):
         self._stdscr = stdscr
         self._log = log
         self._app = app
         self._children = []
+        self._update_requested = False
+        # lets curses move the scrolled lines with the terminal's insert/delete line
+        self._stdscr.idlok(True)
+        self.resize()
+
+    def resize(self):
+        '''
+        Reallocates the buffers to the terminal size, the next update repaints every cell
+        '''
+        width, height = self.size()
+        self.back = CellBuffer(width, height)
+        self._front = None
 
     def clear(self):
-        self._win.reset_to(" ", "black lightgray")
+        self.back.fill(0, 0, self.back.width, self.back.height, " ", "black lightgray")
+
+    def scroll(self, x, y, width, height, lines, char, color_pair_key):
+        '''
+        Scrolls the region of the back buffer. Full width lines are scrolled on the terminal and in the front
+        buffer as well, so the next update writes only the exposed lines.
+        '''
+        self.back.scroll(x, y, width, height, lines, char, color_pair_key)
+        if self._front is None:
+            return
+        if x != 0 or width != self.back.width or abs(lines) >= height:
+            self.back.dirty.update(range(y, y + height))
+            return
+        self._stdscr.setscrreg(y, y + height - 1)
+        self._stdscr.scrollok(True)
+        self._stdscr.scroll(lines)
+        self._stdscr.scrollok(False)
+        self._stdscr.setscrreg(0, self.back.height - 1)
+        self._front.scroll(x, y, width, height, lines, char, color_pair_key)
+        # the terminal blanks the exposed lines with its own attributes, they are always rewritten
+        exposed = range(y + height - lines, y + height) if lines > 0 else range(y, y - lines)
+        for row in exposed:
+            self._front.chars[row] = [None] * width
+        self._front.dirty = set()
+
+    def request_update(self):
+        self._update_requested = True
+
+    def update_requested(self):
+        return self._update_requested
+
+    def update(self):
+        palette = Palette.instance()
+        for x, y, text, color_pair_key in self.back.changes(self._front):
+            try:
+                self._stdscr.addstr(y, x, text, palette.color_pair(color_pair_key))
+            except curses.error:
+                # writing the bottom right cell moves the cursor out of the screen
+                pass
+        if self._front is None:
+            self._front = self.back.copy()
+        else:
+            self.back.copy_rows_to(self._front)
+        self._stdscr.noutrefresh()
+        curses.doupdate()
+        self._update_requested = False
 
     def getch(self):
         return self._stdscr.getch()
@@ -79,7 +254,4 @@ class MagicScreen(object):
         return Palette.instance()
 
     def sub_window(self, width, height, x, y):
-        return MagicWindow(self, self._stdscr.subwin(height, width, y, x), self._log, self._app)
-
-    def pad(self, width, height, x, y):
-        return MagicWindow(self, self._stdscr.newpad(height, width, y, x), self._log, self._app)
+        return MagicWindow(self, self, x, y, width, height, self._log, self._app)